@@ -1,13 +1,154 @@
 from __future__ import annotations
 
+import hmac
 import time
 
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+import config
+from core import admission, cluster, drain, metrics, snapshot, watchdog
+from core.outbound import encode_json
 
 router = APIRouter()
 
 
 @router.get("/health")
-def health():
-    return JSONResponse({"ok": True, "ts": int(time.time())})
+async def health():
+    """Liveness: the process and its event loop answer."""
+
+    return JSONResponse({"ok": True, "ts": int(time.time()), "draining": drain.draining()})
+
+
+@router.get("/ready")
+async def ready():
+    """Readiness and load for load balancers: 503 while new connections would be refused."""
+
+    load = admission.load()
+    return JSONResponse(load, status_code=200 if load["ready"] else 503)
+
+
+@router.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/locate")
+async def locate(room: str):
+    """Which node a client should connect to for `room`."""
+
+    room = room.strip()
+    if not room:
+        return JSONResponse({"error": "room required"}, status_code=400)
+    if not cluster.enabled():
+        return JSONResponse({"room": room, "node": config.NODE_ID, "url": None, "local": True})
+    node_id, url = cluster.RING.locate(room)
+    return JSONResponse({"room": room, "node": node_id, "url": url, "local": node_id == config.NODE_ID})
+
+
+def _admin_denied(request: Request):
+    """Error response unless the request carries `Authorization: Bearer <ADMIN_TOKEN>`."""
+
+    if not config.ADMIN_TOKEN:
+        return JSONResponse({"error": "admin endpoints disabled"}, status_code=404)
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip(), config.ADMIN_TOKEN):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return None
+
+
+@router.post("/admin/drain")
+async def admin_drain(request: Request):
+    """Ask every client to reconnect in staggered batches, ahead of a restart."""
+
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    return JSONResponse({"draining": True, "peers": drain.drain()})
+
+
+@router.get("/admin/rooms")
+async def admin_rooms(request: Request, prefix: str = "", after: str = "", limit: int = config.ADMIN_PAGE_SIZE):
+    """Rooms from the state snapshot, by id; pass `next` back as `after` for the next page."""
+
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    if not 0 < limit <= config.ADMIN_PAGE_MAX:
+        return JSONResponse({"error": f"limit must be in (0, {config.ADMIN_PAGE_MAX}]"}, status_code=400)
+    snap = snapshot.current()
+    page, cursor, total = snap.room_page(prefix, after, limit)
+    return JSONResponse(
+        {
+            "version": snap.version,
+            "ts": snap.ts,
+            "total": total,
+            "rooms": [{"room": r.room, "size": r.size, "changed": r.changed} for r in page],
+            "next": cursor,
+        }
+    )
+
+
+@router.get("/admin/rooms/{room:path}")
+async def admin_room(request: Request, room: str):
+    """One room from the state snapshot, with its members."""
+
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    snap = snapshot.current()
+    view = snap.rooms.get(room)
+    if view is None:
+        return JSONResponse({"error": "room not found", "version": snap.version}, status_code=404)
+    # The member list is already JSON (the room's roster text).
+    head = encode_json({"version": snap.version, "ts": snap.ts, "room": view.room, "size": view.size, "changed": view.changed})
+    return Response(f'{head[:-1]},"members":{view.members}}}', media_type="application/json")
+
+
+@router.get("/admin/peers/{peer_id}")
+async def admin_peer(request: Request, peer_id: str):
+    """A peer connected to this process, from the state snapshot."""
+
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    snap = snapshot.current()
+    view = snap.peers.get(peer_id)
+    if view is None:
+        return JSONResponse({"error": "peer not found", "version": snap.version}, status_code=404)
+    return JSONResponse({"version": snap.version, "ts": snap.ts, **view._asdict()})
+
+
+@router.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 5.0):
+    """Sample the event loop for `seconds`; collapsed stacks for flamegraph.pl / speedscope."""
+
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    if not 0 < seconds <= config.PROFILE_MAX_SEC:
+        return JSONResponse({"error": f"seconds must be in (0, {config.PROFILE_MAX_SEC}]"}, status_code=400)
+    collapsed = await watchdog.profile(seconds, config.PROFILE_INTERVAL_MS / 1000.0)
+    if collapsed is None:
+        return JSONResponse({"error": "a profile is already running"}, status_code=409)
+    return PlainTextResponse(collapsed)
+
+
+@router.get("/debug/tasks")
+async def debug_tasks(request: Request):
+    """Live asyncio tasks grouped by coroutine, with where they wait."""
+
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    return JSONResponse(watchdog.task_summary())
+
+
+@router.get("/debug/stalls")
+async def debug_stalls(request: Request):
+    """The most recent event loop stalls with the stack that was running."""
+
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    return JSONResponse({"stall_ms": config.LOOP_STALL_MS, "stalls": list(watchdog.MONITOR.stalls)})
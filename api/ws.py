@@ -1,23 +1,36 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import time
+from typing import Any, Dict, List, Optional, Tuple
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
 import config
+from core import admission, capture, cluster, drain, heartbeat, history, metrics
+from core.codec import JSON, negotiate
+from core.limits import CLOSE, THROTTLE, PeerLimits, message_class
 from core.models import Peer, new_peer_id
+from core.outbound import Frame, encode_json
+from core.relay import fast_relay_target, from_suffix, scan_envelope, splice_from
+from core.roster import RosterPage
 from core.state import (
     PEERS,
+    RESUME_TOKENS,
     ROOMS,
-    STATE_LOCK,
     broadcast_room,
+    deliver,
+    detach_peer,
+    issue_resume_token,
+    join_room,
+    leave_room,
+    register_peer,
     remove_peer,
+    resume_peer,
+    roster_page,
     send_to_peer,
     validate_message,
-    ws_send,
 )
 
 router = APIRouter()
@@ -25,80 +38,243 @@ router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
+# Optional protocol features a client can turn on with `caps` (in `join` or as
+# the `caps` query parameter); the welcome message lists them.
+CAPS = ("batch",)
+
+
+def _enable_caps(peer: Peer, requested: Any) -> List[str]:
+    """Turn on the requested capabilities this server supports; returns those enabled."""
+
+    if isinstance(requested, str):
+        requested = requested.split(",")
+    if not isinstance(requested, list):
+        return []
+    enabled = [c for c in CAPS if c in requested]
+    if "batch" in enabled:
+        peer.outbox.batching = True
+    return enabled
+
+
+def _roster_frame(
+    mtype: str,
+    room: str,
+    page: RosterPage,
+    caps: Optional[List[str]] = None,
+    replay: Optional[Tuple[int, str, bool]] = None,
+) -> Frame:
+    """`joined`/`roster` message around an already serialized roster page (and broadcast history)."""
+
+    parts = ['{"type":', encode_json(mtype), ',"room":', encode_json(room), ',"peers":', page.text]
+    if page.cursor is not None:
+        parts.append(f',"cursor":{page.cursor}')
+    parts.append(f',"total":{page.total}')
+    if caps is not None:
+        parts.append(',"caps":' + encode_json(caps))
+    if replay is not None:
+        seq, texts, truncated = replay
+        parts.append(f',"seq":{seq},"history":{texts}')
+        if truncated:
+            parts.append(',"truncated":true')
+    parts.append("}")
+    return Frame(text="".join(parts), mtype=mtype)
+
+
+def _encodable(frame: Frame, to_peer: str) -> bool:
+    """Whether a frame from a binary-codec sender can be encoded for `to_peer`.
+
+    Binary values (say an SDP sent as bytes) have no JSON form, so only a local
+    peer on a binary codec can take them; peers elsewhere (or unknown) get JSON
+    text over the bus.
+    """
+
+    target = PEERS.get(to_peer)
+    try:
+        frame.encoded(target.codec if target is not None else JSON)
+    except Exception:
+        return False
+    return True
 
-async def heartbeat_loop(peer_id: str) -> None:
-    """Periodically ping the client and timeout idle connections."""
 
-    while True:
-        await asyncio.sleep(config.PING_INTERVAL_SEC)
+def _rate_limited(limits: PeerLimits, cls: str) -> Dict[str, Any]:
+    return {"type": "error", "error": "rate-limited", "class": cls, "retry_ms": int(limits.retry_after(cls) * 1000)}
 
-        async with STATE_LOCK:
-            peer = PEERS.get(peer_id)
-            if not peer:
-                return
-            ws = peer.ws
-            last_seen = peer.last_seen
 
-        if time.time() - last_seen > config.PING_TIMEOUT_SEC:
-            logger.info("peer timeout peer_id=%s", peer_id)
-            try:
-                await ws.close(code=1001)
-            except Exception:
-                pass
-            async with STATE_LOCK:
-                await remove_peer(peer_id, reason="timeout")
-            return
+async def _reject(peer: Peer, limits: PeerLimits, now: float, error: Dict[str, Any]) -> bool:
+    """Apply the escalating penalty for a rejected frame; True once the peer is closed."""
 
-        try:
-            await ws_send(ws, {"type": "ping", "ts": int(time.time())})
-        except Exception:
-            logger.info("peer ping send failed peer_id=%s", peer_id)
-            async with STATE_LOCK:
-                await remove_peer(peer_id, reason="send-failed")
-            return
+    penalty = limits.strike(now)
+    if penalty == CLOSE:
+        logger.warning("peer closed for abuse peer_id=%s error=%s", peer.peer_id, error["error"])
+        peer.outbox.close(config.RATE_CLOSE_CODE, error["error"])
+        return True
+    if penalty == THROTTLE:
+        # Stop reading from this peer for a while; no reply, it is not listening.
+        logger.info("peer throttled peer_id=%s error=%s", peer.peer_id, error["error"])
+        await asyncio.sleep(config.RATE_THROTTLE_SEC)
+        return False
+    peer.outbox.put(error)
+    return False
 
 
 @router.websocket("/ws")
 async def ws_endpoint(ws: WebSocket):
-    await ws.accept()
-
-    logger.info("ws connected client=%s", getattr(ws, "client", None))
-
-    peer_id = new_peer_id()
-    peer = Peer(peer_id=peer_id, ws=ws)
+    codec, subprotocol = negotiate(ws.scope.get("subprotocols") or [])
+    await ws.accept(subprotocol=subprotocol)
 
-    async with STATE_LOCK:
-        PEERS[peer_id] = peer
+    logger.info("ws connected client=%s codec=%s", getattr(ws, "client", None), codec.name)
 
-    logger.info("ws assigned peer_id=%s", peer_id)
-
-    await ws_send(ws, {"type": "welcome", "peer_id": peer_id})
+    if drain.draining():
+        # Going away: send the client on (its session, if any, stays resumable).
+        notice = Frame({"type": "reconnect", "after_ms": drain.reconnect_delay_ms(len(PEERS))})
+        try:
+            await (ws.send_bytes if codec.binary else ws.send_text)(notice.encoded(codec))
+            await ws.close(code=config.DRAIN_CLOSE_CODE, reason="drain")
+        except Exception:
+            pass
+        return
 
-    hb_task = asyncio.create_task(heartbeat_loop(peer_id))
+    token = ws.query_params.get("resume", "")
+    refusal = admission.refuse_connection(resuming=bool(token) and token in RESUME_TOKENS)
+    if refusal:
+        logger.info("ws refused reason=%s", refusal)
+        try:
+            await ws.close(code=config.OVERLOAD_CLOSE_CODE, reason=refusal)
+        except Exception:
+            pass
+        return
+
+    peer = resume_peer(token) if token and config.RESUME_GRACE_SEC > 0 else None
+    resumed = peer is not None
+    if peer is not None:
+        # Same peer_id, room and name; nothing is announced to the room.
+        peer_id = peer.peer_id
+        old_ws = peer.ws
+        peer.ws = ws
+        peer.codec = codec
+        peer.last_seen = time.time()
+        await peer.outbox.detach()
+        _enable_caps(peer, ws.query_params.get("caps", ""))
+        welcome = {"type": "welcome", "peer_id": peer_id, "caps": list(CAPS), "resumed": True}
+        welcome.update(resume=issue_resume_token(peer), room=peer.room, name=peer.name)
+        peer.outbox.attach(ws, codec, Frame(welcome))
+        metrics.RESUMED.inc()
+        logger.info("ws resumed peer_id=%s queued=%s", peer_id, peer.outbox.depth - 1)
+        if old_ws is not None:
+            try:
+                # A connection we had not noticed was dead yet.
+                await old_ws.close(code=4000, reason="resumed")
+            except Exception:
+                pass
+    else:
+        peer_id = new_peer_id()
+        peer = Peer(peer_id=peer_id, ws=ws, codec=codec)
+
+        register_peer(peer)
+
+        logger.info("ws assigned peer_id=%s", peer_id)
+
+        peer.outbox.start()
+        _enable_caps(peer, ws.query_params.get("caps", ""))
+        welcome = {"type": "welcome", "peer_id": peer_id, "caps": list(CAPS), "resume": issue_resume_token(peer)}
+        if token:
+            welcome["resumed"] = False
+        peer.outbox.put(welcome)
+
+        heartbeat.watch(peer_id)
+
+    # All writes to this socket go through the peer's outbound queue.
+    reply = peer.outbox.put
+    relay_suffix = from_suffix(peer_id)
+    limits = PeerLimits(time.perf_counter())
+    max_frame = config.MAX_FRAME_BYTES
+    resumable = False
+    close_code = 0
+    # Traffic capture (off unless VC_SERVER_CAPTURE is set).
+    cap = capture.CAPTURE
+    handle = cap.opened(peer_id, codec.name, resumed) if cap is not None else 0
 
     try:
         while True:
-            raw = await ws.receive_text()
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+            raw = message.get("text")
+            data = raw if raw is not None else message.get("bytes") or b""
             now = time.time()
+            received = time.perf_counter()
+
+            # Checked before any decoding work is spent on the frame.
+            if len(data) > max_frame:
+                if cap is not None:
+                    cap.oversize(handle, received, data)
+                logger.warning("ws frame too large peer_id=%s size=%s", peer_id, len(data))
+                metrics.REJECTED.inc("oversize")
+                if await _reject(peer, limits, received, {"type": "error", "error": "frame-too-large", "max": max_frame}):
+                    break
+                continue
+            if cap is not None:
+                cap.frame(handle, received, data)
+            if not limits.allow("global", received):
+                if await _reject(peer, limits, received, _rate_limited(limits, "global")):
+                    break
+                continue
+
+            # Fast path: JSON offer/answer/ice are forwarded without building a dict.
+            if raw is not None and '"to"' in raw:
+                try:
+                    env = scan_envelope(raw)
+                except ValueError:
+                    logger.warning("ws invalid json peer_id=%s", peer_id)
+                    metrics.MESSAGES.inc("invalid")
+                    reply({"type": "error", "error": "invalid-json"})
+                    continue
+                to_peer = fast_relay_target(env)
+                if to_peer is not None:
+                    if not limits.allow("relay", received):
+                        if await _reject(peer, limits, received, _rate_limited(limits, "relay")):
+                            break
+                        continue
+                    peer.last_seen = now
+                    mtype = env.mtype
+                    metrics.MESSAGES.inc(mtype)
+                    if mtype == "ice":
+                        logger.debug("relay ice from=%s to=%s", peer_id, to_peer)
+                    else:
+                        logger.info("relay %s from=%s to=%s size=%s", mtype, peer_id, to_peer, len(raw))
+                    frame = splice_from(raw, env, relay_suffix)
+                    frame.born = received
+                    if not send_to_peer(to_peer, frame):
+                        logger.info("relay failed from=%s to=%s type=%s", peer_id, to_peer, mtype)
+                        metrics.RELAY_NOT_FOUND.inc()
+                        reply({"type": "error", "error": "peer-not-found", "to": to_peer})
+                    continue
 
             try:
-                msg = json.loads(raw)
-            except json.JSONDecodeError:
-                logger.warning("ws invalid json peer_id=%s", peer_id)
-                await ws_send(ws, {"type": "error", "error": "invalid-json"})
+                msg = codec.decode(data)
+            except Exception:
+                logger.warning("ws invalid frame peer_id=%s codec=%s", peer_id, codec.name)
+                metrics.MESSAGES.inc("invalid")
+                reply({"type": "error", "error": codec.error})
                 continue
 
             err = validate_message(msg)
             if err:
                 logger.warning("ws invalid message peer_id=%s error=%s", peer_id, err)
-                await ws_send(ws, {"type": "error", "error": err})
+                metrics.MESSAGES.inc("invalid")
+                reply({"type": "error", "error": err})
                 continue
 
-            async with STATE_LOCK:
-                if peer_id in PEERS:
-                    PEERS[peer_id].last_seen = now
+            # Plain attribute write: no lock needed on the hot path.
+            peer.last_seen = now
 
             mtype = msg["type"]
+            cls = message_class(mtype, "to" in msg)
+            if cls is not None and not limits.allow(cls, received):
+                if await _reject(peer, limits, received, _rate_limited(limits, cls)):
+                    break
+                continue
+            metrics.MESSAGES.inc(mtype)
 
             if mtype not in ("ping", "pong"):
                 logger.debug("ws recv peer_id=%s type=%s", peer_id, mtype)
@@ -110,83 +286,68 @@ async def ws_endpoint(ws: WebSocket):
                 room = str(msg.get("room", "")).strip()
                 name = str(msg.get("name", "")).strip()
                 if not room:
-                    await ws_send(ws, {"type": "error", "error": "join requires room"})
+                    reply({"type": "error", "error": "join requires room"})
+                    continue
+                refusal = admission.refuse_join(room, peer.room)
+                if refusal:
+                    reply({"type": "error", "error": "room-full" if refusal == "room-size" else "too-many-rooms", "room": room})
                     continue
+                since = msg.get("since")
+                if since is not None:
+                    try:
+                        since = int(since)
+                    except (TypeError, ValueError):
+                        reply({"type": "error", "error": "invalid since"})
+                        continue
+                caps = _enable_caps(peer, msg["caps"]) if "caps" in msg else None
+
+                # Rooms are placed on nodes by consistent hashing; send clients
+                # on the wrong node to the owner (unless they insist).
+                target = cluster.misplaced(room)
+                if target and not msg.get("force"):
+                    logger.info("join redirect peer_id=%s room=%s node=%s", peer_id, room, target[0])
+                    reply({"type": "redirect", "room": room, "node": target[0], "url": target[1]})
+                    continue
+
+                roster, notices = await join_room(peer_id, room, name)
+                if roster is None:
+                    break
 
-                async with STATE_LOCK:
-                    p = PEERS.get(peer_id)
-                    if not p:
-                        break
-
-                    if p.room and p.room != room:
-                        old_room = p.room
-                        if old_room in ROOMS and peer_id in ROOMS[old_room]:
-                            ROOMS[old_room].remove(peer_id)
-                            if not ROOMS[old_room]:
-                                ROOMS.pop(old_room, None)
-                        await broadcast_room(
-                            old_room,
-                            {"type": "peer-left", "peer_id": peer_id, "reason": "switched-room"},
-                            exclude=peer_id,
-                        )
-
-                    p.room = room
-                    p.name = name
-
-                    ROOMS.setdefault(room, set()).add(peer_id)
-
-                    logger.info(
-                        "peer joined peer_id=%s room=%s name_set=%s members=%s",
-                        peer_id,
-                        room,
-                        bool(name),
-                        len(ROOMS.get(room, set())),
-                    )
-
-                    roster = []
-                    for pid in ROOMS.get(room, set()):
-                        if pid == peer_id:
-                            continue
-                        other = PEERS.get(pid)
-                        if other:
-                            roster.append({"peer_id": pid, "name": other.name})
-
-                await ws_send(ws, {"type": "joined", "room": room, "peers": roster})
-
-                await broadcast_room(
-                    room,
-                    {"type": "peer-joined", "peer": {"peer_id": peer_id, "name": name}},
-                    exclude=peer_id,
-                )
+                replay = history.replay(room, since) if history.enabled() else None
+                reply(_roster_frame("joined", room, roster, caps, replay))
+                deliver(notices)
                 continue
 
             if mtype == "leave":
-                async with STATE_LOCK:
-                    p = PEERS.get(peer_id)
-                    if not p:
-                        break
-                    room = p.room
-                    p.room = ""
-                    if room and room in ROOMS and peer_id in ROOMS[room]:
-                        ROOMS[room].remove(peer_id)
-                        if not ROOMS[room]:
-                            ROOMS.pop(room, None)
+                room, notices = await leave_room(peer_id)
+                if room is None:
+                    break
 
                 if room:
                     logger.info("peer left peer_id=%s room=%s", peer_id, room)
-                    await ws_send(ws, {"type": "left", "room": room})
-                    await broadcast_room(
-                        room,
-                        {"type": "peer-left", "peer_id": peer_id, "reason": "left"},
-                        exclude=peer_id,
-                    )
+                    reply({"type": "left", "room": room})
+                    deliver(notices)
+                continue
+
+            if mtype == "roster":
+                # Next page of a large room's roster.
+                room = peer.room
+                if not room or str(msg.get("room", room)) != room:
+                    reply({"type": "error", "error": "not-in-room"})
+                    continue
+                try:
+                    after = int(msg.get("cursor", 0))
+                except (TypeError, ValueError):
+                    reply({"type": "error", "error": "invalid cursor"})
+                    continue
+                reply(_roster_frame("roster", room, roster_page(room, after, exclude=peer_id)))
                 continue
 
             # Relay messages peer-to-peer
             if "to" in msg:
                 to_peer = str(msg.get("to", "")).strip()
                 if not to_peer:
-                    await ws_send(ws, {"type": "error", "error": 'invalid "to"'})
+                    reply({"type": "error", "error": 'invalid "to"'})
                     continue
 
                 relay = dict(msg)
@@ -200,45 +361,82 @@ async def ws_endpoint(ws: WebSocket):
                 else:
                     logger.debug("relay type=%s from=%s to=%s", mtype, peer_id, to_peer)
 
-                ok = await send_to_peer(to_peer, relay)
-                if not ok:
+                frame = Frame(relay)
+                frame.born = received
+                if codec.binary and not _encodable(frame, to_peer):
+                    logger.info("relay not encodable from=%s to=%s type=%s", peer_id, to_peer, mtype)
+                    reply({"type": "error", "error": "not-encodable", "to": to_peer})
+                    continue
+                if not send_to_peer(to_peer, frame):
                     logger.info("relay failed from=%s to=%s type=%s", peer_id, to_peer, mtype)
-                    await ws_send(ws, {"type": "error", "error": "peer-not-found", "to": to_peer})
+                    metrics.RELAY_NOT_FOUND.inc()
+                    reply({"type": "error", "error": "peer-not-found", "to": to_peer})
                 continue
 
             # Broadcast to room
             if mtype == "broadcast":
-                async with STATE_LOCK:
-                    p = PEERS.get(peer_id)
-                    room = p.room if p else ""
+                room = peer.room
                 if not room:
-                    await ws_send(ws, {"type": "error", "error": "not-in-room"})
+                    reply({"type": "error", "error": "not-in-room"})
                     continue
 
-                async with STATE_LOCK:
-                    recipients = len(ROOMS.get(room, set()))
+                recipients = len(ROOMS.get(room, ()))
 
                 logger.info("broadcast from=%s room=%s recipients=%s", peer_id, room, recipients)
 
                 relay = dict(msg)
                 relay["from"] = peer_id
-                await broadcast_room(room, relay, exclude=None)
+                if codec.binary and not _encodable(Frame(relay), ""):
+                    # History, the bus and JSON members all need the JSON text.
+                    reply({"type": "error", "error": "not-encodable", "room": room})
+                    continue
+                if history.enabled():
+                    broadcast_room(room, history.record(room, relay), exclude=None)
+                else:
+                    # Like `from`, `seq` is ours to set; without history there is none.
+                    relay.pop("seq", None)
+                    broadcast_room(room, relay, exclude=None)
                 continue
 
-            await ws_send(ws, {"type": "error", "error": f"unknown type: {mtype}"})
+            reply({"type": "error", "error": f"unknown type: {mtype}"})
 
-    except WebSocketDisconnect:
+    except WebSocketDisconnect as exc:
 
-        logger.info("ws disconnect peer_id=%s", peer_id)
-        pass
+        logger.info("ws disconnect peer_id=%s code=%s", peer_id, exc.code)
+        # 1000/1001: the client closed on purpose; anything else may come back.
+        resumable = exc.code not in (1000, 1001)
+        close_code = exc.code
     except Exception:
 
         logger.exception("ws endpoint error peer_id=%s", peer_id)
     finally:
-        hb_task.cancel()
-        async with STATE_LOCK:
-            await remove_peer(peer_id, reason="disconnect")
-        logger.info("ws cleaned up peer_id=%s", peer_id)
+        if cap is not None:
+            cap.closed(handle, close_code)
+        if peer.ws is not ws:
+            # Taken over by a resumed connection, which owns the peer now.
+            logger.info("ws replaced peer_id=%s", peer_id)
+        elif (resumable or drain.draining()) and detach_peer(peer, config.RESUME_GRACE_SEC):
+            await peer.outbox.detach()
+            logger.info("ws detached peer_id=%s grace=%s", peer_id, config.RESUME_GRACE_SEC)
+        else:
+            await _close_peer(peer, ws)
+
+
+async def _close_peer(peer: Peer, ws: WebSocket) -> None:
+    await remove_peer(peer.peer_id, reason="disconnect")
+    await peer.outbox.stop()
+    stats = peer.outbox.stats()
+    logger.info(
+        "ws cleaned up peer_id=%s sent=%s frames=%s dropped=%s coalesced=%s max_depth=%s",
+        peer.peer_id,
+        stats["sent"],
+        stats["frames"],
+        stats["dropped"],
+        stats["coalesced"],
+        stats["max_depth"],
+    )
+    if not peer.outbox.close_reason:
+        # Otherwise the outbox is already closing the socket with its own code.
         try:
             await ws.close()
         except Exception:
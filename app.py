@@ -5,14 +5,43 @@ Public entrypoint for uvicorn: `server.app:app`.
 
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 
+import config
 from api.http import router as http_router
 from api.ws import router as ws_router
+from core import capture, heartbeat, journal, snapshot, state, watchdog
+from core.backend import create_backend
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    backend = create_backend(config.STATE_BACKEND)
+    state.use_backend(backend)
+    await backend.start()
+    watchdog.start()
+    heartbeat.start()
+    snapshot.start()
+    if config.STATE_DIR:
+        await journal.open_journal(config.STATE_DIR)
+    if config.CAPTURE_PATH:
+        await capture.open_capture(config.CAPTURE_PATH, config.CAPTURE_PAYLOADS)
+    try:
+        yield
+    finally:
+        await capture.close_capture()
+        await journal.close_journal()
+        await snapshot.stop()
+        await heartbeat.stop()
+        await backend.stop()
+        await watchdog.stop()
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Tiny Signaling Server")
+    app = FastAPI(title="Tiny Signaling Server", lifespan=lifespan)
     app.include_router(http_router)
     app.include_router(ws_router)
     return app
@@ -22,7 +51,7 @@ app = create_app()
 
 
 def main() -> None:
-    from .cli import run
+    from cli import run
 
     run(app)
 
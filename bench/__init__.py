@@ -0,0 +1,4 @@
+"""Benchmarks for the signaling server.
+
+Run from the repository root, e.g. `python -m bench.state_contention`.
+"""
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import asyncio
+from typing import List, Optional
+
+
+class FakeWebSocket:
+    """Minimal stand-in for `fastapi.WebSocket` used by in-process benchmarks.
+
+    `send_latency` simulates the time a real socket write takes to complete.
+    """
+
+    def __init__(self, send_latency: float = 0.0, keep: bool = False) -> None:
+        self.send_latency = send_latency
+        self.keep = keep
+        self.sent: List[str] = []
+        self.sent_count = 0
+        self.sent_bytes = 0
+        self.close_code: Optional[int] = None
+        self.close_reason = ""
+
+    async def send_text(self, data: str) -> None:
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sent_count += 1
+        self.sent_bytes += len(data)
+        if self.keep:
+            self.sent.append(data)
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        self.close_code = code
+        self.close_reason = reason
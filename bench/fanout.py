@@ -0,0 +1,172 @@
+"""In-process micro-benchmark of `broadcast_room` and `remove_peer`.
+
+Runs the real state layer and outbound queues against fake sockets, so a
+change to core/state.py or core/outbound.py can be measured without the
+network stack or a running server:
+
+- broadcast: CPU cost of one `broadcast_room` call (encode + enqueue) and
+  the time until every member's writer has sent it
+- remove: cost of `remove_peer` for a member of a full room (lock, state
+  update, peer-left fan-out)
+
+    python -m bench.fanout --room-size 1000 --rounds 200
+    python -m bench.fanout --save-baseline fanout.json
+    python -m bench.fanout --compare fanout.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+from bench import report
+from bench.fakews import FakeWebSocket
+from core import state
+from core.models import Peer
+
+
+class _CountingSocket(FakeWebSocket):
+    """Fake socket that reports to a shared counter when a send completes."""
+
+    def __init__(self, counter: "_Counter", send_latency: float = 0.0) -> None:
+        super().__init__(send_latency=send_latency)
+        self.counter = counter
+
+    async def send_text(self, data: str) -> None:
+        await super().send_text(data)
+        self.counter.hit()
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self.send_text(data.decode("utf-8"))
+
+
+class _Counter:
+    def __init__(self) -> None:
+        self.count = 0
+        self.target = 0
+        self.done = asyncio.Event()
+
+    def expect(self, n: int) -> None:
+        self.count = 0
+        self.target = n
+        self.done.clear()
+        if n <= 0:
+            self.done.set()
+
+    def hit(self) -> None:
+        self.count += 1
+        if self.count >= self.target:
+            self.done.set()
+
+
+def _fill_room(room: str, size: int, counter: _Counter, latency: float, prefix: str) -> List[Peer]:
+    # Membership is set up directly: join_room would build an O(n) roster per
+    # join, which is not what is being measured here.
+    peers = []
+    members = state.ROOMS.setdefault(room, set())
+    for i in range(size):
+        peer = Peer(peer_id=f"{prefix}{i}", ws=_CountingSocket(counter, latency), room=room, name=f"{prefix}{i}")
+        peer.outbox.maxsize = 1 << 20
+        state.register_peer(peer)
+        peer.outbox.start()
+        members.add(peer.peer_id)
+        peers.append(peer)
+    return peers
+
+
+async def _teardown(peers: List[Peer]) -> None:
+    for peer in peers:
+        await peer.outbox.stop()
+        await state.unregister_peer(peer.peer_id)
+    state.PEERS.clear()
+    state.ROOMS.clear()
+
+
+async def bench_broadcast(room_size: int, rounds: int, latency: float) -> Dict[str, float]:
+    counter = _Counter()
+    peers = _fill_room("bench", room_size, counter, latency, "b")
+    payload = {"type": "broadcast", "from": "b0", "data": {"text": "x" * 64}}
+
+    cpu = 0.0
+    wall: List[float] = []
+    for _ in range(rounds):
+        counter.expect(room_size)
+        c0 = time.process_time()
+        t0 = time.perf_counter()
+        state.broadcast_room("bench", dict(payload))
+        cpu += time.process_time() - c0
+        await counter.done.wait()
+        wall.append(time.perf_counter() - t0)
+
+    await _teardown(peers)
+    results = {
+        "broadcast_call_us": cpu / rounds * 1e6,
+        "broadcast_deliveries_per_sec": room_size * rounds / sum(wall),
+    }
+    results.update(report.latency_summary("broadcast_drain", wall))
+    return results
+
+
+async def bench_remove(room_size: int, rounds: int, latency: float) -> Dict[str, float]:
+    counter = _Counter()
+    peers = _fill_room("bench", room_size + rounds, counter, latency, "r")
+    leaving = peers[room_size:]
+
+    cpu = 0.0
+    wall: List[float] = []
+    for peer in leaving:
+        await peer.outbox.stop()
+        # Every remaining member (and the ones still waiting to leave) gets peer-left.
+        counter.expect(len(state.ROOMS["bench"]) - 1)
+        c0 = time.process_time()
+        t0 = time.perf_counter()
+        await state.remove_peer(peer.peer_id)
+        cpu += time.process_time() - c0
+        await counter.done.wait()
+        wall.append(time.perf_counter() - t0)
+
+    await _teardown(peers[:room_size])
+    results = {
+        "remove_call_us": cpu / rounds * 1e6,
+        "removes_per_sec": rounds / sum(wall),
+    }
+    results.update(report.latency_summary("remove_drain", wall))
+    return results
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, float]:
+    latency = args.latency_ms / 1000.0
+    results: Dict[str, float] = {}
+    results.update(await bench_broadcast(args.room_size, args.rounds, latency))
+    results.update(await bench_remove(args.room_size, args.rounds, latency))
+    return results
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--room-size", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200, help="broadcasts sent / peers removed")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated socket send latency")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    params = {"room_size": args.room_size, "rounds": args.rounds, "latency_ms": args.latency_ms}
+    print(" ".join(f"{k}={v}" for k, v in params.items()))
+    results = asyncio.run(_run(args))
+
+    if args.compare:
+        regressions = report.compare_baseline(args.compare, "fanout", params, results, args.threshold)
+    else:
+        report.print_results(results)
+        regressions = 0
+    if args.save_baseline:
+        report.save_baseline(args.save_baseline, "fanout", params, results)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,472 @@
+"""Load generator: thousands of real `/ws` clients against a running server.
+
+Phases run in order over the same connections:
+
+- connect: open `--clients` sockets and wait for every `welcome`
+- join: room-fill join storm (rooms of `--room-size`), until every
+  `joined` reply has arrived and presence traffic has settled
+- relay: pairs in each room exchange offer/answer and trickle ICE
+- broadcast: clients switch into rooms of `--broadcast-room-size` and one
+  member per room sends `--broadcasts` broadcasts
+- disconnect: close everything at once and wait for the server to drop
+  them (via `vc_connections` in /metrics)
+
+Reports connections/sec, messages/sec, p50/p99/p999 latency (measured from
+the sending client to the receiving client, both in this process), and the
+server's CPU and RSS per connection when its pid is known (Linux /proc).
+
+    python -m bench.loadgen --spawn --clients 2000
+    python -m bench.loadgen --url ws://127.0.0.1:8765/ws --server-pid 1234
+    python -m bench.loadgen --spawn --save-baseline load.json
+    python -m bench.loadgen --spawn --compare load.json
+
+The generator itself is a single asyncio process; at very high client
+counts check its own CPU before blaming the server.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import ConnectionClosed
+
+from bench import report
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PHASES = ("connect", "join", "relay", "broadcast", "disconnect")
+
+
+def _encode(payload: Dict[str, Any]) -> str:
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def _sdp(size: int) -> str:
+    line = "a=candidate:1 1 udp 2122260223 192.168.1.10 54321 typ host generation 0\r\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+class Tally:
+    """Message counters shared by all clients, with waits on a target count."""
+
+    def __init__(self) -> None:
+        self.counts: Dict[str, int] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self._waiters: List[Tuple[str, int, asyncio.Future]] = []
+        self.frames = 0
+        self.messages = 0
+
+    def hit(self, name: str, latency: Optional[float] = None) -> None:
+        n = self.counts.get(name, 0) + 1
+        self.counts[name] = n
+        if latency is not None:
+            self.latencies.setdefault(name, []).append(latency)
+        if self._waiters:
+            for waiter in list(self._waiters):
+                if waiter[0] == name and n >= waiter[1]:
+                    self._waiters.remove(waiter)
+                    if not waiter[2].done():
+                        waiter[2].set_result(None)
+
+    def reset(self, *names: str) -> None:
+        for name in names:
+            self.counts.pop(name, None)
+            self.latencies.pop(name, None)
+
+    async def settle(self, name: str, target: int, quiet: float, timeout: float) -> None:
+        """Wait for `target` hits or until none arrive for `quiet` seconds."""
+
+        deadline = time.monotonic() + timeout
+        last = -1
+        while time.monotonic() < deadline:
+            n = self.counts.get(name, 0)
+            if n >= target or n == last:
+                return
+            last = n
+            await asyncio.sleep(quiet)
+
+    async def until(self, name: str, target: int, timeout: float) -> bool:
+        if self.counts.get(name, 0) >= target:
+            return True
+        fut = asyncio.get_running_loop().create_future()
+        waiter = (name, target, fut)
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(fut, timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            print(f"  warning: timed out waiting for {name}: {self.counts.get(name, 0)}/{target}")
+            return False
+
+
+class Client:
+    """One signaling client; the reader task answers pings and feeds the tally."""
+
+    def __init__(self, ws: ClientConnection, tally: Tally) -> None:
+        self.ws = ws
+        self.tally = tally
+        self.peer_id = ""
+        self.welcome = asyncio.get_running_loop().create_future()
+        self.reader = asyncio.create_task(self._read())
+        self.sent_at: Dict[str, float] = {}
+
+    async def send(self, payload: Dict[str, Any]) -> None:
+        await self.ws.send(_encode(payload))
+
+    async def _read(self) -> None:
+        tally = self.tally
+        try:
+            async for raw in self.ws:
+                now = time.perf_counter()
+                tally.frames += 1
+                msg = json.loads(raw)
+                if msg.get("type") == "batch":
+                    for item in msg["messages"]:
+                        await self._handle(item, now)
+                else:
+                    await self._handle(msg, now)
+        except ConnectionClosed:
+            pass
+
+    async def _handle(self, msg: Dict[str, Any], now: float) -> None:
+        tally = self.tally
+        tally.messages += 1
+        mtype = msg.get("type")
+        if mtype == "ping":
+            await self.ws.send('{"type":"pong"}')
+        elif mtype == "welcome":
+            self.peer_id = msg["peer_id"]
+            if not self.welcome.done():
+                self.welcome.set_result(None)
+        elif mtype == "joined":
+            sent = self.sent_at.pop("join", None)
+            tally.hit("joined", None if sent is None else now - sent)
+        elif mtype == "presence-diff":
+            # Large rooms: one frame per tick; count the entries as events.
+            for peer in msg.get("joined", ()):
+                if peer.get("peer_id") != self.peer_id:
+                    tally.hit("peer-joined")
+            for _ in msg.get("left", ()):
+                tally.hit("peer-left")
+        elif mtype in ("offer", "answer", "ice", "broadcast"):
+            sent = msg.get("t")
+            tally.hit(mtype, None if sent is None else now - sent)
+            if mtype in ("offer", "answer", "ice"):
+                tally.hit("relay", None if sent is None else now - sent)
+        else:
+            tally.hit(mtype or "unknown")
+
+
+class ServerProbe:
+    """CPU time and RSS of the server process, read from /proc (Linux only)."""
+
+    def __init__(self, pid: Optional[int]) -> None:
+        self.pid = pid
+        self._tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def _children(self) -> List[int]:
+        # `--workers` runs the server in child processes of the given pid.
+        try:
+            with open(f"/proc/{self.pid}/task/{self.pid}/children", "r") as f:
+                return [int(p) for p in f.read().split()]
+        except OSError:
+            return []
+
+    def cpu(self) -> Optional[float]:
+        if self.pid is None:
+            return None
+        total = 0.0
+        for pid in [self.pid] + self._children():
+            try:
+                with open(f"/proc/{pid}/stat", "r") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            total += (int(fields[11]) + int(fields[12])) / self._tick
+        return total
+
+    def rss(self) -> Optional[int]:
+        if self.pid is None:
+            return None
+        total = 0
+        for pid in [self.pid] + self._children():
+            try:
+                with open(f"/proc/{pid}/status", "r") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+                            break
+            except OSError:
+                continue
+        return total
+
+
+class Phase:
+    """Wall clock and server CPU over one phase."""
+
+    def __init__(self, name: str, probe: ServerProbe, results: Dict[str, float]) -> None:
+        self.name = name
+        self.probe = probe
+        self.results = results
+
+    def __enter__(self) -> "Phase":
+        print(f"{self.name} ...", flush=True)
+        self.cpu0 = self.probe.cpu()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.elapsed = time.perf_counter() - self.t0
+        cpu1 = self.probe.cpu()
+        if self.cpu0 is not None and cpu1 is not None and self.elapsed > 0:
+            self.results[f"{self.name}_server_cpu_pct"] = (cpu1 - self.cpu0) / self.elapsed * 100.0
+
+
+def _metrics_url(ws_url: str) -> str:
+    scheme, rest = ws_url.split("://", 1)
+    host = rest.split("/", 1)[0]
+    return f"{'https' if scheme == 'wss' else 'http'}://{host}/metrics"
+
+
+def _server_connections(metrics_url: str) -> Optional[float]:
+    try:
+        with urllib.request.urlopen(metrics_url, timeout=5) as resp:
+            body = resp.read().decode("utf-8")
+    except Exception:
+        return None
+    for line in body.splitlines():
+        if line.startswith("vc_connections "):
+            return float(line.split()[1])
+    return None
+
+
+def _raise_fd_limit() -> None:
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _spawn_server(port: int) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.setdefault("VC_SERVER_LOG_LEVEL", "warning")
+    proc = subprocess.Popen(
+        [sys.executable, str(ROOT / "app.py"), "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=str(ROOT),
+        env=env,
+    )
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited with code {proc.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                return proc
+        except Exception:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("server did not become healthy")
+
+
+async def _connect_all(args: argparse.Namespace, tally: Tally) -> List[Client]:
+    slots = asyncio.Semaphore(args.connect_concurrency)
+    compression = None if args.no_compression else "deflate"
+
+    url = args.url
+    if args.batch:
+        url += ("&" if "?" in url else "?") + "caps=batch"
+
+    async def one() -> Client:
+        async with slots:
+            ws = await connect(
+                url,
+                compression=compression,
+                ping_interval=None,
+                open_timeout=args.timeout,
+                max_queue=None,
+            )
+            client = Client(ws, tally)
+            await client.welcome
+            return client
+
+    return list(await asyncio.gather(*(one() for _ in range(args.clients))))
+
+
+def _presence_events(size: int, rooms: int) -> int:
+    # Each member is told about everyone who joins after it.
+    return rooms * size * (size - 1) // 2
+
+
+def _groups(clients: List[Client], size: int) -> List[List[Client]]:
+    return [clients[i : i + size] for i in range(0, len(clients), size)]
+
+
+async def _join(clients: List[Client], size: int, prefix: str, tally: Tally, timeout: float) -> None:
+    groups = _groups(clients, size)
+    tally.reset("joined", "peer-joined")
+    sends = []
+    for n, group in enumerate(groups):
+        for client in group:
+            client.sent_at["join"] = time.perf_counter()
+            sends.append(client.send({"type": "join", "room": f"{prefix}-{n}", "name": client.peer_id}))
+    await asyncio.gather(*sends)
+    await tally.until("joined", len(clients), timeout)
+    expected = sum(_presence_events(len(g), 1) for g in groups)
+    # Rooms above the presence-diff threshold do not produce an exact count.
+    await tally.settle("peer-joined", expected, 0.5, timeout)
+
+
+async def run(args: argparse.Namespace, probe: ServerProbe) -> Dict[str, float]:
+    tally = Tally()
+    results: Dict[str, float] = {}
+    sdp = _sdp(args.sdp_bytes)
+
+    rss0 = probe.rss()
+    with Phase("connect", probe, results) as phase:
+        clients = await _connect_all(args, tally)
+    results["connect_per_sec"] = len(clients) / phase.elapsed
+    rss1 = probe.rss()
+    if rss0 is not None and rss1 is not None:
+        results["rss_per_conn_kb"] = (rss1 - rss0) / len(clients) / 1024.0
+
+    if "join" in args.phases:
+        with Phase("join", probe, results) as phase:
+            await _join(clients, args.room_size, "room", tally, args.timeout)
+        results["join_per_sec"] = len(clients) / phase.elapsed
+        results["presence_msgs_per_sec"] = tally.counts.get("peer-joined", 0) / phase.elapsed
+        results.update(report.latency_summary("join", tally.latencies.get("joined", [])))
+
+    if "relay" in args.phases:
+        pairs = [(g[i], g[i + 1]) for g in _groups(clients, args.room_size) for i in range(0, len(g) - 1, 2)]
+        expected = len(pairs) * (2 + 2 * args.ice)
+        tally.reset("relay", "offer", "answer", "ice")
+
+        async def negotiate(a: Client, b: Client) -> None:
+            await a.send({"type": "offer", "to": b.peer_id, "sdp": sdp, "t": time.perf_counter()})
+            await b.send({"type": "answer", "to": a.peer_id, "sdp": sdp, "t": time.perf_counter()})
+            for i in range(args.ice):
+                cand = {"candidate": f"candidate:{i} 1 udp 1686052607 203.0.113.{i % 250} {40000 + i} typ srflx"}
+                await a.send({"type": "ice", "to": b.peer_id, "candidate": cand, "t": time.perf_counter()})
+                await b.send({"type": "ice", "to": a.peer_id, "candidate": cand, "t": time.perf_counter()})
+
+        with Phase("relay", probe, results) as phase:
+            await asyncio.gather(*(negotiate(a, b) for a, b in pairs))
+            await tally.until("relay", expected, args.timeout)
+        results["relay_msgs_per_sec"] = tally.counts.get("relay", 0) / phase.elapsed
+        results.update(report.latency_summary("relay", tally.latencies.get("relay", [])))
+
+    if "broadcast" in args.phases:
+        # Switching rooms is part of the setup, not of the measurement.
+        await _join(clients, args.broadcast_room_size, "big", tally, args.timeout)
+        groups = _groups(clients, args.broadcast_room_size)
+        expected = sum(len(g) for g in groups) * args.broadcasts
+        tally.reset("broadcast")
+        interval = args.broadcast_interval_ms / 1000.0
+
+        async def sender(client: Client) -> None:
+            for i in range(args.broadcasts):
+                await client.send({"type": "broadcast", "data": {"seq": i}, "t": time.perf_counter()})
+                if interval:
+                    await asyncio.sleep(interval)
+
+        with Phase("broadcast", probe, results) as phase:
+            await asyncio.gather(*(sender(g[0]) for g in groups))
+            await tally.until("broadcast", expected, args.timeout)
+        results["broadcast_msgs_per_sec"] = tally.counts.get("broadcast", 0) / phase.elapsed
+        results.update(report.latency_summary("broadcast", tally.latencies.get("broadcast", [])))
+
+    metrics_url = _metrics_url(args.url)
+    with Phase("disconnect", probe, results) as phase:
+        await asyncio.gather(*(c.ws.close() for c in clients), return_exceptions=True)
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            remaining = await asyncio.to_thread(_server_connections, metrics_url)
+            if not remaining:
+                break
+            await asyncio.sleep(0.05)
+    results["disconnect_per_sec"] = len(clients) / phase.elapsed
+    if tally.messages:
+        results["frames_per_msg"] = tally.frames / tally.messages
+    await asyncio.gather(*(c.reader for c in clients), return_exceptions=True)
+    return results
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://127.0.0.1:8765/ws")
+    parser.add_argument("--spawn", action="store_true", help="start a local server (python app.py) for the run")
+    parser.add_argument("--port", type=int, default=8800, help="port for --spawn")
+    parser.add_argument("--server-pid", type=int, help="pid of an already running server, for CPU/RSS")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--room-size", type=int, default=10)
+    parser.add_argument("--broadcast-room-size", type=int, default=100)
+    parser.add_argument("--broadcasts", type=int, default=20, help="broadcasts per room")
+    parser.add_argument("--broadcast-interval-ms", type=float, default=10.0)
+    parser.add_argument("--ice", type=int, default=10, help="ICE candidates sent each way per pair")
+    parser.add_argument("--sdp-bytes", type=int, default=3000)
+    parser.add_argument("--phases", default=",".join(PHASES[1:-1]), help="subset of join,relay,broadcast")
+    parser.add_argument("--batch", action="store_true", help='advertise the "batch" capability')
+    parser.add_argument("--no-compression", action="store_true", help="do not offer permessage-deflate")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-phase wait limit in seconds")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+    args.phases = {p.strip() for p in args.phases.split(",") if p.strip()}
+
+    _raise_fd_limit()
+    proc = None
+    pid = args.server_pid
+    if args.spawn:
+        args.url = f"ws://127.0.0.1:{args.port}/ws"
+        proc = _spawn_server(args.port)
+        pid = proc.pid
+
+    params = {
+        "clients": args.clients,
+        "room_size": args.room_size,
+        "broadcast_room_size": args.broadcast_room_size,
+        "broadcasts": args.broadcasts,
+        "ice": args.ice,
+        "sdp_bytes": args.sdp_bytes,
+        "phases": ",".join(p for p in PHASES if p in args.phases),
+        "compression": not args.no_compression,
+        "batch": args.batch,
+    }
+    print(" ".join(f"{k}={v}" for k, v in params.items()))
+    try:
+        results = asyncio.run(run(args, ServerProbe(pid)))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    if args.compare:
+        regressions = report.compare_baseline(args.compare, "loadgen", params, results, args.threshold)
+    else:
+        report.print_results(results)
+        regressions = 0
+    if args.save_baseline:
+        report.save_baseline(args.save_baseline, "loadgen", params, results)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
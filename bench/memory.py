@@ -0,0 +1,122 @@
+"""Memory held per idle connection, excluding the socket itself.
+
+Builds N sessions the way `api.ws` does (peer, outbound queue, resume token,
+rate limits, heartbeat entry, room membership and roster entry, the joined
+frame delivered), lets every writer go idle and reports the Python heap
+growth per peer as measured by tracemalloc, plus the largest contributors by
+source file:
+
+    python -m bench.memory --peers 10000 100000
+    python -m bench.memory --save-baseline memory.json
+    python -m bench.memory --compare memory.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import os
+import time
+import tracemalloc
+from typing import Dict, List
+
+from bench import report
+from bench.fakews import FakeWebSocket
+from core import heartbeat, state
+from core.limits import PeerLimits
+from core.models import Peer, new_peer_id
+
+
+async def _settle(peers: List[Peer]) -> None:
+    while any(p.outbox.depth for p in peers):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+
+
+async def measure(n: int, room_size: int, top: int) -> Dict[str, float]:
+    sockets = [FakeWebSocket() for _ in range(n)]
+    gc.collect()
+    snapshot0 = tracemalloc.take_snapshot()
+    before = tracemalloc.get_traced_memory()[0]
+
+    peers: List[Peer] = []
+    limits: List[PeerLimits] = []
+    now = time.monotonic()
+    for i, ws in enumerate(sockets):
+        peer = Peer(peer_id=new_peer_id(), ws=ws)
+        state.register_peer(peer)
+        state.issue_resume_token(peer)
+        peer.outbox.start()
+        session_limits = PeerLimits(now)
+        session_limits.allow("global", now)
+        session_limits.allow("join", now)
+        limits.append(session_limits)
+        heartbeat.watch(peer.peer_id)
+        page, notices = await state.join_room(peer.peer_id, f"room-{i // room_size}", f"user {i}")
+        peer.outbox.put({"type": "joined", "room": peer.room, "peers": page.text if page else "[]"})
+        state.deliver(notices)
+        peers.append(peer)
+        if i % 1000 == 999:
+            await _settle(peers[-1000:])
+    await _settle(peers)
+
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    stats = tracemalloc.take_snapshot().compare_to(snapshot0, "filename")
+
+    results = {f"bytes_per_peer_{n}": (after - before) / n}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for stat in stats[:top]:
+        name = os.path.relpath(stat.traceback[0].filename, root)
+        if name.startswith(".."):
+            name = os.path.basename(stat.traceback[0].filename)
+        results[f"bytes_per_peer_{n}[{name}]"] = stat.size_diff / n
+
+    for peer in peers:
+        await peer.outbox.stop()
+    state.PEERS.clear()
+    state.ROOMS.clear()
+    state.ROSTERS.clear()
+    state.RESUME_TOKENS.clear()
+    del peers, limits, sockets
+    gc.collect()
+    return results
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, float]:
+    # The heartbeat wheel is not started: entries just sit in their slots.
+    results: Dict[str, float] = {}
+    for n in args.peers:
+        results.update(await measure(n, args.room_size, args.top))
+    return results
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peers", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--room-size", type=int, default=10)
+    parser.add_argument("--top", type=int, default=6, help="contributors listed per run")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    params = {"peers": args.peers, "room_size": args.room_size}
+    print(" ".join(f"{k}={v}" for k, v in params.items()))
+    tracemalloc.start()
+    results = asyncio.run(_run(args))
+    tracemalloc.stop()
+
+    if args.compare:
+        regressions = report.compare_baseline(args.compare, "memory", params, results, args.threshold)
+    else:
+        report.print_results(results)
+        regressions = 0
+    if args.save_baseline:
+        report.save_baseline(args.save_baseline, "memory", params, results)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+"""Relay cost: zero-reparse fast path vs decode/copy/encode.
+
+Reports CPU time per relayed message and p50/p99 latency from "frame
+received" to "frame written" through a real outbound queue (fake socket).
+
+    python -m bench.relay_fastpath --messages 20000 --sdp-bytes 4000
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Callable, List
+
+from bench.fakews import FakeWebSocket
+from core.outbound import Frame, OutboundQueue, encode_json
+from core.relay import fast_relay_target, from_suffix, scan_envelope, splice_from
+from core.state import validate_message
+
+
+def _offer(sdp_bytes: int) -> str:
+    line = "a=candidate:1 1 udp 2122260223 192.168.1.10 54321 typ host generation 0\r\n"
+    sdp = (line * (sdp_bytes // len(line) + 1))[:sdp_bytes]
+    return json.dumps({"type": "offer", "to": "target-peer", "sdp": sdp})
+
+
+def _ice(i: int) -> str:
+    cand = f"candidate:{i} 1 udp 1686052607 203.0.113.{i % 250} {40000 + i} typ srflx raddr 0.0.0.0 rport 0"
+    return json.dumps({"type": "ice", "to": "target-peer", "candidate": {"candidate": cand, "sdpMid": "0", "sdpMLineIndex": 0}})
+
+
+def legacy(raw: str, peer_id: str, suffix: str) -> Frame:
+    msg = json.loads(raw)
+    validate_message(msg)
+    relay = dict(msg)
+    relay["from"] = peer_id
+    return Frame(text=encode_json(relay), mtype=msg["type"])
+
+
+def fast(raw: str, peer_id: str, suffix: str) -> Frame:
+    env = scan_envelope(raw)
+    if fast_relay_target(env) is None:
+        return legacy(raw, peer_id, suffix)
+    return splice_from(raw, env, suffix)
+
+
+def _check_from() -> None:
+    """Both paths forward exactly one `from`, the sender's, even when the client forged one."""
+
+    suffix = from_suffix("sender-peer")
+    for raw in ('{"type":"offer","to":"target-peer","sdp":"y"}', '{"type":"offer","to":"target-peer","sdp":"y","from":"evil"}'):
+        for fn in (legacy, fast):
+            text = fn(raw, "sender-peer", suffix).text
+            assert text.count('"from"') == 1 and json.loads(text)["from"] == "sender-peer", (fn.__name__, text)
+
+
+def _cpu_per_message(fn: Callable[[str, str, str], Frame], frames: List[str]) -> float:
+    suffix = from_suffix("sender-peer")
+    t0 = time.process_time()
+    for raw in frames:
+        fn(raw, "sender-peer", suffix).text
+    return (time.process_time() - t0) / len(frames)
+
+
+class _TimedSocket(FakeWebSocket):
+    def __init__(self) -> None:
+        super().__init__()
+        self.written = asyncio.Event()
+
+    async def send_text(self, data: str) -> None:
+        await super().send_text(data)
+        self.written.set()
+
+
+async def _latencies(fn: Callable[[str, str, str], Frame], frames: List[str]) -> List[float]:
+    ws = _TimedSocket()
+    outbox = OutboundQueue(ws, "target-peer", maxsize=len(frames) + 1)
+    outbox.start()
+    suffix = from_suffix("sender-peer")
+    out = []
+    for raw in frames:
+        ws.written.clear()
+        t0 = time.perf_counter()
+        outbox.put(fn(raw, "sender-peer", suffix))
+        await ws.written.wait()
+        out.append(time.perf_counter() - t0)
+    await outbox.stop()
+    return out
+
+
+def _pct(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--sdp-bytes", type=int, default=4000)
+    args = parser.parse_args(argv)
+    _check_from()
+
+    workloads = {
+        "offer": [_offer(args.sdp_bytes)] * args.messages,
+        "ice": [_ice(i) for i in range(args.messages)],
+    }
+    print(f"messages={args.messages} sdp_bytes={args.sdp_bytes}")
+    print(f"{'workload':<8} {'path':<7} {'cpu us/msg':>11} {'p50 us':>8} {'p99 us':>8}")
+    for name, frames in workloads.items():
+        for label, fn in (("legacy", legacy), ("fast", fast)):
+            cpu = _cpu_per_message(fn, frames)
+            lat = asyncio.run(_latencies(fn, frames[: min(len(frames), 5000)]))
+            print(
+                f"{name:<8} {label:<7} {cpu * 1e6:>11.2f} "
+                f"{statistics.median(lat) * 1e6:>8.1f} {_pct(lat, 0.99) * 1e6:>8.1f}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,290 @@
+"""Replay a traffic capture (core.capture) against a server.
+
+Every captured connection becomes a real `/ws` client that connects,
+sends and closes when the capture says, at `--speed` times the original
+pace. Relay targets are mapped onto the replayed
+peers, rooms onto `room-<n>`, and each frame is padded to its captured size;
+payloads are synthesized (type, target, room) unless the capture holds them,
+in which case they are sent as captured (`--redact` synthesizes anyway).
+`--multiply N` runs N copies of the capture side by side in separate rooms.
+
+    python -m bench.replay prod.cap --spawn --speed 4
+    python -m bench.replay prod.cap --url ws://127.0.0.1:8765/ws --server-pid 1234
+    python -m bench.replay prod.cap --spawn --save-baseline replay.json
+    python -m bench.replay prod.cap --spawn --compare replay.json
+
+Reports frames sent and messages received per second, join/relay/broadcast
+latency (sender to receiver, both in this process), how far the replayer
+fell behind the capture's schedule, and server CPU when its pid is known.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from websockets.asyncio.client import connect
+
+from bench import report
+from bench.loadgen import Client, Phase, ServerProbe, Tally, _encode, _raise_fd_limit, _spawn_server
+from core.capture import BINARY, CLOSE, FRAME, NO_PEER, OPEN, RESUMED, UNKNOWN_PEER, Record, read_capture
+
+
+class ReplayClient(Client):
+    """A loadgen client that also keeps its resume token and counts errors by kind."""
+
+    resume = ""
+
+    async def _handle(self, msg: Dict[str, Any], now: float) -> None:
+        mtype = msg.get("type")
+        if mtype == "welcome":
+            self.resume = str(msg.get("resume", ""))
+        elif mtype == "error":
+            self.tally.hit(f"error:{msg.get('error')}")
+        await super()._handle(msg, now)
+
+
+class Connection:
+    """One captured connection (handle) of one copy, fed its records in order."""
+
+    def __init__(self, replay: "Replay", copy: int, handle: int) -> None:
+        self.replay = replay
+        self.copy = copy
+        self.handle = handle
+        self.client: Optional[ReplayClient] = None
+        self.resume = ""
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            rec = await self.queue.get()
+            if rec is None:
+                return
+            try:
+                if rec.kind == OPEN:
+                    await self._open(bool(rec.flags & RESUMED))
+                elif rec.kind == FRAME:
+                    await self._send(rec)
+                elif rec.kind == CLOSE:
+                    await self._close(rec.size)
+            except Exception:
+                self.replay.tally.hit("client-error")
+                self.client = None
+
+    async def _open(self, resumed: bool) -> None:
+        url = self.replay.url
+        if resumed and self.resume:
+            url += ("&" if "?" in url else "?") + f"resume={self.resume}"
+        ws = await connect(url, ping_interval=None, open_timeout=30, max_queue=None, compression="deflate")
+        client = ReplayClient(ws, self.replay.tally)
+        try:
+            await asyncio.wait_for(client.welcome, 30)
+        except asyncio.TimeoutError:
+            # Refused (e.g. admission control) or closed before the welcome.
+            self.replay.tally.hit("connect-failed")
+            await ws.close()
+            return
+        self.client = client
+        self.replay.tally.hit("connected")
+
+    async def _close(self, code: int) -> None:
+        client, self.client = self.client, None
+        if client is None:
+            return
+        self.resume = client.resume
+        # Abnormal closes stay abnormal, so the server keeps the session for a resume.
+        await client.ws.close(code=1000 if code in (0, 1000, 1001) else 4000)
+
+    async def _send(self, rec: Record) -> None:
+        client = self.client
+        if client is None or rec.mtype == "pong":
+            # Not connected (refused, or its open predates the capture); pongs
+            # are answered by the client itself.
+            self.replay.tally.hit("skipped")
+            return
+        text = self.replay.frame(self.copy, self.handle, rec)
+        if rec.mtype == "join":
+            client.sent_at["join"] = time.perf_counter()
+        await client.ws.send(text)
+        self.replay.sent += 1
+
+
+class Replay:
+    def __init__(self, args: argparse.Namespace, payloads: bool) -> None:
+        self.url = args.url
+        self.payloads = payloads and not args.redact
+        self.tally = Tally()
+        self.connections: Dict[Tuple[int, int], Connection] = {}
+        self.sent = 0
+
+    def connection(self, copy: int, handle: int) -> Connection:
+        conn = self.connections.get((copy, handle))
+        if conn is None:
+            conn = self.connections[(copy, handle)] = Connection(self, copy, handle)
+        return conn
+
+    def _peer_id(self, copy: int, handle: int) -> str:
+        if handle == UNKNOWN_PEER:
+            return "unknown-peer"
+        conn = self.connections.get((copy, handle))
+        if conn is None or conn.client is None or not conn.client.peer_id:
+            return f"gone-{handle}"
+        return conn.client.peer_id
+
+    def frame(self, copy: int, handle: int, rec: Record) -> str:
+        if self.payloads and rec.payload:
+            return self._captured(copy, rec)
+        if rec.mtype == "invalid":
+            return "?" * max(rec.size, 1)
+        payload: Dict[str, Any] = {"type": rec.mtype}
+        if rec.mtype == "join":
+            payload["room"] = f"c{copy}-room-{rec.room}"
+            payload["name"] = f"h{handle}"
+        if rec.to != NO_PEER:
+            payload["to"] = self._peer_id(copy, rec.to)
+        payload["t"] = time.perf_counter()
+        text = _encode(payload)
+        pad = rec.size - len(text) - len(',"pad":""')
+        if pad > 0:
+            payload["pad"] = "x" * pad
+            text = _encode(payload)
+        return text
+
+    def _captured(self, copy: int, rec: Record) -> str:
+        try:
+            if rec.flags & BINARY:
+                from core.codec import CODECS
+
+                msg = CODECS["vc.msgpack"].decode(rec.payload)
+            else:
+                msg = json.loads(rec.payload)
+        except Exception:
+            return rec.payload.decode("utf-8", "replace")
+        if not isinstance(msg, dict):
+            return _encode(msg)
+        if rec.to != NO_PEER:
+            msg["to"] = self._peer_id(copy, rec.to)
+        if rec.mtype == "join" and copy:
+            msg["room"] = f"c{copy}-{msg.get('room', '')}"
+        # Replies are JSON whatever the original codec; text frames are always accepted.
+        msg["t"] = time.perf_counter()
+        return _encode(msg)
+
+
+async def run(args: argparse.Namespace, probe: ServerProbe) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    lags: List[float] = []
+    with open(args.capture, "rb") as f:
+        header, records = read_capture(f)
+        replay = Replay(args, bool(header.get("payloads")))
+        speed = args.speed
+        n = 0
+        with Phase("replay", probe, results) as phase:
+            start = time.perf_counter()
+            for rec in records:
+                if args.max_sec and rec.t > args.max_sec:
+                    break
+                delay = start + rec.t / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    lags.append(-delay)
+                for copy in range(args.multiply):
+                    replay.connection(copy, rec.handle).queue.put_nowait(rec)
+                n += 1
+            for conn in replay.connections.values():
+                conn.queue.put_nowait(None)
+            await asyncio.gather(*(c.task for c in replay.connections.values()))
+            # In-flight deliveries: until nothing arrives for half a second.
+            deadline = time.monotonic() + args.drain_sec
+            last = -1
+            while replay.tally.messages != last and time.monotonic() < deadline:
+                last = replay.tally.messages
+                await asyncio.sleep(0.5)
+
+    clients = [c.client for c in replay.connections.values() if c.client is not None]
+    await asyncio.gather(*(c.ws.close() for c in clients), return_exceptions=True)
+    await asyncio.gather(*(c.reader for c in clients), return_exceptions=True)
+
+    tally = replay.tally
+    elapsed = phase.elapsed
+    results.update(
+        {
+            "records": float(n),
+            "connections": float(tally.counts.get("connected", 0)),
+            "connect_failed": float(tally.counts.get("connect-failed", 0)),
+            "frames_sent_per_sec": replay.sent / elapsed,
+            "msgs_received_per_sec": tally.messages / elapsed,
+            "errors": float(sum(v for k, v in tally.counts.items() if k.startswith("error:"))),
+        }
+    )
+    for name in ("joined", "relay", "broadcast"):
+        if tally.latencies.get(name):
+            results.update(report.latency_summary("join" if name == "joined" else name, tally.latencies[name]))
+    if lags:
+        results.update({k.replace("_ms", "_lag_ms"): v for k, v in report.latency_summary("schedule", lags).items()})
+    for key, count in sorted(tally.counts.items()):
+        if key.startswith("error:"):
+            print(f"  {key} {count}")
+    return results
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="capture file (VC_SERVER_CAPTURE)")
+    parser.add_argument("--url", default="ws://127.0.0.1:8765/ws")
+    parser.add_argument("--spawn", action="store_true", help="start a local server (python app.py) for the run")
+    parser.add_argument("--port", type=int, default=8800, help="port for --spawn")
+    parser.add_argument("--server-pid", type=int, help="pid of an already running server, for CPU")
+    parser.add_argument("--speed", type=float, default=1.0, help="multiple of the captured pace")
+    parser.add_argument("--multiply", type=int, default=1, help="copies of the capture to run side by side")
+    parser.add_argument("--max-sec", type=float, default=0.0, help="replay only the first seconds of the capture")
+    parser.add_argument("--redact", action="store_true", help="synthesize payloads even if the capture has them")
+    parser.add_argument("--drain-sec", type=float, default=5.0, help="wait limit for in-flight messages at the end")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    _raise_fd_limit()
+    proc = None
+    pid = args.server_pid
+    if args.spawn:
+        args.url = f"ws://127.0.0.1:{args.port}/ws"
+        proc = _spawn_server(args.port)
+        pid = proc.pid
+
+    params = {
+        "capture": os.path.basename(args.capture),
+        "speed": args.speed,
+        "multiply": args.multiply,
+        "max_sec": args.max_sec,
+        "redact": args.redact,
+    }
+    print(" ".join(f"{k}={v}" for k, v in params.items()))
+    try:
+        results = asyncio.run(run(args, ServerProbe(pid)))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    if args.compare:
+        regressions = report.compare_baseline(args.compare, "replay", params, results, args.threshold)
+    else:
+        report.print_results(results)
+        regressions = 0
+    if args.save_baseline:
+        report.save_baseline(args.save_baseline, "replay", params, results)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,115 @@
+"""Result tables, percentiles and saved baselines shared by the benchmarks.
+
+A baseline is a JSON file of `{"bench": ..., "params": {...}, "results":
+{metric: value}}`. `--compare` prints each metric next to the baseline with
+the change in percent, marking regressions beyond the threshold; metrics
+ending in `_per_sec` are better when higher, everything else when lower.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import platform
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence (q in 0..100)."""
+
+    if not sorted_values:
+        return math.nan
+    rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(prefix: str, samples: List[float]) -> Dict[str, float]:
+    """p50/p99/p999 in milliseconds for a list of latencies in seconds."""
+
+    values = sorted(samples)
+    return {
+        f"{prefix}_p50_ms": percentile(values, 50) * 1000.0,
+        f"{prefix}_p99_ms": percentile(values, 99) * 1000.0,
+        f"{prefix}_p999_ms": percentile(values, 99.9) * 1000.0,
+    }
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_sec")
+
+
+def print_results(results: Dict[str, float]) -> None:
+    width = max((len(k) for k in results), default=0)
+    for metric, value in results.items():
+        print(f"  {metric:<{width}} {_fmt(value):>14}")
+
+
+def save_baseline(path: str, bench: str, params: Dict[str, Any], results: Dict[str, float]) -> None:
+    doc = {
+        "bench": bench,
+        "params": params,
+        "results": results,
+        "saved_at": int(time.time()),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"baseline saved to {path}")
+
+
+def compare_baseline(
+    path: str,
+    bench: str,
+    params: Dict[str, Any],
+    results: Dict[str, float],
+    threshold: float = 10.0,
+) -> int:
+    """Print results against a saved baseline; returns the number of regressions."""
+
+    with open(path, "r", encoding="utf-8") as f:
+        doc = json.load(f)
+    if doc.get("bench") != bench:
+        raise SystemExit(f"{path} is a baseline for {doc.get('bench')!r}, not {bench!r}")
+    old_params = doc.get("params", {})
+    changed = sorted(k for k in set(old_params) | set(params) if old_params.get(k) != params.get(k))
+    if changed:
+        print(f"warning: parameters differ from the baseline: {', '.join(changed)}")
+
+    baseline: Dict[str, float] = doc.get("results", {})
+    regressions = 0
+    width = max((len(k) for k in results), default=0)
+    print(f"  {'metric':<{width}} {'baseline':>14} {'current':>14} {'change':>9}")
+    for metric, value in results.items():
+        old = baseline.get(metric)
+        change = _change(old, value)
+        flag = ""
+        if change is not None:
+            worse = -change if higher_is_better(metric) else change
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            elif worse < -threshold:
+                flag = "  improved"
+        change_col = "-" if change is None else f"{change:+.1f}%"
+        print(f"  {metric:<{width}} {_fmt(old):>14} {_fmt(value):>14} {change_col:>9}{flag}")
+    return regressions
+
+
+def _change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if old is None or new is None or not old or math.isnan(old) or math.isnan(new):
+        return None
+    return (new - old) / abs(old) * 100.0
+
+
+def _fmt(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float) and math.isnan(value):
+        return "nan"
+    if abs(value) >= 100:
+        return f"{value:,.0f}"
+    return f"{value:,.3f}"
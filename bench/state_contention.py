@@ -0,0 +1,158 @@
+"""Join/leave throughput under contention, by number of rooms.
+
+Compares the current state layer (per-room locks, notifications delivered
+after unlocking, queued sends) with the legacy layout (one global lock held
+across awaited broadcasts). Sockets are faked with a fixed send latency.
+
+The current layer never awaits while holding a room lock, so on one event
+loop its locks never contend and its throughput is flat across room counts.
+The "held" columns measure the locks themselves under contention: every
+operation holds its room's lock (or, for comparison, one lock shared by all
+rooms) across an await of `--hold-ms`, as a critical section that waits on
+I/O would. Per-room locks scale with the number of rooms; the shared lock
+does not.
+
+    python -m bench.state_contention --peers 100 --cycles 2 --latency-ms 0.5
+    python -m bench.state_contention --skip-legacy --hold-ms 2
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Set
+
+import config
+from bench.fakews import FakeWebSocket
+from core import history, outbound, presence, snapshot, state
+from core.models import Peer
+
+
+def _reset() -> None:
+    """Forget module state left over from a previous `asyncio.run`."""
+
+    state.PEERS.clear()
+    state.ROOMS.clear()
+    state.ROSTERS.clear()
+    state.RESUME_TOKENS.clear()
+    state._ROOM_LOCKS.clear()
+    presence._PENDING.clear()
+    history._ROOMS.clear()
+    snapshot._DIRTY_ROOMS.clear()
+    snapshot._DIRTY_PEERS.clear()
+    # Bound to the loop it first waited on.
+    outbound._SEND_SLOTS = asyncio.Semaphore(config.SEND_CONCURRENCY)
+
+
+async def _run_current(peers: int, rooms: int, cycles: int, latency: float) -> float:
+    _reset()
+    ids = []
+    for i in range(peers):
+        peer = Peer(peer_id=f"p{i}", ws=FakeWebSocket(send_latency=latency))
+        state.register_peer(peer)
+        peer.outbox.start()
+        ids.append(peer.peer_id)
+
+    async def worker(i: int) -> None:
+        pid = ids[i]
+        room = f"room-{i % rooms}"
+        for _ in range(cycles):
+            roster, notices = await state.join_room(pid, room, pid)
+            state.deliver(notices)
+            _, notices = await state.leave_room(pid)
+            state.deliver(notices)
+            await asyncio.sleep(0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(peers)))
+    elapsed = time.perf_counter() - t0
+
+    for pid in ids:
+        await state.PEERS[pid].outbox.stop()
+        await state.remove_peer(pid)
+    _reset()
+    return elapsed
+
+
+async def _run_held(peers: int, rooms: int, cycles: int, hold: float, shared: bool) -> float:
+    _reset()
+
+    async def worker(i: int) -> None:
+        room = "all" if shared else f"room-{i % rooms}"
+        for _ in range(cycles * 2):
+            async with state.room_locks(room):
+                await asyncio.sleep(hold)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(peers)))
+    elapsed = time.perf_counter() - t0
+    _reset()
+    return elapsed
+
+
+async def _run_legacy(peers: int, rooms: int, cycles: int, latency: float) -> float:
+    lock = asyncio.Lock()
+    conns: Dict[str, FakeWebSocket] = {}
+    room_of: Dict[str, str] = {}
+    members: Dict[str, Set[str]] = {}
+    ids = [f"p{i}" for i in range(peers)]
+    for pid in ids:
+        conns[pid] = FakeWebSocket(send_latency=latency)
+
+    async def broadcast(room: str, payload: dict, exclude: str) -> None:
+        for other in members.get(room, set()).copy():
+            if other != exclude:
+                await conns[other].send_text(json.dumps(payload, separators=(",", ":")))
+
+    async def worker(i: int) -> None:
+        pid = ids[i]
+        room = f"room-{i % rooms}"
+        for _ in range(cycles):
+            async with lock:
+                room_of[pid] = room
+                members.setdefault(room, set()).add(pid)
+                roster = [{"peer_id": o, "name": o} for o in members[room] if o != pid]
+            await conns[pid].send_text(json.dumps({"type": "joined", "peers": roster}))
+            await broadcast(room, {"type": "peer-joined", "peer": {"peer_id": pid}}, pid)
+            async with lock:
+                members[room].discard(pid)
+                room_of[pid] = ""
+                await broadcast(room, {"type": "peer-left", "peer_id": pid}, pid)
+            await asyncio.sleep(0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(peers)))
+    return time.perf_counter() - t0
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peers", type=int, default=100)
+    parser.add_argument("--cycles", type=int, default=2, help="join/leave cycles per peer")
+    parser.add_argument("--rooms", default="1,4,16,64", help="comma-separated room counts")
+    parser.add_argument("--latency-ms", type=float, default=0.5, help="simulated socket send latency")
+    parser.add_argument("--hold-ms", type=float, default=1.0, help="await inside the lock for the held columns (0: skip)")
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args(argv)
+
+    latency = args.latency_ms / 1000.0
+    hold = args.hold_ms / 1000.0
+    ops = args.peers * args.cycles * 2
+    print(f"peers={args.peers} cycles={args.cycles} send_latency_ms={args.latency_ms} hold_ms={args.hold_ms}")
+    print(f"{'rooms':>6} {'current ops/s':>14} {'held room ops/s':>16} {'held shared ops/s':>18} {'legacy ops/s':>14}")
+    for rooms in (int(r) for r in args.rooms.split(",")):
+        current = asyncio.run(_run_current(args.peers, rooms, args.cycles, latency))
+        cols = []
+        for shared in (False, True):
+            held = asyncio.run(_run_held(args.peers, rooms, args.cycles, hold, shared)) if hold else None
+            cols.append("-" if held is None else f"{ops / held:,.0f}")
+        legacy = None if args.skip_legacy else asyncio.run(_run_legacy(args.peers, rooms, args.cycles, latency))
+        legacy_col = "-" if legacy is None else f"{ops / legacy:,.0f}"
+        print(f"{rooms:>6} {ops / current:>14,.0f} {cols[0]:>16} {cols[1]:>18} {legacy_col:>14}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,10 +3,14 @@ from __future__ import annotations
 import argparse
 
 import os
+from typing import Any, Dict
 
 import uvicorn
 from fastapi import FastAPI
 
+import config
+import logging_config
+from core.heartbeat import uvicorn_ping_options
 from logging_config import setup_logging
 
 
@@ -21,6 +25,17 @@ def _load_dotenv() -> None:
         return
 
 
+def uvicorn_ws_options() -> Dict[str, Any]:
+    """WebSocket-related uvicorn settings shared by the CLI and the GUI."""
+
+    options: Dict[str, Any] = {
+        "ws_per_message_deflate": config.WS_PER_MESSAGE_DEFLATE,
+        "ws_max_size": config.WS_MAX_MESSAGE_BYTES,
+    }
+    options.update(uvicorn_ping_options())
+    return options
+
+
 def run(app: FastAPI) -> None:
     _load_dotenv()
 
@@ -32,7 +47,65 @@ def run(app: FastAPI) -> None:
         default=None,
         help="Logging level (debug, info, warning, error). Can also use VC_SERVER_LOG_LEVEL or VC_LOG_LEVEL.",
     )
+    parser.add_argument(
+        "--log-format",
+        choices=("text", "json"),
+        default=None,
+        help="Log line format: text (default) or json lines. Can also use VC_SERVER_LOG_FORMAT.",
+    )
+    parser.add_argument(
+        "--log-mode",
+        choices=("queued", "sync"),
+        default=None,
+        help="queued (default) writes logs from a background thread; sync writes inline. Can also use VC_SERVER_LOG_MODE.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes. More than one uses the bus state backend (VC_SERVER_STATE_BACKEND=bus).",
+    )
+    parser.add_argument(
+        "--capture",
+        metavar="PATH",
+        default=None,
+        help='Record inbound traffic for bench/replay.py ("{pid}" is replaced per worker). Can also use VC_SERVER_CAPTURE.',
+    )
     args = parser.parse_args()
+    if args.workers > 1 and config.STATE_DIR:
+        # Workers would share one snapshot and each restore every session.
+        parser.error("VC_SERVER_STATE_DIR (warm restart) needs one process per directory; it cannot be used with --workers")
 
-    setup_logging(args.log_level)
-    uvicorn.run(app, host=args.host, port=args.port, log_level=(args.log_level or "info"))
+    if args.capture:
+        # Workers read it from the environment when they import config.
+        os.environ["VC_SERVER_CAPTURE"] = config.CAPTURE_PATH = args.capture
+    if args.workers > 1 and config.CAPTURE_PATH and "{pid}" not in config.CAPTURE_PATH:
+        # Each worker creates its own capture file and would refuse a shared one.
+        parser.error('--capture needs "{pid}" in the path with --workers, one file per worker')
+
+    setup_logging(args.log_level, mode=args.log_mode, fmt=args.log_format)
+
+    target: Any = app
+    options = uvicorn_ws_options()
+    if args.workers > 1:
+        # Workers import the app themselves and must share state over the bus.
+        os.environ.setdefault("VC_SERVER_STATE_BACKEND", "bus")
+        target = "app:app"
+        # Each worker sets up its own logging from these.
+        for name, value in (("LEVEL", args.log_level), ("MODE", args.log_mode), ("FORMAT", args.log_format)):
+            if value:
+                os.environ[f"VC_SERVER_LOG_{name}"] = value
+        options["log_config"] = logging_config.worker_log_config()
+    elif logging_config.queued():
+        # Let uvicorn's loggers propagate to the root queue handler instead of
+        # installing its own (synchronous) stream handlers.
+        options["log_config"] = None
+
+    uvicorn.run(
+        target,
+        workers=args.workers,
+        host=args.host,
+        port=args.port,
+        log_level=(args.log_level or "info"),
+        **options,
+    )
@@ -1,4 +1,186 @@
 """Server configuration constants."""
 
+import os
+import socket
+
 PING_INTERVAL_SEC = 20
 PING_TIMEOUT_SEC = 60  # if we haven't seen any message/pong for this long, drop
+
+# Heartbeat: "app" sends JSON ping messages from a single timing wheel;
+# "protocol" leaves keepalive to WebSocket ping/pong frames in uvicorn.
+HEARTBEAT_MODE = "app"
+HEARTBEAT_TICK_SEC = 1.0  # timing wheel resolution
+HEARTBEAT_BATCH = 1000  # peers handled per sweep step before yielding
+
+# Per-peer outbound queue: messages waiting for that peer's writer task.
+SEND_QUEUE_MAX = 256
+# Overflow policy by message type ("drop-oldest", "coalesce" or "disconnect").
+# Unlisted types are treated as critical and use SEND_QUEUE_DEFAULT_POLICY.
+SEND_QUEUE_POLICIES = {
+    "ice": "drop-oldest",
+    "ping": "drop-oldest",
+    "peer-joined": "coalesce",
+    "peer-left": "coalesce",
+}
+SEND_QUEUE_DEFAULT_POLICY = "disconnect"
+SEND_QUEUE_CLOSE_CODE = 1008  # close code used when a critical message overflows
+
+# Socket writes: per-recipient timeout (a recipient stuck longer is closed as a
+# slow consumer) and the cap on writes in flight across all writer tasks. A
+# writer that waits SEND_TIMEOUT_SEC for one of those slots keeps its messages
+# queued and tries again.
+SEND_TIMEOUT_SEC = 5.0
+SEND_CONCURRENCY = 1024
+
+# Batching for peers that advertise the "batch" capability: while a burst is
+# under way (the previous send was less than BATCH_WINDOW_MS ago) the writer
+# waits out the window and sends everything queued as one "batch" frame.
+BATCH_WINDOW_MS = 5.0
+BATCH_MAX_MESSAGES = 32
+BATCH_MAX_BYTES = 64 * 1024
+
+# How long a peer whose connection dropped (any close code but 1000/1001)
+# keeps its id, room and queued messages for a reconnect with its resume
+# token. 0 removes peers immediately.
+RESUME_GRACE_SEC = 30.0
+
+# Warm restart (see core.journal): directory for the session snapshot and
+# journal; empty disables persistence. Restored sessions wait
+# RESTORE_GRACE_SEC for their clients; state older than RESTORE_MAX_AGE_SEC
+# is not restored.
+STATE_DIR = os.environ.get("VC_SERVER_STATE_DIR", "")
+JOURNAL_FLUSH_SEC = 1.0
+SNAPSHOT_INTERVAL_SEC = 60.0
+RESTORE_GRACE_SEC = 60.0
+RESTORE_MAX_AGE_SEC = 300.0
+
+# Drain (POST /admin/drain): every client is told to reconnect (with its
+# resume token) after a delay that grows by DRAIN_BATCH_INTERVAL_MS for each
+# DRAIN_BATCH_SIZE clients, then disconnected with DRAIN_CLOSE_CODE.
+DRAIN_BATCH_SIZE = 200
+DRAIN_BATCH_INTERVAL_MS = 500
+DRAIN_CLOSE_CODE = 1012  # service restart
+
+# Bearer token for the /admin and /debug endpoints; empty disables them.
+ADMIN_TOKEN = os.environ.get("VC_SERVER_ADMIN_TOKEN", "")
+
+# Admin read API (/admin/rooms, /admin/peers; see core.snapshot): the state
+# snapshot it serves is republished at most every SNAPSHOT_INTERVAL_MS, and
+# only if something changed. Room listings return ADMIN_PAGE_SIZE rooms per
+# page unless asked for more, up to ADMIN_PAGE_MAX.
+SNAPSHOT_INTERVAL_MS = 500
+ADMIN_PAGE_SIZE = 100
+ADMIN_PAGE_MAX = 1000
+
+# Admission control (see core.admission); 0 disables a limit. A new
+# connection beyond MAX_CONNECTIONS, or while the event loop lags by
+# SHED_LOOP_LAG_MS or more or SHED_QUEUED_MESSAGES are waiting in outbound
+# queues, is closed with OVERLOAD_CLOSE_CODE right after the handshake
+# (resumes are exempt from MAX_CONNECTIONS). A join that would create room
+# number MAX_ROOMS + 1 or grow a room past MAX_ROOM_SIZE gets an error.
+MAX_CONNECTIONS = int(os.environ.get("VC_SERVER_MAX_CONNECTIONS", "0"))
+MAX_ROOMS = int(os.environ.get("VC_SERVER_MAX_ROOMS", "0"))
+MAX_ROOM_SIZE = int(os.environ.get("VC_SERVER_MAX_ROOM_SIZE", "0"))
+SHED_LOOP_LAG_MS = 1000
+SHED_QUEUED_MESSAGES = 500_000
+OVERLOAD_CLOSE_CODE = 1013  # try again later
+
+# Broadcast history (see core.history): each room keeps its latest broadcasts,
+# at most HISTORY_MAX_MESSAGES / HISTORY_MAX_BYTES of JSON and none older
+# than HISTORY_MAX_AGE_SEC, for `joined` replies. 0 messages disables
+# sequencing and history; so does the bus state backend, where each process
+# would number rooms on its own.
+HISTORY_MAX_MESSAGES = int(os.environ.get("VC_SERVER_HISTORY_MAX_MESSAGES", "50"))
+HISTORY_MAX_BYTES = 32 * 1024
+HISTORY_MAX_AGE_SEC = 30.0
+
+# Traffic capture for bench/replay.py (see core.capture): inbound frames go to
+# VC_SERVER_CAPTURE (a new file; "{pid}" is replaced by the worker's pid),
+# with payloads only if VC_SERVER_CAPTURE_PAYLOADS=1. Written every
+# CAPTURE_FLUSH_SEC; stops at CAPTURE_MAX_BYTES, and drops frames past
+# CAPTURE_MAX_PENDING waiting for a flush.
+CAPTURE_PATH = os.environ.get("VC_SERVER_CAPTURE", "")
+CAPTURE_PAYLOADS = os.environ.get("VC_SERVER_CAPTURE_PAYLOADS", "") == "1"
+CAPTURE_FLUSH_SEC = 0.5
+CAPTURE_MAX_BYTES = 1024 * 1024 * 1024
+CAPTURE_MAX_PENDING = 200_000
+
+# Event-loop monitor (see core.watchdog): a beat every LOOP_LAG_INTERVAL_MS
+# measures loop lag; a beat LOOP_STALL_MS overdue is a stall, logged with the
+# stack that was running (0 disables the watchdog thread). GET /debug/profile
+# samples every PROFILE_INTERVAL_MS for at most PROFILE_MAX_SEC.
+LOOP_LAG_INTERVAL_MS = 100
+LOOP_STALL_MS = 250
+PROFILE_INTERVAL_MS = 5
+PROFILE_MAX_SEC = 60
+
+# Inbound limits (see core.limits). Frames larger than MAX_FRAME_BYTES are
+# rejected before decoding; WS_MAX_MESSAGE_BYTES is the hard cap at which
+# the WebSocket layer itself drops the connection.
+MAX_FRAME_BYTES = 64 * 1024
+WS_MAX_MESSAGE_BYTES = 1024 * 1024
+# Token buckets per peer: class -> (tokens per second, burst). "global"
+# applies to every frame, the others by message type.
+RATE_LIMITS = {
+    "global": (100.0, 300.0),
+    "relay": (50.0, 200.0),
+    "broadcast": (10.0, 20.0),
+    "join": (2.0, 10.0),
+    # Roster pages (ROSTER_PAGE_SIZE members each) a client follows after joining.
+    "roster": (20.0, 40.0),
+}
+# Each rejection is a strike (one forgiven per RATE_STRIKE_DECAY_SEC). Below
+# RATE_STRIKES_THROTTLE the peer gets an error; from there its reads pause for
+# RATE_THROTTLE_SEC per rejection; at RATE_STRIKES_CLOSE it is disconnected.
+RATE_STRIKE_DECAY_SEC = 10.0
+RATE_STRIKES_THROTTLE = 5
+RATE_STRIKES_CLOSE = 20
+RATE_THROTTLE_SEC = 1.0
+RATE_CLOSE_CODE = 1008
+
+# permessage-deflate for clients that offer it (shrinks large SDP payloads).
+WS_PER_MESSAGE_DEFLATE = True
+
+# Rooms with more members than this send the roster in pages of this size
+# ("cursor" in joined; the client asks for the rest with "roster" requests).
+ROSTER_PAGE_SIZE = 500
+
+# Rooms with at least this many members get presence as one "presence-diff"
+# per PRESENCE_TICK_MS instead of a peer-joined/peer-left per change (0: never).
+PRESENCE_DIFF_THRESHOLD = 100
+PRESENCE_TICK_MS = 250
+
+# Logging (see logging_config). In the default "queued" mode records wait in a
+# queue of at most LOG_QUEUE_MAX for the writer thread and are dropped beyond
+# it. LOG_SAMPLING thins hot-path events, matched by message template prefix
+# (first match wins): prefix -> (keep 1 in N, max records per second; 0: no cap).
+LOG_QUEUE_MAX = 10000
+LOG_SAMPLING = {
+    "relay failed ": (1, 20.0),
+    "relay ice ": (10, 50.0),
+    "relay ": (1, 100.0),
+    "ws recv ": (1, 50.0),
+    "broadcast from=": (1, 50.0),
+    "broadcast_room ": (1, 50.0),
+    "send_to_peer ": (1, 20.0),
+    "ws refused ": (1, 10.0),
+}
+
+# State backend: "memory" (single process) or "bus" (several workers/nodes
+# sharing membership and routing through core.bus).
+STATE_BACKEND = os.environ.get("VC_SERVER_STATE_BACKEND", "memory")
+# Broker address: "tcp:host:port" or "unix:/path/to.sock".
+BUS_ADDRESS = os.environ.get("VC_SERVER_BUS_ADDRESS", "tcp:127.0.0.1:8799")
+# Start an in-process broker if none is listening at BUS_ADDRESS.
+BUS_EMBED_BROKER = os.environ.get("VC_SERVER_BUS_EMBED_BROKER", "1") != "0"
+# Unique id of this process on the bus.
+NODE_ID = os.environ.get("VC_SERVER_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# Broker disconnects a node whose unsent backlog exceeds this many bytes.
+BUS_NODE_BUFFER_MAX = 64 * 1024 * 1024
+# After reconnecting, remote peers not re-announced within this window are dropped.
+BUS_RESYNC_GRACE_SEC = 5.0
+
+# Room placement: "node_id=ws_url" entries, comma-separated (see core.cluster).
+# Empty disables placement; NODE_ID must name this node's entry.
+CLUSTER_NODES = os.environ.get("VC_SERVER_CLUSTER_NODES", "")
+CLUSTER_VNODES = 128  # virtual points per node on the hash ring
@@ -0,0 +1,82 @@
+"""Admission control: what a loaded node refuses, and how loaded it is.
+
+New connections are refused (closed with `config.OVERLOAD_CLOSE_CODE`,
+"try again later") when the node is at `MAX_CONNECTIONS`, when the event
+loop is lagging (`SHED_LOOP_LAG_MS`, from core.watchdog) or when too many
+messages are waiting in outbound queues (`SHED_QUEUED_MESSAGES`). Joins are
+refused past `MAX_ROOMS` rooms or `MAX_ROOM_SIZE` members; the check is done
+before taking the room lock, so concurrent joins can overshoot the size
+limit by the number in flight.
+
+`load` is what /ready reports, for load balancers to weight or drain nodes.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+import config
+from core import drain, metrics, watchdog
+from core.outbound import queued_total
+from core.state import PEERS, ROOMS
+
+
+def _overloaded() -> Optional[str]:
+    lag_ms = config.SHED_LOOP_LAG_MS
+    if lag_ms and watchdog.MONITOR.lag * 1000.0 >= lag_ms:
+        return "loop-lag"
+    if config.SHED_QUEUED_MESSAGES and queued_total() >= config.SHED_QUEUED_MESSAGES:
+        return "queued"
+    return None
+
+
+def refuse_connection(resuming: bool = False) -> Optional[str]:
+    """Reason to turn a new connection away, or None to admit it."""
+
+    if not resuming and config.MAX_CONNECTIONS and len(PEERS) >= config.MAX_CONNECTIONS:
+        reason = "connections"
+    else:
+        reason = _overloaded()
+    if reason:
+        metrics.SHED.inc(reason)
+    return reason
+
+
+def refuse_join(room: str, current_room: str) -> Optional[str]:
+    """Reason to refuse a join of `room`, or None."""
+
+    if room == current_room:
+        return None
+    members = ROOMS.get(room)
+    reason = None
+    if members is None:
+        if config.MAX_ROOMS and len(ROOMS) >= config.MAX_ROOMS:
+            reason = "rooms"
+    elif config.MAX_ROOM_SIZE and len(members) >= config.MAX_ROOM_SIZE:
+        reason = "room-size"
+    if reason:
+        metrics.SHED.inc(reason)
+    return reason
+
+
+def load() -> Dict[str, Any]:
+    """Current load; `ready` is False while new connections would be refused."""
+
+    overloaded = _overloaded()
+    full = bool(config.MAX_CONNECTIONS) and len(PEERS) >= config.MAX_CONNECTIONS
+    ratios = [
+        len(PEERS) / config.MAX_CONNECTIONS if config.MAX_CONNECTIONS else 0.0,
+        watchdog.MONITOR.lag * 1000.0 / config.SHED_LOOP_LAG_MS if config.SHED_LOOP_LAG_MS else 0.0,
+        queued_total() / config.SHED_QUEUED_MESSAGES if config.SHED_QUEUED_MESSAGES else 0.0,
+    ]
+    return {
+        "ready": not (overloaded or full or drain.draining()),
+        "reason": "draining" if drain.draining() else ("connections" if full else overloaded),
+        # Highest of the ratios to the shedding thresholds; 1.0 means shedding.
+        "load": round(min(1.0, max(ratios)), 3),
+        "connections": len(PEERS),
+        "rooms": len(ROOMS),
+        "loop_lag_ms": round(watchdog.MONITOR.lag * 1000.0, 1),
+        "queued": queued_total(),
+        "shed": dict(metrics.SHED.values),
+    }
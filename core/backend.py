@@ -0,0 +1,60 @@
+"""Pluggable state backends.
+
+`core.state` always keeps this process's connections in `PEERS` and room
+membership in `ROOMS`. A backend adds whatever is needed to share that with
+other processes: announcing local membership changes, answering for peers
+that live elsewhere, and routing relays/broadcasts to them.
+
+- `memory`: single process; PEERS/ROOMS are the whole truth (the default).
+- `bus`: several workers or nodes connected through a message bus, see
+  `core.bus`.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from core.outbound import Frame
+
+
+class StateBackend:
+    name = ""
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    # Local changes, announced to the other processes.
+    def peer_up(self, peer_id: str) -> None:
+        pass
+
+    def peer_down(self, peer_id: str, reason: str = "disconnect") -> None:
+        pass
+
+    def member(self, peer_id: str, room: str, name: str) -> None:
+        """`peer_id` is now in `room` ("" when it is in no room)."""
+
+    # Peers owned by other processes.
+    def send_to_remote(self, peer_id: str, frame: Frame) -> bool:
+        return False
+
+    def broadcast_remote(self, room: str, frame: Frame, exclude: Optional[str]) -> None:
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Everything lives in this process's PEERS/ROOMS; nothing to share."""
+
+    name = "memory"
+
+
+def create_backend(name: str) -> StateBackend:
+    if name == "memory":
+        return MemoryBackend()
+    if name == "bus":
+        from core.bus import BusBackend
+
+        return BusBackend()
+    raise ValueError(f"unknown state backend: {name}")
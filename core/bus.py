@@ -0,0 +1,483 @@
+"""Message bus for running several server processes as one signaling service.
+
+Each process (uvicorn worker or node) connects to a broker and:
+
+- announces its own peers (`up`/`member`/`down`), which the broker keeps in a
+  directory and forwards to every other process, so each process can mirror
+  remote room membership into `core.state.ROOMS` and answer rosters locally;
+- sends `peer` messages (relays) to the broker, which forwards them only to
+  the process that owns the target peer;
+- sends `room` messages (broadcasts) once; the broker forwards them to the
+  processes that have members in that room.
+
+Presence (`peer-joined`/`peer-left`, or the diffs of large rooms) is not sent
+over the bus: each process derives it for its own members from the `member`
+and `down` announcements, at the moment it applies them to its mirror. A
+joiner's roster and the presence it gets afterwards therefore always agree,
+however a join here races with one on another process: a remote member that
+is not yet in the roster arrives later as a `peer-joined`.
+
+The broker can be embedded: with `BUS_EMBED_BROKER`, the first process that
+finds no broker at `BUS_ADDRESS` starts one and the others connect to it, so a
+single machine needs no external service. For several machines run a
+standalone broker with `python -m core.bus --address tcp:0.0.0.0:8799`.
+
+Wire format: 4-byte big-endian length followed by a compact JSON object.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import errno
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import config
+from core.backend import StateBackend
+from core.outbound import COALESCE, Frame, overflow_policy
+
+
+logger = logging.getLogger(__name__)
+
+
+_MAX_MESSAGE = 16 * 1024 * 1024
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    """`unix:/path/to.sock` or `tcp:host:port` -> (kind, target)."""
+
+    kind, _, rest = address.partition(":")
+    if kind == "unix" and rest:
+        return "unix", rest
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        if host and port.isdigit():
+            return "tcp", (host, int(port))
+    raise ValueError(f"invalid bus address: {address!r}")
+
+
+def pack(msg: Dict[str, Any]) -> bytes:
+    body = json.dumps(msg, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return len(body).to_bytes(4, "big") + body
+
+
+async def read_message(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """The next message; None once the connection is closed or unusable."""
+
+    try:
+        header = await reader.readexactly(4)
+        size = int.from_bytes(header, "big")
+        if size > _MAX_MESSAGE:
+            raise ValueError(f"bus message too large: {size}")
+        msg = json.loads(await reader.readexactly(size))
+        if not isinstance(msg, dict):
+            raise ValueError("bus message is not an object")
+        return msg
+    except (asyncio.IncompleteReadError, OSError):
+        return None
+    except ValueError as e:
+        # Bad length or body: nothing after it can be framed, so treat the
+        # connection as lost (the client reconnects and resyncs).
+        logger.warning("bus stream corrupt, dropping connection: %s", e)
+        return None
+
+
+async def open_connection(address: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    kind, target = parse_address(address)
+    if kind == "unix":
+        return await asyncio.open_unix_connection(target)
+    return await asyncio.open_connection(*target)
+
+
+class BusBroker:
+    """Routes bus traffic between processes and keeps the peer directory."""
+
+    def __init__(self, address: str) -> None:
+        self.address = address
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        # node_id -> writer
+        self._nodes: Dict[str, asyncio.StreamWriter] = {}
+        # peer_id -> [node_id, room, name]
+        self._peers: Dict[str, List[str]] = {}
+        # room -> {node_id: members on that node}
+        self._room_nodes: Dict[str, Dict[str, int]] = {}
+
+    async def start(self) -> None:
+        """Bind the broker; raises OSError(EADDRINUSE) if another one is live."""
+
+        kind, target = parse_address(self.address)
+        if kind == "unix":
+            if os.path.exists(target):
+                try:
+                    _, writer = await asyncio.open_unix_connection(target)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.unlink(target)  # stale socket from a dead broker
+                else:
+                    writer.close()
+                    raise OSError(errno.EADDRINUSE, f"bus broker already running at {target}")
+            self._server = await asyncio.start_unix_server(self._handle, path=target)
+        else:
+            host, port = target
+            self._server = await asyncio.start_server(self._handle, host=host, port=port)
+        logger.info("bus broker listening address=%s", self.address)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._nodes.values()):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _send(self, node: str, data: bytes) -> None:
+        writer = self._nodes.get(node)
+        if writer is None:
+            return
+        transport = writer.transport
+        if transport.get_write_buffer_size() > config.BUS_NODE_BUFFER_MAX:
+            logger.warning("bus node too slow, disconnecting node=%s", node)
+            writer.close()
+            return
+        writer.write(data)
+
+    def _send_others(self, origin: str, data: bytes) -> None:
+        for node in list(self._nodes):
+            if node != origin:
+                self._send(node, data)
+
+    def _track_room(self, room: str, node: str, delta: int) -> None:
+        if not room:
+            return
+        nodes = self._room_nodes.setdefault(room, {})
+        count = nodes.get(node, 0) + delta
+        if count > 0:
+            nodes[node] = count
+        else:
+            nodes.pop(node, None)
+            if not nodes:
+                self._room_nodes.pop(room, None)
+
+    def _drop_peer(self, peer_id: str) -> Optional[List[str]]:
+        entry = self._peers.pop(peer_id, None)
+        if entry is not None:
+            self._track_room(entry[1], entry[0], -1)
+        return entry
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        hello = await read_message(reader)
+        if not hello or hello.get("op") != "hello" or not hello.get("node"):
+            writer.close()
+            return
+        node = str(hello["node"])
+
+        previous = self._nodes.get(node)
+        if previous is not None:
+            previous.close()
+        self._nodes[node] = writer
+        logger.info("bus node connected node=%s nodes=%s", node, len(self._nodes))
+
+        snapshot = [[pid, e[0], e[1], e[2]] for pid, e in self._peers.items() if e[0] != node]
+        writer.write(pack({"op": "snapshot", "peers": snapshot}))
+
+        try:
+            while True:
+                msg = await read_message(reader)
+                if msg is None:
+                    break
+                self._dispatch(node, msg)
+        except Exception:
+            logger.exception("bus node error node=%s", node)
+        finally:
+            if self._nodes.get(node) is writer:
+                del self._nodes[node]
+                self._node_lost(node)
+            writer.close()
+
+    def _dispatch(self, node: str, msg: Dict[str, Any]) -> None:
+        op = msg.get("op")
+
+        if op == "peer":
+            entry = self._peers.get(msg.get("to", ""))
+            if entry is not None and entry[0] != node:
+                self._send(entry[0], pack(msg))
+            return
+
+        if op == "room":
+            for target in list(self._room_nodes.get(msg.get("room", ""), ())):
+                if target != node:
+                    self._send(target, pack(msg))
+            return
+
+        peer_id = str(msg.get("peer", ""))
+        if not peer_id:
+            return
+        msg["node"] = node
+
+        if op == "up":
+            self._drop_peer(peer_id)
+            self._peers[peer_id] = [node, "", ""]
+        elif op == "member":
+            entry = self._peers.get(peer_id)
+            if entry is None:
+                entry = self._peers[peer_id] = [node, "", ""]
+            self._track_room(entry[1], node, -1)
+            entry[1] = str(msg.get("room", ""))
+            entry[2] = str(msg.get("name", ""))
+            self._track_room(entry[1], node, +1)
+        elif op == "down":
+            self._drop_peer(peer_id)
+        else:
+            return
+        self._send_others(node, pack(msg))
+
+    def _node_lost(self, node: str) -> None:
+        lost = [pid for pid, entry in self._peers.items() if entry[0] == node]
+        logger.info("bus node lost node=%s peers=%s", node, len(lost))
+        for pid in lost:
+            self._drop_peer(pid)
+            data = pack({"op": "down", "peer": pid, "node": node, "lost": True})
+            for other in list(self._nodes):
+                self._send(other, data)
+
+
+class BusBackend(StateBackend):
+    """State backend that shares membership and routes messages over the bus."""
+
+    name = "bus"
+
+    def __init__(
+        self,
+        address: Optional[str] = None,
+        node_id: Optional[str] = None,
+        embed_broker: Optional[bool] = None,
+    ) -> None:
+        self.address = address or config.BUS_ADDRESS
+        self.node_id = node_id or config.NODE_ID
+        self.embed_broker = config.BUS_EMBED_BROKER if embed_broker is None else embed_broker
+
+        # peer_id -> [node_id, room, name] for peers owned by other processes
+        self.remote: Dict[str, List[str]] = {}
+        self._unconfirmed: Set[str] = set()
+
+        self._broker: Optional[BusBroker] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self.connected = asyncio.Event()
+
+        self.sent = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="bus-client")
+
+    async def stop(self) -> None:
+        task = self._task
+        self._task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._broker is not None:
+            await self._broker.stop()
+            self._broker = None
+
+    # -- outgoing ---------------------------------------------------------
+
+    def _publish(self, msg: Dict[str, Any]) -> bool:
+        writer = self._writer
+        if writer is None:
+            # Relays/broadcasts are time-sensitive; membership is resent in
+            # full on reconnect, so nothing is buffered while disconnected.
+            self.dropped += 1
+            return False
+        writer.write(pack(msg))
+        self.sent += 1
+        return True
+
+    def peer_up(self, peer_id: str) -> None:
+        self._publish({"op": "up", "peer": peer_id})
+
+    def peer_down(self, peer_id: str, reason: str = "disconnect") -> None:
+        self._publish({"op": "down", "peer": peer_id, "reason": reason})
+
+    def member(self, peer_id: str, room: str, name: str) -> None:
+        self._publish({"op": "member", "peer": peer_id, "room": room, "name": name})
+
+    def send_to_remote(self, peer_id: str, frame: Frame) -> bool:
+        if peer_id not in self.remote:
+            return False
+        return self._publish({"op": "peer", "to": peer_id, "mtype": frame.mtype, "text": frame.text})
+
+    def broadcast_remote(self, room: str, frame: Frame, exclude: Optional[str]) -> None:
+        self._publish({"op": "room", "room": room, "exclude": exclude, "mtype": frame.mtype, "text": frame.text})
+
+    # -- connection -------------------------------------------------------
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            return await open_connection(self.address)
+        except OSError:
+            if not self.embed_broker or self._broker is not None:
+                raise
+        broker = BusBroker(self.address)
+        try:
+            await broker.start()
+            self._broker = broker
+        except OSError as e:
+            # Another worker won the race to host the broker.
+            logger.debug("bus embedded broker not started: %s", e)
+        return await open_connection(self.address)
+
+    async def _run(self) -> None:
+        from core import state
+
+        backoff = 0.1
+        while True:
+            try:
+                reader, writer = await self._connect()
+            except OSError as e:
+                logger.info("bus connect failed address=%s error=%s", self.address, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+
+            backoff = 0.1
+            writer.write(pack({"op": "hello", "node": self.node_id}))
+            self._writer = writer
+            # Re-announce everything we own; the broker may be new.
+            for peer in list(state.PEERS.values()):
+                self.peer_up(peer.peer_id)
+                if peer.room:
+                    self.member(peer.peer_id, peer.room, peer.name)
+            self._unconfirmed = set(self.remote)
+            purge = asyncio.create_task(self._purge_unconfirmed(), name="bus-resync")
+            self.connected.set()
+            logger.info("bus connected node=%s address=%s", self.node_id, self.address)
+
+            try:
+                while True:
+                    msg = await read_message(reader)
+                    if msg is None:
+                        break
+                    try:
+                        self._dispatch(msg)
+                    except Exception:
+                        logger.exception("bus dispatch failed op=%s", msg.get("op"))
+            finally:
+                self.connected.clear()
+                self._writer = None
+                purge.cancel()
+                writer.close()
+            logger.warning("bus disconnected node=%s", self.node_id)
+            await asyncio.sleep(backoff)
+
+    async def _purge_unconfirmed(self) -> None:
+        await asyncio.sleep(config.BUS_RESYNC_GRACE_SEC)
+        for peer_id in list(self._unconfirmed):
+            self._remote_down(peer_id, "node-lost")
+        self._unconfirmed.clear()
+
+    # -- incoming ---------------------------------------------------------
+
+    def _dispatch(self, msg: Dict[str, Any]) -> None:
+        from core import state
+
+        op = msg.get("op")
+
+        if op == "peer":
+            peer = state.PEERS.get(msg.get("to", ""))
+            if peer is not None:
+                peer.outbox.put(_frame(msg))
+            return
+
+        if op == "room":
+            state.broadcast_room(msg.get("room", ""), _frame(msg), exclude=msg.get("exclude"), local_only=True)
+            return
+
+        if op == "snapshot":
+            for peer_id, node, room, name in msg.get("peers", []):
+                self._remote_member(peer_id, node, room, name)
+            return
+
+        peer_id = str(msg.get("peer", ""))
+        if op == "up":
+            self._remote_member(peer_id, str(msg.get("node", "")), "", "")
+        elif op == "member":
+            self._remote_member(peer_id, str(msg.get("node", "")), str(msg.get("room", "")), str(msg.get("name", "")))
+        elif op == "down":
+            self._remote_down(peer_id, "node-lost" if msg.get("lost") else str(msg.get("reason") or "disconnect"))
+
+    def _remote_member(self, peer_id: str, node: str, room: str, name: str) -> None:
+        from core import state
+
+        if not peer_id or peer_id in state.PEERS:
+            return
+        self._unconfirmed.discard(peer_id)
+        entry = self.remote.get(peer_id)
+        old_room, old_name = (entry[1], entry[2]) if entry is not None else ("", "")
+        self.remote[peer_id] = [node, room, name]
+        state.apply_remote_member(peer_id, old_room, room, name)
+
+        # Presence for local members, as the owning process sent its own (a
+        # re-announcement after a reconnect changes nothing and says nothing).
+        notices = []
+        if old_room and old_room != room:
+            reason = "switched-room" if room else "left"
+            notices.append(state.Notice(old_room, {"type": "peer-left", "peer_id": peer_id, "reason": reason}, peer_id))
+        if room and (room != old_room or name != old_name):
+            joined = {"type": "peer-joined", "peer": {"peer_id": peer_id, "name": name}}
+            notices.append(state.Notice(room, joined, peer_id))
+        state.deliver(notices)
+
+    def _remote_down(self, peer_id: str, reason: str) -> None:
+        from core import state
+
+        entry = self.remote.pop(peer_id, None)
+        if entry is None:
+            return
+        room = entry[1]
+        state.apply_remote_member(peer_id, room, "")
+        if room:
+            state.deliver([state.Notice(room, {"type": "peer-left", "peer_id": peer_id, "reason": reason}, peer_id)])
+
+
+def _frame(msg: Dict[str, Any]) -> Frame:
+    mtype = str(msg.get("mtype", ""))
+    text = str(msg.get("text", ""))
+    if overflow_policy(mtype) == COALESCE:
+        # Coalescing needs the payload to find the subject peer.
+        return Frame(json.loads(text))
+    return Frame(text=text, mtype=mtype)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Standalone signaling bus broker")
+    parser.add_argument("--address", default=config.BUS_ADDRESS, help="unix:/path.sock or tcp:host:port")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level="INFO", format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    async def _serve() -> None:
+        broker = BusBroker(args.address)
+        await broker.start()
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(_serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,268 @@
+"""Traffic capture: inbound frames with timing, for replay (bench/replay.py).
+
+With `VC_SERVER_CAPTURE=<path>` every connection's opening, inbound frames
+and close are appended to a binary file:
+
+    header   b"VCCAP\\x01", u32 length, JSON {"started", "node", "payloads"}
+    record   struct RECORD (little endian), then `mtype`, then `payload`
+
+    kind     u8   OPEN, FRAME or CLOSE
+    flags    u8   BINARY (a binary WebSocket frame), RESUMED (on OPEN)
+    t        f64  seconds since the capture started
+    handle   u32  connection number within the capture (peer ids are not kept)
+    size     u32  frame length (characters of text / bytes); CLOSE: close code
+    to       i32  handle of the relay target; NO_PEER without one, UNKNOWN_PEER
+                  for a peer id the capture never saw connect
+    room     i32  room number within the capture for `join`, else -1
+    mtype    u8 length + utf-8: message type ("invalid" if undecodable,
+                  "oversize" past `MAX_FRAME_BYTES`); OPEN: the codec name
+    payload  u32 length + the frame as received; empty unless
+             `VC_SERVER_CAPTURE_PAYLOADS=1` (payloads carry SDP, ICE addresses
+             and whatever clients broadcast; never for "oversize")
+
+`open_capture` creates the file exclusively and writes the header, so a path
+already in use (another run, or another worker without "{pid}") is refused
+up front. Like the journal, recording is a list append on the event loop and
+file I/O runs in a thread every `CAPTURE_FLUSH_SEC`. Frames are decoded for
+their type/target in that thread when payloads are kept; without payloads
+they are decoded when recorded, so no frame is held until the flush. Frames
+the server rejects for size are recorded by size only. The capture stops at
+`CAPTURE_MAX_BYTES`; frames beyond `CAPTURE_MAX_PENDING` between flushes are
+dropped and counted.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import config
+from core import metrics
+from core.codec import CODECS
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"VCCAP\x01"
+RECORD = struct.Struct("<BBdIIiiB")
+
+OPEN, FRAME, CLOSE = 1, 2, 3
+BINARY, RESUMED = 1, 2
+NO_PEER, UNKNOWN_PEER = -1, -2
+
+_MAX_MTYPE = 64
+
+
+class Record(NamedTuple):
+    kind: int
+    flags: int
+    t: float
+    handle: int
+    size: int
+    to: int
+    room: int
+    mtype: str
+    payload: bytes
+
+
+def read_capture(f: BinaryIO) -> Tuple[Dict[str, Any], Iterator[Record]]:
+    """The header and an iterator over the records of a capture file."""
+
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a capture file")
+    (length,) = struct.unpack("<I", f.read(4))
+    header = json.loads(f.read(length).decode("utf-8"))
+
+    def records() -> Iterator[Record]:
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return  # end of file, or a torn write at the tail
+            kind, flags, t, handle, size, to, room, mtype_len = RECORD.unpack(head)
+            mtype = f.read(mtype_len).decode("utf-8", "replace")
+            raw = f.read(4)
+            if len(raw) < 4:
+                return
+            payload = f.read(struct.unpack("<I", raw)[0])
+            yield Record(kind, flags, t, handle, size, to, room, mtype, payload)
+
+    return header, records()
+
+
+# (type, target handle, room number) of an inbound frame
+_Described = Tuple[str, int, int]
+
+# (kind, flags, perf_counter, handle, size or close code,
+#  frame, its description, or codec name)
+_Pending = Tuple[int, int, float, int, int, Union[str, bytes, _Described]]
+
+_OVERSIZE: _Described = ("oversize", NO_PEER, -1)
+
+
+class Capture:
+    def __init__(self, path: str, payloads: bool) -> None:
+        self.path = path
+        self.payloads = payloads
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.pending: List[_Pending] = []
+        self.written = 0
+        self.full = False
+        self._next_handle = 0
+        # peer_id -> handle (assigned on the loop, read by the writer thread)
+        self._handles: Dict[str, int] = {}
+        # Touched by whoever runs `_describe`: the writer thread with
+        # payloads, the loop without.
+        self._rooms: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # -- recording (event loop) ---------------------------------------------
+
+    def opened(self, peer_id: str, codec: str, resumed: bool) -> int:
+        handle = self._handles.get(peer_id) if resumed else None
+        if handle is None:
+            handle = self._handles[peer_id] = self._next_handle
+            self._next_handle += 1
+        self._add((OPEN, RESUMED if resumed else 0, time.perf_counter(), handle, 0, codec))
+        return handle
+
+    def frame(self, handle: int, received: float, data: Union[str, bytes]) -> None:
+        if self.full:
+            return
+        flags = 0 if isinstance(data, str) else BINARY
+        self._add((FRAME, flags, received, handle, len(data), data if self.payloads else self._describe(data)))
+
+    def oversize(self, handle: int, received: float, data: Union[str, bytes]) -> None:
+        """A frame rejected for size: only its length is kept."""
+
+        self._add((FRAME, 0 if isinstance(data, str) else BINARY, received, handle, len(data), _OVERSIZE))
+
+    def closed(self, handle: int, code: int) -> None:
+        self._add((CLOSE, 0, time.perf_counter(), handle, code, ""))
+
+    def _add(self, entry: _Pending) -> None:
+        if self.full:
+            return
+        if len(self.pending) >= config.CAPTURE_MAX_PENDING:
+            metrics.CAPTURE_DROPPED.inc()
+            return
+        self.pending.append(entry)
+
+    # -- writing (thread) ---------------------------------------------------
+
+    def _describe(self, data: Union[str, bytes]) -> _Described:
+        """(type, target handle, room number) of an inbound frame."""
+
+        try:
+            msg = json.loads(data) if isinstance(data, str) else CODECS["vc.msgpack"].decode(data)
+        except Exception:
+            msg = None
+        if not isinstance(msg, dict):
+            return "invalid", NO_PEER, -1
+        mtype = str(msg.get("type", ""))[:_MAX_MTYPE]
+        to = NO_PEER
+        if "to" in msg:
+            to = self._handles.get(str(msg["to"]).strip(), UNKNOWN_PEER)
+        room = -1
+        if mtype == "join":
+            name = str(msg.get("room", "")).strip()
+            room = self._rooms.get(name, -1)
+            if room < 0 and name:
+                room = self._rooms[name] = len(self._rooms)
+        return mtype, to, room
+
+    def _write(self, entries: List[_Pending]) -> int:
+        parts: List[bytes] = []
+        for kind, flags, at, handle, size, data in entries:
+            to, room = NO_PEER, -1
+            if kind == FRAME and isinstance(data, tuple):
+                (mtype, to, room), payload = data, b""
+            elif kind == FRAME:
+                mtype, to, room = self._describe(data)
+                payload = data.encode("utf-8") if isinstance(data, str) else data
+            else:
+                mtype, payload = str(data), b""
+            name = mtype.encode("utf-8")
+            parts.append(RECORD.pack(kind, flags, at - self.started, handle, size, to, room, len(name)))
+            parts.append(name)
+            parts.append(struct.pack("<I", len(payload)))
+            parts.append(payload)
+        blob = b"".join(parts)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        with os.fdopen(fd, "ab") as f:
+            f.write(blob)
+            return f.tell()
+
+    def create(self) -> None:
+        """Create the file with its header; fails if it exists (blocking I/O)."""
+
+        # One capture per file: the header's start time anchors every `t`.
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            raise ValueError(f"capture file exists: {self.path}") from None
+        header = json.dumps({"started": self.started_at, "node": config.NODE_ID, "payloads": self.payloads}).encode()
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(header)) + header)
+            self.written = f.tell()
+
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+        entries, self.pending = self.pending, []
+        self.written = await asyncio.to_thread(self._write, entries)
+        if self.written >= config.CAPTURE_MAX_BYTES and not self.full:
+            self.full = True
+            logger.warning("capture stopped at max size path=%s bytes=%s", self.path, self.written)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(config.CAPTURE_FLUSH_SEC)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("capture write failed")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="capture")
+
+    async def stop(self) -> None:
+        task = self._task
+        self._task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+
+CAPTURE: Optional[Capture] = None
+
+
+async def open_capture(path: str, payloads: bool = False) -> None:
+    """Start capturing to `path` ("{pid}" in it is replaced, for --workers)."""
+
+    global CAPTURE
+    path = path.replace("{pid}", str(os.getpid()))
+    cap = Capture(path, payloads)
+    await asyncio.to_thread(cap.create)
+    CAPTURE = cap
+    cap.start()
+    logger.info("capture started path=%s payloads=%s", path, payloads)
+
+
+async def close_capture() -> None:
+    global CAPTURE
+    capture = CAPTURE
+    if capture is not None:
+        CAPTURE = None
+        await capture.stop()
+        logger.info("capture closed path=%s bytes=%s", capture.path, capture.written)
@@ -0,0 +1,104 @@
+"""Room placement across server nodes by consistent hashing.
+
+Every room maps to one node, so all members of a room can be connected to
+the same process and join/offer/answer never cross the bus. Each node is
+placed on the ring at many virtual points for an even spread; adding or
+removing a node only moves the rooms whose arc it gains or loses (about
+1/N of them).
+
+Configured with `VC_SERVER_CLUSTER_NODES`, e.g.
+`a=wss://a.example.com/ws,b=wss://b.example.com/ws`; this node's entry is
+the one named by `VC_SERVER_NODE_ID`. Empty disables placement.
+"""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Optional[Dict[str, str]] = None, vnodes: int = 128) -> None:
+        self.vnodes = vnodes
+        self._urls: Dict[str, str] = {}
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for node_id, url in (nodes or {}).items():
+            self.add_node(node_id, url)
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+    @property
+    def nodes(self) -> Dict[str, str]:
+        return dict(self._urls)
+
+    def add_node(self, node_id: str, url: str) -> None:
+        if node_id in self._urls:
+            self._urls[node_id] = url
+            return
+        self._urls[node_id] = url
+        for i in range(self.vnodes):
+            point = _hash(f"{node_id}#{i}")
+            idx = bisect.bisect_left(self._points, point)
+            self._points.insert(idx, point)
+            self._owners.insert(idx, node_id)
+
+    def remove_node(self, node_id: str) -> None:
+        if self._urls.pop(node_id, None) is None:
+            return
+        keep = [(p, o) for p, o in zip(self._points, self._owners) if o != node_id]
+        self._points = [p for p, _ in keep]
+        self._owners = [o for _, o in keep]
+
+    def owner(self, room: str) -> Optional[str]:
+        if not self._points:
+            return None
+        idx = bisect.bisect_right(self._points, _hash(room))
+        if idx == len(self._points):
+            idx = 0
+        return self._owners[idx]
+
+    def locate(self, room: str) -> Tuple[Optional[str], Optional[str]]:
+        """(node_id, url) that should host `room`."""
+
+        node_id = self.owner(room)
+        return node_id, (self._urls.get(node_id) if node_id else None)
+
+
+def parse_nodes(spec: str) -> Dict[str, str]:
+    nodes: Dict[str, str] = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        node_id, sep, url = item.partition("=")
+        if not sep or not node_id.strip() or not url.strip():
+            raise ValueError(f"invalid cluster node entry: {item!r} (expected id=url)")
+        nodes[node_id.strip()] = url.strip()
+    return nodes
+
+
+RING = HashRing(parse_nodes(config.CLUSTER_NODES), vnodes=config.CLUSTER_VNODES)
+
+
+def enabled() -> bool:
+    return len(RING) > 0
+
+
+def misplaced(room: str) -> Optional[Tuple[str, Optional[str]]]:
+    """If `room` belongs to another node, return that node's (id, url)."""
+
+    if not enabled():
+        return None
+    node_id, url = RING.locate(room)
+    if node_id is None or node_id == config.NODE_ID:
+        return None
+    return node_id, url
@@ -0,0 +1,110 @@
+"""Wire codecs for `/ws`, negotiated per connection via `Sec-WebSocket-Protocol`.
+
+- `vc.json` (default, also used when the client offers no subprotocol): JSON
+  text frames.
+- `vc.msgpack`: MessagePack binary frames. Only offered when the optional
+  `msgpack` package is installed.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+try:
+    import msgpack  # type: ignore
+except Exception:  # optional dependency
+    msgpack = None
+
+
+class Codec:
+    name = ""
+    binary = False
+    error = "invalid-frame"  # error code sent back for undecodable frames
+
+    def encode(self, payload: Dict[str, Any]) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        raise NotImplementedError
+
+    def encode_batch(self, parts: List[Union[str, bytes]]) -> Union[str, bytes]:
+        """`{"type": "batch", "messages": [...]}` around already encoded messages."""
+
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "vc.json"
+    binary = False
+    error = "invalid-json"
+
+    def encode(self, payload: Dict[str, Any]) -> str:
+        return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+    def encode_batch(self, parts: List[Union[str, bytes]]) -> str:
+        return '{"type":"batch","messages":[' + ",".join(parts) + "]}"  # type: ignore[arg-type]
+
+
+class MsgpackCodec(Codec):
+    name = "vc.msgpack"
+    binary = True
+    error = "invalid-msgpack"
+
+    def encode(self, payload: Dict[str, Any]) -> bytes:
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            # Text frames are always JSON, whatever was negotiated.
+            return json.loads(data)
+        return msgpack.unpackb(data, raw=False)
+
+    def encode_batch(self, parts: List[Union[str, bytes]]) -> bytes:
+        n = len(parts)
+        if n < 16:
+            header = bytes((0x90 | n,))
+        elif n < 0x10000:
+            header = b"\xdc" + n.to_bytes(2, "big")
+        else:
+            header = b"\xdd" + n.to_bytes(4, "big")
+        return _BATCH_PREFIX + header + b"".join(parts)  # type: ignore[arg-type]
+
+
+JSON = JsonCodec()
+
+# Map of two entries, "type": "batch", then the "messages" key; the array
+# header and the encoded messages follow.
+_BATCH_PREFIX = (
+    b"\x82" + msgpack.packb("type") + msgpack.packb("batch") + msgpack.packb("messages")
+    if msgpack is not None
+    else b""
+)
+
+# subprotocol name -> codec
+CODECS: Dict[str, Codec] = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def negotiate(offered: Sequence[str]) -> Tuple[Codec, Optional[str]]:
+    """Pick a codec from the client's offered subprotocols.
+
+    The first offered one we support wins: clients list subprotocols in their
+    order of preference. Returns the codec and the subprotocol to echo in the
+    handshake (None when the client offered nothing we know, so old clients
+    see no change).
+    """
+
+    for name in offered:
+        codec = CODECS.get(name.strip())
+        if codec is not None:
+            return codec, codec.name
+    return JSON, None
+
+
+def available() -> List[str]:
+    return list(CODECS)
@@ -0,0 +1,52 @@
+"""Graceful drain before a restart or deploy.
+
+Every connected client gets `{"type": "reconnect", "after_ms": ..., "resume":
+"<token>"}` and is disconnected with `DRAIN_CLOSE_CODE`; the delays are
+spread in batches of `DRAIN_BATCH_SIZE`, `DRAIN_BATCH_INTERVAL_MS` apart, so
+the reconnects reach the next process gradually instead of all at once.
+Sessions stay resumable and are written to the snapshot (see core.journal),
+so clients come back into their rooms with their old ids.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+
+import config
+from core import journal
+from core.state import PEERS, issue_resume_token
+
+
+logger = logging.getLogger(__name__)
+
+
+_DRAINING = False
+
+
+def draining() -> bool:
+    return _DRAINING
+
+
+def reconnect_delay_ms(index: int) -> int:
+    """Delay for the index-th client told to reconnect: its batch plus jitter."""
+
+    interval = config.DRAIN_BATCH_INTERVAL_MS
+    return (index // config.DRAIN_BATCH_SIZE) * interval + random.randrange(max(1, interval))
+
+
+def drain() -> int:
+    """Tell every connected client to reconnect later; returns how many were told."""
+
+    global _DRAINING
+    _DRAINING = True
+    peers = [p for p in PEERS.values() if not p.detached_at]
+    random.shuffle(peers)
+    for index, peer in enumerate(peers):
+        token = issue_resume_token(peer)
+        peer.outbox.put({"type": "reconnect", "after_ms": reconnect_delay_ms(index), "resume": token})
+        peer.outbox.finish(config.DRAIN_CLOSE_CODE, "drain")
+    if journal.JOURNAL is not None:
+        journal.JOURNAL.request_compact()
+    logger.info("drain started peers=%s", len(peers))
+    return len(peers)
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+import config
+from core import metrics
+from core.outbound import Frame, encode_json
+from core.state import PEERS, remove_peer
+
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatWheel:
+    """Hashed timing wheel that pings and times out every peer from one task.
+
+    Each slot covers `tick` seconds; a peer sits in exactly one slot, the one
+    for its next check. A sweep handles a whole slot in batches with a single
+    pre-encoded ping frame, so the cost of keepalive does not grow with one
+    timer (and one encode) per connection.
+    """
+
+    def __init__(self, interval: float, timeout: float, tick: float = 1.0) -> None:
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+        self._nslots = int(math.ceil(interval / tick)) + 1
+        self._slots: List[List[str]] = [[] for _ in range(self._nslots)]
+        self._origin = 0.0
+        self._current = 0
+        self._task: Optional[asyncio.Task] = None
+
+        self.watched = 0
+        self.pings = 0
+        self.timeouts = 0
+
+    def _tick_at(self, when: float) -> int:
+        return int((when - self._origin) / self.tick)
+
+    def watch(self, peer_id: str, now: Optional[float] = None) -> None:
+        """Start heartbeating a peer; it is dropped lazily once it leaves PEERS."""
+
+        now = time.monotonic() if now is None else now
+        self._schedule(peer_id, self._tick_at(now + self.interval))
+        self.watched += 1
+
+    def _schedule(self, peer_id: str, due: int) -> None:
+        # Never schedule into the slot being swept or past a full turn of the wheel.
+        due = min(max(due, self._current + 1), self._current + self._nslots - 1)
+        self._slots[due % self._nslots].append(peer_id)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._origin = time.monotonic()
+            self._current = 0
+            self._task = asyncio.create_task(self._run(), name="heartbeat-wheel")
+
+    async def stop(self) -> None:
+        task = self._task
+        self._task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            next_at = self._origin + (self._current + 1) * self.tick
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._current += 1
+            try:
+                await self._sweep(self._current)
+            except Exception:
+                logger.exception("heartbeat sweep failed")
+
+    async def _sweep(self, tick: int) -> None:
+        slot_index = tick % self._nslots
+        due = self._slots[slot_index]
+        if not due:
+            return
+        self._slots[slot_index] = []
+
+        now = time.time()
+        ping = Frame(text=encode_json({"type": "ping", "ts": int(now)}), mtype="ping")
+        next_due = tick + max(1, int(round(self.interval / self.tick)))
+        expired = []
+
+        batch = config.HEARTBEAT_BATCH
+        for start in range(0, len(due), batch):
+            for peer_id in due[start : start + batch]:
+                peer = PEERS.get(peer_id)
+                if not peer:
+                    continue
+                if now - peer.last_seen > self.timeout:
+                    expired.append(peer)
+                    continue
+                if not peer.outbox.put(ping) and peer.outbox.closed:
+                    logger.info("peer ping send failed peer_id=%s", peer_id)
+                    expired.append(peer)
+                    continue
+                self.pings += 1
+                self._schedule(peer_id, next_due)
+            if start + batch < len(due):
+                # Let the rest of the loop breathe between batches.
+                await asyncio.sleep(0)
+
+        for peer in expired:
+            reason = "send-failed" if peer.outbox.closed else "timeout"
+            if reason == "timeout":
+                logger.info("peer timeout peer_id=%s", peer.peer_id)
+                self.timeouts += 1
+                metrics.HEARTBEAT_TIMEOUTS.inc()
+                peer.outbox.close(code=1001, reason="timeout")
+            await remove_peer(peer.peer_id, reason=reason)
+
+
+WHEEL = HeartbeatWheel(interval=config.PING_INTERVAL_SEC, timeout=config.PING_TIMEOUT_SEC, tick=config.HEARTBEAT_TICK_SEC)
+
+
+def app_pings_enabled() -> bool:
+    return config.HEARTBEAT_MODE != "protocol"
+
+
+def watch(peer_id: str) -> None:
+    if app_pings_enabled():
+        WHEEL.watch(peer_id)
+
+
+def start() -> None:
+    if app_pings_enabled():
+        WHEEL.start()
+
+
+async def stop() -> None:
+    await WHEEL.stop()
+
+
+def uvicorn_ping_options() -> Dict[str, Any]:
+    """Uvicorn keyword arguments for the configured heartbeat mode.
+
+    In "protocol" mode the WebSocket layer sends ping frames and drops peers
+    whose pong does not arrive, so a silent peer is still dropped roughly
+    PING_TIMEOUT_SEC after it was last heard from.
+    """
+
+    if app_pings_enabled():
+        return {}
+    return {
+        "ws_ping_interval": float(config.PING_INTERVAL_SEC),
+        "ws_ping_timeout": float(max(config.PING_TIMEOUT_SEC - config.PING_INTERVAL_SEC, 1)),
+    }
@@ -0,0 +1,137 @@
+"""Per-room broadcast sequence numbers and a short history for late joiners.
+
+Every `broadcast` gets the room's next `seq` (a client-sent `seq`, like
+`from`, is overwritten) and is kept in the room's ring, bounded by
+`config.HISTORY_MAX_MESSAGES`, `HISTORY_MAX_BYTES` (of JSON text) and
+`HISTORY_MAX_AGE_SEC`. A `joined` reply carries the room's current `seq` and
+the kept broadcasts after the `since` the client sent (all of them without
+one), so a joiner catches up without everyone re-broadcasting their state:
+
+    {"type": "joined", ..., "seq": 42, "history": [{"type": "broadcast", "seq": 41, ...}, ...]}
+
+`"truncated": true` means broadcasts after `since` were already evicted. A
+`since` above the current `seq` is from an earlier history of the room (it
+emptied and was forgotten) and gets the whole ring.
+
+One timer per room drops entries once the newest is older than the max age;
+the sequence counter lives on while the room has members, so `seq` never
+goes backwards for anyone in it.
+
+The counter and ring are per process, so with the bus backend (core.bus,
+`--workers`) each process would number the same room on its own and members
+would see repeated or out-of-order `seq` values. Until a room's `seq` has a
+single owner, sequencing and history are off with that backend: no `seq`,
+`history` or `truncated` is sent and `since` is ignored.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import config
+from core import metrics
+from core.outbound import Frame
+
+
+class RoomHistory:
+    __slots__ = ("seq", "entries", "size", "timer")
+
+    def __init__(self) -> None:
+        self.seq = 0
+        # (seq, monotonic time, frame, len(frame.text)), oldest first
+        self.entries: Deque[Tuple[int, float, Frame, int]] = deque()
+        self.size = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def trim(self, now: float) -> None:
+        entries = self.entries
+        horizon = now - config.HISTORY_MAX_AGE_SEC
+        while entries and (
+            len(entries) > config.HISTORY_MAX_MESSAGES or self.size > config.HISTORY_MAX_BYTES or entries[0][1] <= horizon
+        ):
+            self.size -= entries.popleft()[3]
+
+
+# room -> history, for rooms that broadcast recently or still have members
+_ROOMS: Dict[str, RoomHistory] = {}
+
+
+def enabled() -> bool:
+    return config.HISTORY_MAX_MESSAGES > 0 and config.STATE_BACKEND != "bus"
+
+
+def record(room: str, payload: Dict[str, Any]) -> Frame:
+    """Number a broadcast, keep it in the room's ring and return its shared Frame."""
+
+    h = _ROOMS.get(room)
+    if h is None:
+        h = _ROOMS[room] = RoomHistory()
+    h.seq += 1
+    payload["seq"] = h.seq
+    frame = Frame(payload)
+    now = time.monotonic()
+    size = len(frame.text)
+    h.entries.append((h.seq, now, frame, size))
+    h.size += size
+    h.trim(now)
+    if h.timer is None and h.entries:
+        h.timer = asyncio.get_running_loop().call_later(config.HISTORY_MAX_AGE_SEC, _expire, room)
+    return frame
+
+
+def replay(room: str, since: Optional[int] = None) -> Tuple[int, str, bool]:
+    """(current seq, JSON array of kept broadcasts after `since`, truncated)."""
+
+    h = _ROOMS.get(room)
+    if h is None:
+        return 0, "[]", False
+    h.trim(time.monotonic())
+    if since is None or since > h.seq:
+        since = 0
+        asked = False
+    else:
+        asked = True
+    entries = h.entries
+    first = entries[0][0] if entries else h.seq + 1
+    texts: List[str] = [frame.text for seq, _, frame, _ in entries if seq > since]
+    return h.seq, "[" + ",".join(texts) + "]", asked and since + 1 < first
+
+
+def room_closed(room: str) -> None:
+    """The room lost its last member; forget it once nothing is kept."""
+
+    h = _ROOMS.get(room)
+    if h is not None and not h.entries:
+        _drop(room, h)
+
+
+def _drop(room: str, h: RoomHistory) -> None:
+    if h.timer is not None:
+        h.timer.cancel()
+        h.timer = None
+    if _ROOMS.get(room) is h:
+        del _ROOMS[room]
+
+
+def _expire(room: str) -> None:
+    from core.state import ROOMS
+
+    h = _ROOMS.get(room)
+    if h is None:
+        return
+    h.timer = None
+    now = time.monotonic()
+    h.trim(now)
+    if h.entries:
+        # Come back when the newest kept entry ages out.
+        h.timer = asyncio.get_running_loop().call_later(h.entries[-1][1] + config.HISTORY_MAX_AGE_SEC - now, _expire, room)
+    elif room not in ROOMS:
+        _drop(room, h)
+
+
+metrics.REGISTRY.register(
+    metrics.Gauge("vc_history_bytes", "JSON text kept in room broadcast histories.", lambda: sum(h.size for h in _ROOMS.values()))
+)
@@ -0,0 +1,282 @@
+"""On-disk snapshot of local sessions for warm restarts.
+
+With `VC_SERVER_STATE_DIR` set, membership changes of this process's peers
+(resume token, room, name) are appended to a journal, flushed every
+`JOURNAL_FLUSH_SEC` from a background task, and compacted into a snapshot
+every `SNAPSHOT_INTERVAL_SEC` and on shutdown:
+
+    snapshot.json       {"gen": g, "saved_at": ..., "peers": [[id, token, room, name], ...]}
+    journal.<g>.jsonl   ["t", id, token] | ["m", id, room, name] | ["d", id]
+
+Compaction starts a new generation, so a crash at any point leaves either
+the old snapshot with its complete journal or the new snapshot. On startup
+the snapshot and its journal are replayed and every session comes back as a
+detached peer waiting `RESTORE_GRACE_SEC` for its client to resume (see
+core.state.detach_peer), so rooms refill without any presence traffic.
+Entries of the wrong shape (an old or partial write) are skipped and logged,
+and a malformed snapshot is treated like an unreadable one: start empty.
+
+Recording is a list append on the event loop; all file I/O runs in a thread.
+The files hold resume tokens and are created readable by the owner only.
+
+A directory belongs to one process: `open_journal` takes an exclusive lock
+on its `lock` file (where the platform has `fcntl`) and refuses a directory
+another live process holds, so two processes never restore the same sessions
+or overwrite each other's snapshot. `--workers` refuses `VC_SERVER_STATE_DIR`
+for the same reason.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks
+    fcntl = None  # type: ignore[assignment]
+
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.gen = 0
+        self.pending: List[Tuple[Any, ...]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._compact_now = asyncio.Event()
+        self._lock_fd: Optional[int] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _log_path(self, gen: int) -> str:
+        return self._path(f"journal.{gen}.jsonl")
+
+    # -- restore ------------------------------------------------------------
+
+    def lock(self) -> None:
+        """Claim the directory for this process (blocking I/O).
+
+        Raises RuntimeError if another process holds it.
+        """
+
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        if fcntl is None:
+            return
+        fd = os.open(self._path("lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise RuntimeError(f"state directory in use by another process: {self.directory}") from None
+        self._lock_fd = fd
+
+    def unlock(self) -> None:
+        fd, self._lock_fd = self._lock_fd, None
+        if fd is not None:
+            os.close(fd)
+
+    def load(self) -> Dict[str, List[str]]:
+        """peer_id -> [token, room, name] as of the last flush (blocking I/O)."""
+
+        peers: Dict[str, List[str]] = {}
+        try:
+            with open(self._path("snapshot.json"), "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            snapshot = {"gen": 0, "saved_at": 0, "peers": []}
+        except (OSError, ValueError):
+            logger.exception("journal snapshot unreadable, starting empty")
+            snapshot = {"gen": 0, "saved_at": 0, "peers": []}
+
+        skipped = 0
+        try:
+            if not isinstance(snapshot, dict):
+                raise TypeError(f"snapshot is {type(snapshot).__name__}, not an object")
+            self.gen = int(snapshot.get("gen", 0))
+            saved_at = float(snapshot.get("saved_at", 0))
+            for entry in snapshot.get("peers", []):
+                if isinstance(entry, list) and len(entry) == 4 and all(isinstance(v, str) for v in entry):
+                    peers[entry[0]] = entry[1:]
+                else:
+                    skipped += 1
+        except (TypeError, ValueError):
+            logger.exception("journal snapshot malformed, starting empty")
+            self.gen, saved_at, skipped = 0, 0.0, 0
+            peers.clear()
+
+        log_path = self._log_path(self.gen)
+        try:
+            saved_at = max(saved_at, os.path.getmtime(log_path))
+            with open(log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn write at the tail
+                    if not _apply(peers, entry):
+                        skipped += 1
+        except FileNotFoundError:
+            pass
+        if skipped:
+            logger.warning("journal entries malformed, skipped count=%s", skipped)
+
+        if saved_at and time.time() - saved_at > config.RESTORE_MAX_AGE_SEC:
+            logger.info("journal too old to restore age=%.0fs", time.time() - saved_at)
+            return {}
+        return peers
+
+    # -- recording ----------------------------------------------------------
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="journal")
+
+    async def stop(self) -> None:
+        task = self._task
+        self._task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.compact()
+
+    def request_compact(self) -> None:
+        self._compact_now.set()
+
+    async def _run(self) -> None:
+        next_compact = time.monotonic() + config.SNAPSHOT_INTERVAL_SEC
+        while True:
+            try:
+                await asyncio.wait_for(self._compact_now.wait(), config.JOURNAL_FLUSH_SEC)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                if self._compact_now.is_set() or time.monotonic() >= next_compact:
+                    self._compact_now.clear()
+                    await self.compact()
+                    next_compact = time.monotonic() + config.SNAPSHOT_INTERVAL_SEC
+                else:
+                    await self.flush()
+            except Exception:
+                logger.exception("journal write failed")
+
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+        entries, self.pending = self.pending, []
+        data = "".join(json.dumps(e, separators=(",", ":"), ensure_ascii=False) + "\n" for e in entries)
+        await asyncio.to_thread(_append, self._log_path(self.gen), data)
+
+    async def compact(self) -> None:
+        """Write a snapshot of the current sessions and start a new journal."""
+
+        from core.state import PEERS
+
+        # Captured on the loop, so it matches exactly what has been recorded.
+        peers = [[p.peer_id, p.resume_token, p.room, p.name] for p in PEERS.values() if p.resume_token]
+        self.pending = []
+        old_gen = self.gen
+        self.gen += 1
+        snapshot = {"gen": self.gen, "node": config.NODE_ID, "saved_at": time.time(), "peers": peers}
+        await asyncio.to_thread(self._write_snapshot, snapshot, old_gen)
+        logger.info("journal snapshot written peers=%s gen=%s", len(peers), self.gen)
+
+    def _write_snapshot(self, snapshot: Dict[str, Any], old_gen: int) -> None:
+        path = self._path("snapshot.json")
+        tmp = path + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"), ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        for gen in (old_gen, old_gen - 1):
+            try:
+                os.unlink(self._log_path(gen))
+            except FileNotFoundError:
+                pass
+
+
+def _append(path: str, data: str) -> None:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(data)
+
+
+# op -> entry length, op included
+_ARITY = {"t": 3, "m": 4, "d": 2}
+
+
+def _apply(peers: Dict[str, List[str]], entry: Any) -> bool:
+    """Apply one journal entry; False (and no change) if it is malformed."""
+
+    if not isinstance(entry, list) or not all(isinstance(v, str) for v in entry):
+        return False
+    if not entry or _ARITY.get(entry[0]) != len(entry):
+        return False
+    op = entry[0]
+    if op == "t":
+        _, peer_id, token = entry
+        peers.setdefault(peer_id, ["", "", ""])[0] = token
+    elif op == "m":
+        _, peer_id, room, name = entry
+        current = peers.setdefault(peer_id, ["", "", ""])
+        current[1] = room
+        current[2] = name
+    elif op == "d":
+        peers.pop(entry[1], None)
+    return True
+
+
+JOURNAL: Optional[Journal] = None
+
+
+def record(*entry: Any) -> None:
+    """Queue a journal entry (no-op unless persistence is enabled)."""
+
+    if JOURNAL is not None:
+        JOURNAL.pending.append(entry)
+
+
+async def open_journal(directory: str) -> int:
+    """Enable persistence and bring back the saved sessions; returns how many."""
+
+    from core import heartbeat, state
+
+    global JOURNAL
+    journal = Journal(directory)
+    await asyncio.to_thread(journal.lock)
+    saved = await asyncio.to_thread(journal.load)
+    restored = 0
+    for peer_id, (token, room, name) in saved.items():
+        if token and state.restore_peer(peer_id, token, room, name, config.RESTORE_GRACE_SEC):
+            heartbeat.watch(peer_id)
+            restored += 1
+    JOURNAL = journal
+    # Start the new generation from exactly what was restored.
+    await journal.compact()
+    journal.start()
+    if restored:
+        logger.info("restored sessions=%s rooms=%s", restored, len(state.ROOMS))
+    return restored
+
+
+async def close_journal() -> None:
+    global JOURNAL
+    journal = JOURNAL
+    if journal is not None:
+        await journal.stop()
+        journal.unlock()
+        JOURNAL = None
@@ -0,0 +1,115 @@
+"""Per-peer rate limits and escalating penalties.
+
+Every inbound frame takes a token from the peer's global bucket before it is
+decoded; once its type is known it also takes one from its class bucket
+(relay, broadcast, join or roster, see `config.RATE_LIMITS`). Frames over
+`config.MAX_FRAME_BYTES` are rejected before decoding.
+
+Each rejection is a strike; strikes are forgiven one per
+`RATE_STRIKE_DECAY_SEC`. The penalty grows with the strike count: an error
+reply, then pausing reads from the peer's socket (its own TCP backpressure
+slows it down, nobody else's), then closing it.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Optional, Tuple
+
+import config
+from core import metrics
+
+
+# Penalties, in escalating order.
+ERROR = "error"
+THROTTLE = "throttle"
+CLOSE = "close"
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now: float) -> bool:
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        self.stamp = now
+        if tokens > self.burst:
+            tokens = self.burst
+        if tokens < 1.0:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1.0
+        return True
+
+    def retry_after(self) -> float:
+        """Seconds until the next token."""
+
+        return max(0.0, (1.0 - self.tokens) / self.rate) if self.rate else 0.0
+
+
+def message_class(mtype: str, relay: bool) -> Optional[str]:
+    if relay:
+        return "relay"
+    if mtype == "broadcast":
+        return "broadcast"
+    if mtype in ("join", "leave"):
+        return "join"
+    if mtype == "roster":
+        # Paging a large room is a burst of these right after one join.
+        return "roster"
+    return None
+
+
+class PeerLimits:
+    """Token buckets and strike count of one connection.
+
+    A bucket is created on first use (starting full), so a connection that
+    never relays or broadcasts carries no bucket for those classes.
+    """
+
+    __slots__ = ("limits", "buckets", "strikes", "last_strike")
+
+    def __init__(self, now: float, limits: Optional[Dict[str, Tuple[float, float]]] = None) -> None:
+        self.limits = config.RATE_LIMITS if limits is None else limits
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.strikes = 0.0
+        self.last_strike = now
+
+    def allow(self, name: Optional[str], now: float) -> bool:
+        """Take a token from bucket `name` (unlimited if it is not configured)."""
+
+        if not name:
+            return True
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            limit = self.limits.get(name)
+            if limit is None:
+                return True
+            bucket = self.buckets[name] = TokenBucket(limit[0], limit[1], now)
+        if bucket.take(now):
+            return True
+        metrics.REJECTED.inc(f"rate-{name}")
+        return False
+
+    def retry_after(self, name: Optional[str]) -> float:
+        bucket = self.buckets.get(name) if name else None
+        return bucket.retry_after() if bucket is not None else 0.0
+
+    def strike(self, now: float) -> str:
+        """Record a rejection; returns the penalty to apply."""
+
+        forgiven = (now - self.last_strike) / config.RATE_STRIKE_DECAY_SEC
+        self.strikes = max(0.0, self.strikes - forgiven) + 1.0
+        self.last_strike = now
+        if self.strikes >= config.RATE_STRIKES_CLOSE:
+            penalty = CLOSE
+        elif self.strikes >= config.RATE_STRIKES_THROTTLE:
+            penalty = THROTTLE
+        else:
+            penalty = ERROR
+        metrics.PENALTIES.inc(penalty)
+        return penalty
@@ -0,0 +1,260 @@
+"""In-process metrics with Prometheus text exposition (`GET /metrics`).
+
+Hot-path updates are plain attribute/dict/list increments (no locks, no
+allocation): everything runs on the event loop thread. Gauges are computed
+from live state only when scraped.
+"""
+
+from __future__ import annotations
+
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    __slots__ = ("name", "help", "value")
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value += n
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        yield f"{self.name} {_fmt(self.value)}"
+
+
+class LabeledCounter:
+    """Counter with one label. Values outside `allowed` (if given) count as "other"."""
+
+    __slots__ = ("name", "help", "label", "values", "allowed")
+
+    def __init__(self, name: str, help: str, label: str, allowed: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values: Dict[str, int] = {}
+        self.allowed = frozenset(allowed)
+
+    def inc(self, value: str, n: int = 1) -> None:
+        if self.allowed and value not in self.allowed:
+            value = "other"
+        values = self.values
+        values[value] = values.get(value, 0) + n
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for value, count in sorted(self.values.items()):
+            yield f'{self.name}{{{self.label}="{_escape(value)}"}} {_fmt(count)}'
+
+
+class Gauge:
+    """Gauge computed on scrape."""
+
+    __slots__ = ("name", "help", "fn")
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]) -> None:
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_fmt(self.fn())}"
+
+
+class Histogram:
+    __slots__ = ("name", "help", "bounds", "counts", "sum", "count")
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]) -> None:
+        self.name = name
+        self.help = help
+        self.bounds: Tuple[float, ...] = tuple(sorted(buckets))
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        yield from _render_buckets(self.name, self.bounds, self.counts, self.sum, self.count)
+
+
+class SampledHistogram:
+    """Histogram rebuilt from a sample of live values on every scrape."""
+
+    __slots__ = ("name", "help", "bounds", "fn")
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], fn: Callable[[], Iterable[float]]) -> None:
+        self.name = name
+        self.help = help
+        self.bounds = tuple(sorted(buckets))
+        self.fn = fn
+
+    def render(self) -> Iterable[str]:
+        counts = [0] * (len(self.bounds) + 1)
+        total = 0.0
+        n = 0
+        for value in self.fn():
+            counts[bisect_left(self.bounds, value)] += 1
+            total += value
+            n += 1
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        yield from _render_buckets(self.name, self.bounds, counts, total, n)
+
+
+def _render_buckets(name: str, bounds: Sequence[float], counts: Sequence[int], total: float, n: int) -> Iterable[str]:
+    cumulative = 0
+    for bound, count in zip(bounds, counts):
+        cumulative += count
+        yield f'{name}_bucket{{le="{_fmt(bound)}"}} {cumulative}'
+    yield f'{name}_bucket{{le="+Inf"}} {n}'
+    yield f"{name}_sum {_fmt(total)}"
+    yield f"{name}_count {n}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())  # type: ignore[attr-defined]
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+KNOWN_TYPES = (
+    "join",
+    "leave",
+    "roster",
+    "offer",
+    "answer",
+    "ice",
+    "broadcast",
+    "ping",
+    "pong",
+    "invalid",
+)
+
+MESSAGES = REGISTRY.register(
+    LabeledCounter("vc_messages_received_total", "Inbound messages by type.", "type", allowed=KNOWN_TYPES)
+)
+RELAY_LATENCY = REGISTRY.register(
+    Histogram(
+        "vc_relay_latency_seconds",
+        "Relayed message latency from receive to send complete.",
+        LATENCY_BUCKETS,
+    )
+)
+RELAY_NOT_FOUND = REGISTRY.register(
+    Counter("vc_relay_peer_not_found_total", "Relays whose target peer was not found.")
+)
+FANOUT_DURATION = REGISTRY.register(
+    Histogram("vc_broadcast_fanout_seconds", "Time to fan a room message out to all recipients.", LATENCY_BUCKETS)
+)
+LOCK_WAIT = REGISTRY.register(
+    Histogram("vc_room_lock_wait_seconds", "Time spent waiting for room locks (replaces STATE_LOCK).", LATENCY_BUCKETS)
+)
+HEARTBEAT_TIMEOUTS = REGISTRY.register(
+    Counter("vc_heartbeat_timeouts_total", "Peers dropped for not responding within PING_TIMEOUT_SEC.")
+)
+SEND_FAILURES = REGISTRY.register(
+    LabeledCounter("vc_send_failures_total", "Outbound send failures by reason.", "reason")
+)
+SEND_DROPPED = REGISTRY.register(
+    Counter("vc_send_dropped_total", "Outbound messages dropped by queue overflow policies.")
+)
+SEND_FRAMES = REGISTRY.register(
+    Counter("vc_send_frames_total", "WebSocket frames written (a batch counts once).")
+)
+SEND_BATCHED = REGISTRY.register(
+    Counter("vc_send_batched_messages_total", "Messages delivered inside batch frames.")
+)
+PRESENCE_AGGREGATED = REGISTRY.register(
+    Counter("vc_presence_aggregated_total", "Presence events folded into presence-diff frames.")
+)
+REJECTED = REGISTRY.register(
+    LabeledCounter(
+        "vc_rejected_frames_total",
+        "Inbound frames rejected before handling, by reason.",
+        "reason",
+        allowed=("oversize", "rate-global", "rate-relay", "rate-broadcast", "rate-join", "rate-roster"),
+    )
+)
+PENALTIES = REGISTRY.register(
+    LabeledCounter("vc_rate_penalties_total", "Penalties applied to peers for rejected frames.", "penalty")
+)
+RESUMED = REGISTRY.register(
+    Counter("vc_sessions_resumed_total", "Connections that took over a session with a resume token.")
+)
+RESUME_EXPIRED = REGISTRY.register(
+    Counter("vc_sessions_resume_expired_total", "Dropped sessions removed after the resume grace period.")
+)
+LOG_DROPPED = REGISTRY.register(
+    LabeledCounter(
+        "vc_log_dropped_total",
+        "Log records dropped by sampling, rate caps or a full log queue.",
+        "reason",
+        allowed=("sampled", "rate", "queue-full"),
+    )
+)
+LOOP_LAG = REGISTRY.register(
+    Histogram(
+        "vc_loop_lag_seconds",
+        "How late the event loop monitor's periodic beat woke up.",
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+    )
+)
+LOOP_STALLS = REGISTRY.register(
+    Counter("vc_loop_stalls_total", "Event loop stalls longer than LOOP_STALL_MS.")
+)
+CAPTURE_DROPPED = REGISTRY.register(
+    Counter("vc_capture_dropped_total", "Inbound frames left out of the traffic capture (writer behind).")
+)
+SNAPSHOT_PUBLISH = REGISTRY.register(
+    Histogram("vc_snapshot_publish_seconds", "Time to publish an admin state snapshot.", LATENCY_BUCKETS)
+)
+SHED = REGISTRY.register(
+    LabeledCounter(
+        "vc_shed_total",
+        "Connections and joins refused by admission control, by reason.",
+        "reason",
+        allowed=("connections", "loop-lag", "queued", "rooms", "room-size"),
+    )
+)
@@ -2,10 +2,13 @@ from __future__ import annotations
 
 import secrets
 import time
-from dataclasses import dataclass, field
+from typing import Optional
 
 from fastapi import WebSocket
 
+from core.codec import JSON, Codec
+from core.outbound import OutboundQueue
+
 
 def new_peer_id() -> str:
     """Short URL-safe id."""
@@ -13,10 +16,36 @@ def new_peer_id() -> str:
     return secrets.token_urlsafe(8)
 
 
-@dataclass
 class Peer:
-    peer_id: str
-    ws: WebSocket
-    name: str = ""
-    room: str = ""
-    last_seen: float = field(default_factory=lambda: time.time())
+    """One signaling session.
+
+    Slotted: with many idle connections per node the per-instance `__dict__`
+    would cost more than the fields themselves. Room ids are interned (see
+    core.state.join_room), so members share one string per room.
+    """
+
+    __slots__ = ("peer_id", "ws", "name", "room", "last_seen", "codec", "resume_token", "detached_at", "outbox")
+
+    def __init__(
+        self,
+        peer_id: str,
+        ws: WebSocket,
+        name: str = "",
+        room: str = "",
+        last_seen: Optional[float] = None,
+        codec: Codec = JSON,
+        resume_token: str = "",
+    ) -> None:
+        self.peer_id = peer_id
+        self.ws = ws
+        self.name = name
+        self.room = room
+        self.last_seen = time.time() if last_seen is None else last_seen
+        self.codec = codec
+        self.resume_token = resume_token
+        # monotonic time the socket was lost, while the session waits to be resumed
+        self.detached_at = 0.0
+        self.outbox = OutboundQueue(ws, peer_id, codec=codec)
+
+    def __repr__(self) -> str:
+        return f"Peer(peer_id={self.peer_id!r}, name={self.name!r}, room={self.room!r}, last_seen={self.last_seen!r})"
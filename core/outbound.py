@@ -0,0 +1,480 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from fastapi import WebSocket
+
+import config
+from core import metrics
+from core.codec import JSON, Codec
+
+
+logger = logging.getLogger(__name__)
+
+
+# Overflow policies (see config.SEND_QUEUE_POLICIES).
+DROP_OLDEST = "drop-oldest"
+DISCONNECT = "disconnect"
+COALESCE = "coalesce"
+
+# Caps socket writes in flight across all writer tasks.
+_SEND_SLOTS = asyncio.Semaphore(config.SEND_CONCURRENCY)
+
+# Messages waiting in all outbound queues (see queued_total).
+_queued = 0
+
+
+def queued_total() -> int:
+    """Messages waiting in every peer's outbound queue together."""
+
+    return _queued
+
+
+def _count(n: int) -> None:
+    global _queued
+    _queued += n
+
+
+def encode_json(payload: Dict[str, Any]) -> str:
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+def overflow_policy(mtype: str) -> str:
+    return config.SEND_QUEUE_POLICIES.get(mtype, config.SEND_QUEUE_DEFAULT_POLICY)
+
+
+def _presence_key(payload: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """Coalescing key for presence events: the peer the event is about."""
+
+    subject = payload.get("peer_id")
+    if subject is None:
+        peer = payload.get("peer")
+        if isinstance(peer, dict):
+            subject = peer.get("peer_id")
+    if subject is None:
+        return None
+    return ("presence", str(subject))
+
+
+class Frame:
+    """An outbound message, encoded at most once.
+
+    A single Frame can be queued on many peers: the first writer to send it
+    encodes it and every other recipient using the same codec reuses the
+    result.
+    """
+
+    __slots__ = ("mtype", "policy", "key", "born", "_payload", "_text", "_binary")
+
+    def __init__(
+        self,
+        payload: Optional[Dict[str, Any]] = None,
+        text: Optional[str] = None,
+        mtype: Optional[str] = None,
+    ) -> None:
+        if mtype is None:
+            mtype = str(payload.get("type", "")) if payload is not None else ""
+        self.mtype = mtype
+        self.policy = overflow_policy(mtype)
+        self.key = _presence_key(payload) if self.policy == COALESCE and payload is not None else None
+        # perf_counter() at receive for relayed messages (relay latency metric).
+        self.born = 0.0
+        self._payload = payload
+        self._text = text
+        self._binary: Optional[Tuple[Codec, Union[str, bytes]]] = None
+
+    @property
+    def text(self) -> str:
+        text = self._text
+        if text is None:
+            text = self._text = encode_json(self._payload or {})
+        return text
+
+    @property
+    def payload(self) -> Dict[str, Any]:
+        if self._payload is None:
+            self._payload = json.loads(self._text or "{}")
+        return self._payload
+
+    def encoded(self, codec: Codec) -> Union[str, bytes]:
+        if codec is JSON:
+            return self.text
+        cached = self._binary
+        if cached is None or cached[0] is not codec:
+            cached = self._binary = (codec, codec.encode(self.payload))
+        return cached[1]
+
+
+class _Item:
+    __slots__ = ("frame",)
+
+    def __init__(self, frame: Frame) -> None:
+        self.frame = frame
+
+
+class OutboundQueue:
+    """Bounded per-peer send queue drained by a writer task.
+
+    Producers never await the socket: `put` only enqueues. When the queue is
+    full the overflow policy of the message type decides what happens, so a
+    stalled client can only ever hurt itself.
+
+    The writer task exists only while there is something to write: it is
+    spawned by `put` and exits once the queue is empty, so an idle
+    connection costs no task, coroutine frame or wakeup future.
+    """
+
+    __slots__ = (
+        "_ws",
+        "peer_id",
+        "codec",
+        "maxsize",
+        "_items",
+        "_pending",
+        "_task",
+        "_writing",
+        "closed",
+        "close_reason",
+        "batching",
+        "_finish",
+        "_last_send",
+        "sent",
+        "frames",
+        "batches",
+        "dropped",
+        "coalesced",
+        "max_depth",
+    )
+
+    def __init__(self, ws: WebSocket, peer_id: str, maxsize: Optional[int] = None, codec: Codec = JSON) -> None:
+        self._ws = ws
+        self.peer_id = peer_id
+        self.codec = codec
+        self.maxsize = maxsize or config.SEND_QUEUE_MAX
+
+        # A list rather than a deque: queues are short (maxsize) and an empty
+        # deque keeps a whole block allocated for every idle connection.
+        self._items: List[_Item] = []
+        self._pending: Dict[Tuple[str, str], _Item] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Between start/attach and detach/stop: queued messages get written.
+        self._writing = False
+
+        self.closed = False
+        self.close_reason = ""
+        # Set for peers that advertised the "batch" capability.
+        self.batching = False
+        # (code, reason) to close the socket with once the queue is empty.
+        self._finish: Optional[Tuple[int, str]] = None
+        # monotonic time of the last socket write (batching window).
+        self._last_send = 0.0
+
+        # Counters (exposed per peer via `stats`).
+        self.sent = 0
+        self.frames = 0
+        self.batches = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "frames": self.frames,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "closed": self.closed,
+            "close_reason": self.close_reason,
+        }
+
+    def start(self) -> None:
+        self._writing = True
+        self._kick()
+
+    def _kick(self) -> None:
+        if self._task is None and self._writing and not self.closed and (self._items or self._finish is not None):
+            self._task = asyncio.create_task(self._run(), name=f"writer:{self.peer_id}")
+
+    async def stop(self) -> None:
+        self.closed = True
+        self._writing = False
+        self._clear()
+        task = self._task
+        self._task = None
+        if task and task is not asyncio.current_task():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def detach(self) -> None:
+        """Stop writing but keep queueing (up to the usual limits) until `attach` or `stop`."""
+
+        self._writing = False
+        task = self._task
+        self._task = None
+        if task and task is not asyncio.current_task():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def attach(self, ws: WebSocket, codec: Codec, first: Frame) -> None:
+        """Resume writing to a new socket: `first`, then whatever queued up meanwhile."""
+
+        self._ws = ws
+        self.codec = codec
+        self._items.insert(0, _Item(first))
+        _count(1)
+        self.start()
+
+    def finish(self, code: int, reason: str) -> None:
+        """Close the socket as soon as everything queued has been written.
+
+        Unlike `close`, the queue stays usable: later messages are kept as for
+        a detached queue, ready for `attach`.
+        """
+
+        self._finish = (code, reason)
+        self._kick()
+
+    def put(self, message: Union[Dict[str, Any], Frame]) -> bool:
+        """Queue a message (payload dict or shared Frame) for delivery.
+
+        Returns False if it was not accepted.
+        """
+
+        if self.closed:
+            return False
+
+        frame = message if isinstance(message, Frame) else Frame(message)
+
+        key = frame.key
+        if key is not None:
+            queued = self._pending.get(key)
+            if queued is not None:
+                # Replace in place: keeps its position ahead of later messages.
+                queued.frame = frame
+                self.coalesced += 1
+                return True
+
+        if len(self._items) >= self.maxsize and not self._make_room(frame.mtype, frame.policy):
+            return False
+
+        item = _Item(frame)
+        self._items.append(item)
+        _count(1)
+        if key is not None:
+            self._pending[key] = item
+
+        depth = len(self._items)
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if self._task is None:
+            self._kick()
+        return True
+
+    def _make_room(self, mtype: str, policy: str) -> bool:
+        if policy in (DROP_OLDEST, COALESCE):
+            # Presence (COALESCE) with no queued event to replace is shed like
+            # an expendable message rather than costing the peer its connection.
+            for queued in self._items:
+                if queued.frame.policy == DROP_OLDEST:
+                    self._items.remove(queued)
+                    _count(-1)
+                    self.dropped += 1
+                    metrics.SEND_DROPPED.inc()
+                    return True
+            # Nothing expendable queued ahead of us: shed the new message.
+            self.dropped += 1
+            metrics.SEND_DROPPED.inc()
+            return False
+
+        self.dropped += 1
+        metrics.SEND_DROPPED.inc()
+        metrics.SEND_FAILURES.inc("overflow")
+        logger.info(
+            "send queue overflow peer_id=%s type=%s depth=%s policy=%s",
+            self.peer_id,
+            mtype,
+            len(self._items),
+            policy,
+        )
+        self.close(config.SEND_QUEUE_CLOSE_CODE, "send-queue-overflow")
+        return False
+
+    def close(self, code: int = 1000, reason: str = "") -> None:
+        """Stop accepting messages and close the socket without waiting on the writer."""
+
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        self._clear()
+        asyncio.create_task(self._abort(code, reason), name=f"close:{self.peer_id}")
+
+    def _clear(self) -> None:
+        _count(-len(self._items))
+        self._items.clear()
+        self._pending.clear()
+
+    async def _abort(self, code: int, reason: str) -> None:
+        task = self._task
+        self._task = None
+        if task:
+            task.cancel()
+        try:
+            await self._ws.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def _requeue(self, frames: List[Frame]) -> None:
+        """Put frames that may not have gone out back at the head of the queue."""
+
+        if self.closed:
+            return
+        items: List[_Item] = []
+        for frame in frames:
+            key = frame.key
+            if key is not None:
+                if key in self._pending:
+                    # A newer event about the same peer was queued meanwhile.
+                    self.coalesced += 1
+                    continue
+            item = _Item(frame)
+            if key is not None:
+                self._pending[key] = item
+            items.append(item)
+        self._items[:0] = items
+        _count(len(items))
+
+    def _pop(self) -> Frame:
+        frame = self._items.pop(0).frame
+        _count(-1)
+        if frame.key is not None:
+            self._pending.pop(frame.key, None)
+        return frame
+
+    def _encode(self, frame: Frame) -> Optional[Union[str, bytes]]:
+        try:
+            return frame.encoded(self.codec)
+        except Exception:
+            # e.g. binary values from a msgpack sender going to a JSON peer
+            logger.info(
+                "writer encode failed peer_id=%s type=%s codec=%s", self.peer_id, frame.mtype, self.codec.name
+            )
+            self.dropped += 1
+            metrics.SEND_FAILURES.inc("encode")
+            return None
+
+    async def _run(self) -> None:
+        ws = self._ws
+        codec = self.codec
+        send = ws.send_bytes if codec.binary else ws.send_text
+        items = self._items
+        window = config.BATCH_WINDOW_MS / 1000.0
+        while True:
+            if not items:
+                self._task = None
+                if self._finish is not None and not self.closed:
+                    code, reason = self._finish
+                    self._finish = None
+                    # Later messages wait for `attach`, as on a detached queue.
+                    self._writing = False
+                    try:
+                        await ws.close(code=code, reason=reason)
+                    except Exception:
+                        pass
+                return
+
+            if self.batching and window and len(items) < config.BATCH_MAX_MESSAGES:
+                # Mid-burst: let the rest of it arrive so it goes out as one frame.
+                # An isolated message is sent straight away.
+                wait = self._last_send + window - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    if not items:
+                        continue
+
+            frames = []
+            parts = []
+            size = 0
+            while items:
+                frame = self._pop()
+                data = self._encode(frame)
+                if data is not None:
+                    frames.append(frame)
+                    parts.append(data)
+                    size += len(data)
+                if not self.batching or len(parts) >= config.BATCH_MAX_MESSAGES or size >= config.BATCH_MAX_BYTES:
+                    break
+            if not parts:
+                continue
+            data = parts[0] if len(parts) == 1 else codec.encode_batch(parts)
+            mtype = frames[0].mtype if len(frames) == 1 else "batch"
+
+            try:
+                # The wait for a slot is bounded too: slots held by stalled
+                # recipients must not hold up everyone else's writes.
+                await asyncio.wait_for(_SEND_SLOTS.acquire(), config.SEND_TIMEOUT_SEC)
+            except asyncio.CancelledError:
+                self._requeue(frames)
+                raise
+            except asyncio.TimeoutError:
+                # Not this peer's fault: keep its messages (subject to the
+                # queue limits) and try again.
+                logger.info("writer send slot timeout peer_id=%s type=%s", self.peer_id, mtype)
+                metrics.SEND_FAILURES.inc("slot-timeout")
+                self._requeue(frames)
+                continue
+
+            try:
+                try:
+                    await asyncio.wait_for(send(data), config.SEND_TIMEOUT_SEC)
+                finally:
+                    _SEND_SLOTS.release()
+            except asyncio.CancelledError:
+                # detach/stop mid-send: keep the frames for a resumed socket.
+                self._requeue(frames)
+                raise
+            except asyncio.TimeoutError:
+                logger.info("writer send timeout peer_id=%s type=%s", self.peer_id, mtype)
+                metrics.SEND_FAILURES.inc("timeout")
+                self.close(config.SEND_QUEUE_CLOSE_CODE, "send-timeout")
+                return
+            except Exception:
+                logger.info("writer send failed peer_id=%s type=%s", self.peer_id, mtype)
+                metrics.SEND_FAILURES.inc("error")
+                # Keep the undelivered messages: the session may be resumed on a
+                # new socket (see attach). Otherwise the endpoint stops the queue.
+                self._requeue(frames)
+                self._task = None
+                self._writing = False
+                return
+            self._last_send = time.monotonic()
+            self.sent += len(frames)
+            self.frames += 1
+            metrics.SEND_FRAMES.inc()
+            if len(frames) > 1:
+                self.batches += 1
+                metrics.SEND_BATCHED.inc(len(frames))
+            now = time.perf_counter()
+            for frame in frames:
+                if frame.born:
+                    metrics.RELAY_LATENCY.observe(now - frame.born)
+
+
+metrics.REGISTRY.register(metrics.Gauge("vc_send_queued", "Messages waiting in outbound queues.", queued_total))
@@ -0,0 +1,75 @@
+"""Debounced presence for large rooms.
+
+In a room of n members every join/leave is a frame to n-1 peers, so a
+reconnect wave of k peers costs k*n frames. Once a room has at least
+`config.PRESENCE_DIFF_THRESHOLD` members its `peer-joined`/`peer-left`
+notices are collected for `config.PRESENCE_TICK_MS` and sent as one shared
+frame:
+
+    {"type": "presence-diff", "room": "...",
+     "joined": [{"peer_id": "...", "name": "..."}, ...],
+     "left": [{"peer_id": "...", "reason": "..."}, ...]}
+
+Only the latest change per peer is kept, so the lists are disjoint; a client
+applies `joined` as add/update and `left` as remove, and ignores its own id.
+Smaller rooms keep the immediate per-event messages.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List, Tuple
+
+import config
+from core import metrics
+
+
+# room -> peer_id -> ("joined" | "left", entry), for rooms with a flush scheduled
+_PENDING: Dict[str, Dict[str, Tuple[str, Dict[str, Any]]]] = {}
+
+
+def absorb(room: str, payload: Dict[str, Any], size: int) -> bool:
+    """Take a presence event into the room's next diff instead of sending it now.
+
+    Returns False if the event should go out as usual. Once a diff is
+    pending, every presence event of that room joins it, so a diff and an
+    immediate event never overtake each other.
+    """
+
+    threshold = config.PRESENCE_DIFF_THRESHOLD
+    if not threshold:
+        return False
+    mtype = payload.get("type")
+    if mtype == "peer-joined":
+        peer = payload.get("peer") or {}
+        peer_id = str(peer.get("peer_id", ""))
+        change = ("joined", peer)
+    elif mtype == "peer-left":
+        peer_id = str(payload.get("peer_id", ""))
+        change = ("left", {"peer_id": peer_id, "reason": payload.get("reason", "")})
+    else:
+        return False
+
+    pending = _PENDING.get(room)
+    if pending is None:
+        if size < threshold:
+            return False
+        pending = _PENDING[room] = {}
+        asyncio.get_running_loop().call_later(config.PRESENCE_TICK_MS / 1000.0, _flush, room)
+    pending[peer_id] = change
+    metrics.PRESENCE_AGGREGATED.inc()
+    return True
+
+
+def _flush(room: str) -> None:
+    from core.state import broadcast_room
+
+    pending = _PENDING.pop(room, None)
+    if not pending:
+        return
+    joined: List[Dict[str, Any]] = []
+    left: List[Dict[str, Any]] = []
+    for kind, entry in pending.values():
+        (joined if kind == "joined" else left).append(entry)
+    # Every process sends diffs for its own members (see state.deliver).
+    broadcast_room(room, {"type": "presence-diff", "room": room, "joined": joined, "left": left}, local_only=True)
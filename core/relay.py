@@ -0,0 +1,121 @@
+"""Relay fast path for peer-to-peer messages (offer/answer/ice).
+
+Instead of decoding the whole frame into a dict, copying it, adding `from`
+and encoding it again, the top-level object is walked once with the stdlib's
+C scanner to pick out `type` and `to`, and the original text is forwarded
+with `"from"` spliced in before the closing brace. Frames that carry a
+`from` of their own take the regular path, so the forwarded text never has
+two.
+"""
+
+from __future__ import annotations
+
+import json
+import json.decoder
+import json.scanner
+import re
+from typing import NamedTuple, Optional
+
+from core.outbound import Frame
+
+
+FAST_TYPES = frozenset(("offer", "answer", "ice"))
+
+_scan_value = json.scanner.make_scanner(json.JSONDecoder())
+_scan_string = json.decoder.scanstring
+_skip_ws = re.compile(r"[ \t\n\r]*").match
+_WS = " \t\n\r"
+
+
+class Envelope(NamedTuple):
+    mtype: object
+    to: object
+    close: int  # index of the object's closing brace
+    has_from: bool  # a top-level "from" key is present
+
+
+def scan_envelope(raw: str) -> Optional[Envelope]:
+    """Validate a frame and extract its top-level `type` and `to`, and whether it has a `from`.
+
+    Returns None when the frame is not a non-empty JSON object (the regular
+    path produces the right error for those). Raises ValueError for invalid
+    JSON. Later duplicate keys win, as with `json.loads`.
+    """
+
+    try:
+        i = _skip_ws(raw, 0).end()
+        if raw[i] != "{":
+            return None
+        i = _skip_ws(raw, i + 1).end()
+        if raw[i] == "}":
+            return None
+
+        # Clients almost always send compact JSON, so only fall back to the
+        # whitespace regex when the next character actually is whitespace.
+        mtype = to = None
+        has_from = False
+        while True:
+            if raw[i] != '"':
+                raise ValueError("expected property name")
+            key, i = _scan_string(raw, i + 1)
+            if raw[i] in _WS:
+                i = _skip_ws(raw, i).end()
+            if raw[i] != ":":
+                raise ValueError("expected ':'")
+            i += 1
+            if raw[i] in _WS:
+                i = _skip_ws(raw, i).end()
+            value, i = _scan_value(raw, i)
+            if key == "type":
+                mtype = value
+            elif key == "to":
+                to = value
+            elif key == "from":
+                has_from = True
+            c = raw[i]
+            if c in _WS:
+                i = _skip_ws(raw, i).end()
+                c = raw[i]
+            if c == ",":
+                i += 1
+                if raw[i] in _WS:
+                    i = _skip_ws(raw, i).end()
+                continue
+            if c == "}":
+                break
+            raise ValueError("expected ',' or '}'")
+    except (IndexError, StopIteration) as e:
+        raise ValueError("truncated or invalid JSON") from e
+
+    if _skip_ws(raw, i + 1).end() != len(raw):
+        raise ValueError("extra data")
+    return Envelope(mtype, to, i, has_from)
+
+
+def fast_relay_target(env: Optional[Envelope]) -> Optional[str]:
+    """Return the relay target if this frame can take the fast path."""
+
+    if env is None or not isinstance(env.mtype, str) or env.mtype not in FAST_TYPES:
+        return None
+    if env.has_from:
+        # Splicing would duplicate the key; the regular path replaces it.
+        return None
+    to = env.to
+    if not isinstance(to, str) or not to or to != to.strip():
+        return None
+    return to
+
+
+def from_suffix(peer_id: str) -> str:
+    """Text that closes a relayed object with the sender's id (computed once per peer)."""
+
+    return ',"from":' + json.dumps(peer_id) + "}"
+
+
+def splice_from(raw: str, env: Envelope, suffix: str) -> Frame:
+    """Forward `raw` with the `from_suffix` appended as its last property.
+
+    Only for envelopes without a `from` of their own (see `fast_relay_target`).
+    """
+
+    return Frame(text=raw[: env.close] + suffix, mtype=env.mtype)
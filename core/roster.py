@@ -0,0 +1,93 @@
+"""Per-room roster index with pre-serialized entries.
+
+Each member's `{"peer_id", "name"}` entry is encoded once, when it joins or
+renames, and the whole roster text is rebuilt from those fragments only after
+a change. A joiner gets the current text without any per-member encoding.
+
+Rooms larger than `config.ROSTER_PAGE_SIZE` hand the roster out in pages: an
+entry's cursor is its insertion sequence number, so pages stay consistent
+while members come and go (someone who joins after the first page appears in
+a later page and, like everyone else, in a `peer-joined` event).
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from core.outbound import encode_json
+
+
+@dataclass
+class RosterPage:
+    text: str  # JSON array of {"peer_id", "name"} entries
+    cursor: Optional[int]  # pass back to get the next page; None on the last one
+    total: int  # members in the room, the requester included
+
+
+class Roster:
+    __slots__ = ("_entries", "_seqs", "_ids", "_next_seq", "_text")
+
+    def __init__(self) -> None:
+        # peer_id -> (seq, fragment); insertion order is seq order.
+        self._entries: Dict[str, Tuple[int, str]] = {}
+        # seq-sorted parallel lists for cursor lookups.
+        self._seqs: List[int] = []
+        self._ids: List[str] = []
+        self._next_seq = 0
+        self._text: Optional[str] = "[]"
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, peer_id: object) -> bool:
+        return peer_id in self._entries
+
+    def set(self, peer_id: str, name: str) -> None:
+        """Add a member or update its name (a rename keeps its place)."""
+
+        fragment = encode_json({"peer_id": peer_id, "name": name})
+        entry = self._entries.get(peer_id)
+        if entry is not None:
+            if entry[1] == fragment:
+                return
+            self._entries[peer_id] = (entry[0], fragment)
+        else:
+            self._next_seq += 1
+            self._entries[peer_id] = (self._next_seq, fragment)
+            self._seqs.append(self._next_seq)
+            self._ids.append(peer_id)
+        self._text = None
+
+    def discard(self, peer_id: str) -> None:
+        entry = self._entries.pop(peer_id, None)
+        if entry is None:
+            return
+        i = bisect_left(self._seqs, entry[0])
+        del self._seqs[i]
+        del self._ids[i]
+        self._text = None
+
+    def text(self, exclude: Optional[str] = None) -> str:
+        """The whole roster as a JSON array (cached unless `exclude` is given)."""
+
+        if exclude is not None and exclude in self._entries:
+            return "[" + ",".join(f for pid, (_, f) in self._entries.items() if pid != exclude) + "]"
+        text = self._text
+        if text is None:
+            text = self._text = "[" + ",".join(f for _, f in self._entries.values()) + "]"
+        return text
+
+    def page(self, after: int = 0, limit: Optional[int] = None, exclude: Optional[str] = None) -> RosterPage:
+        """Entries added after cursor `after`, at most `limit` of them."""
+
+        total = len(self._entries)
+        if not after and (limit is None or total <= limit):
+            return RosterPage(self.text(exclude), None, total)
+        start = bisect_right(self._seqs, after)
+        end = len(self._ids) if limit is None else min(start + limit, len(self._ids))
+        entries = self._entries
+        text = "[" + ",".join(entries[pid][1] for pid in self._ids[start:end] if pid != exclude) + "]"
+        cursor = self._seqs[end - 1] if end < len(self._ids) else None
+        return RosterPage(text, cursor, total)
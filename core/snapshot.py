@@ -0,0 +1,321 @@
+"""Read-only, versioned snapshots of rooms and peers for the admin API.
+
+State mutations only mark what they touched (`touch_room`, `touch_peer`: a
+set insert). A publisher task wakes every `config.SNAPSHOT_INTERVAL_MS` and,
+if anything was marked, builds the next `Snapshot` copy-on-write: its maps
+are split into `_SHARDS` dicts by key hash, and the sorted room ids into
+chunks of about `_CHUNK`; only the shards and chunks holding a marked room or
+peer are copied and re-read from live state, so a publish costs about the
+number of changes (plus one pointer per shard and chunk), not the number of
+peers or rooms. Readers take `current()` and never see it change, so admin
+requests neither touch the live dicts nor take room locks, however often
+dashboards poll; they see state at most one interval old (`ts`).
+
+A room's member list is its roster text (core.roster), the same cached
+string joiners get.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple, TypeVar
+
+import config
+from core import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_SHARDS = 256
+_CHUNK = 512
+
+V = TypeVar("V")
+
+
+class ShardedMap(Mapping[str, V]):
+    """Immutable mapping over `_SHARDS` dicts; versions share unchanged shards."""
+
+    __slots__ = ("_shards", "_len")
+
+    def __init__(self, shards: Tuple[Dict[str, V], ...], length: int) -> None:
+        self._shards = shards
+        self._len = length
+
+    def __getitem__(self, key: str) -> V:
+        return self._shards[hash(key) % _SHARDS][key]
+
+    def get(self, key: str, default=None):
+        return self._shards[hash(key) % _SHARDS].get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._shards[hash(key) % _SHARDS]
+
+    def __iter__(self) -> Iterator[str]:
+        for shard in self._shards:
+            yield from shard
+
+    def __len__(self) -> int:
+        return self._len
+
+    def evolve(self, changes: Dict[str, Optional[V]]) -> "ShardedMap[V]":
+        """A new map with `changes` applied (None removes the key)."""
+
+        shards = list(self._shards)
+        copied: Set[int] = set()
+        length = self._len
+        for key, value in changes.items():
+            i = hash(key) % _SHARDS
+            if i not in copied:
+                shards[i] = dict(shards[i])
+                copied.add(i)
+            shard = shards[i]
+            if value is None:
+                if shard.pop(key, None) is not None:
+                    length -= 1
+            else:
+                if key not in shard:
+                    length += 1
+                shard[key] = value
+        return ShardedMap(tuple(shards), length)
+
+
+class SortedNames:
+    """Immutable sorted sequence of ids in chunks; versions share unchanged chunks.
+
+    Positions are global, as in one sorted list: `bisect_left`/`bisect_right`
+    return indexes and `slice` takes a range of them.
+    """
+
+    __slots__ = ("_chunks", "_maxes", "_offsets", "_len")
+
+    def __init__(self, chunks: Tuple[Tuple[str, ...], ...] = ()) -> None:
+        self._chunks = chunks
+        self._maxes = tuple(chunk[-1] for chunk in chunks)
+        offsets = []
+        n = 0
+        for chunk in chunks:
+            offsets.append(n)
+            n += len(chunk)
+        self._offsets = tuple(offsets)
+        self._len = n
+
+    def __len__(self) -> int:
+        return self._len
+
+    def bisect_left(self, name: str) -> int:
+        i = bisect_left(self._maxes, name)
+        if i == len(self._chunks):
+            return self._len
+        return self._offsets[i] + bisect_left(self._chunks[i], name)
+
+    def bisect_right(self, name: str) -> int:
+        i = bisect_right(self._maxes, name)
+        if i == len(self._chunks):
+            return self._len
+        return self._offsets[i] + bisect_right(self._chunks[i], name)
+
+    def slice(self, start: int, end: int) -> List[str]:
+        out: List[str] = []
+        i = max(0, bisect_right(self._offsets, start) - 1)
+        while start < end and i < len(self._chunks):
+            offset = self._offsets[i]
+            chunk = self._chunks[i]
+            out.extend(chunk[start - offset : end - offset])
+            start = offset + len(chunk)
+            i += 1
+        return out
+
+    def evolve(self, added: Iterable[str], removed: Iterable[str]) -> "SortedNames":
+        """A new sequence with `added` inserted and `removed` taken out."""
+
+        chunks = list(self._chunks)
+        maxes = list(self._maxes)
+        copied: Dict[int, List[str]] = {}
+
+        def chunk_for(name: str) -> Optional[int]:
+            if not chunks:
+                return None
+            return min(bisect_left(maxes, name), len(chunks) - 1)
+
+        for name in removed:
+            i = chunk_for(name)
+            if i is None:
+                continue
+            chunk = copied.get(i)
+            if chunk is None:
+                chunk = copied[i] = list(chunks[i])
+            j = bisect_left(chunk, name)
+            if j < len(chunk) and chunk[j] == name:
+                del chunk[j]
+        for name in added:
+            i = chunk_for(name)
+            if i is None:
+                chunks.append(())
+                maxes.append(name)
+                i = 0
+            chunk = copied.get(i)
+            if chunk is None:
+                chunk = copied[i] = list(chunks[i])
+            insort(chunk, name)
+        if not copied:
+            return self
+
+        # Untouched chunks are shared; grown ones are split, emptied ones dropped.
+        out: List[Tuple[str, ...]] = []
+        for i, chunk in enumerate(chunks):
+            edited = copied.get(i)
+            if edited is None:
+                out.append(chunk)
+            elif len(edited) > 2 * _CHUNK:
+                out.extend(tuple(edited[k : k + _CHUNK]) for k in range(0, len(edited), _CHUNK))
+            elif edited:
+                out.append(tuple(edited))
+        return SortedNames(tuple(out))
+
+
+class RoomView(NamedTuple):
+    room: str
+    size: int
+    members: str  # JSON array of {"peer_id", "name"}
+    changed: int  # snapshot version in which the room last changed
+
+
+class PeerView(NamedTuple):
+    peer_id: str
+    name: str
+    room: str
+    codec: str
+    detached: bool
+    changed: int
+
+
+class Snapshot:
+    """One published version; nothing in it is mutated after `publish`."""
+
+    __slots__ = ("version", "ts", "rooms", "names", "peers")
+
+    def __init__(
+        self,
+        version: int,
+        ts: float,
+        rooms: ShardedMap[RoomView],
+        names: SortedNames,
+        peers: ShardedMap[PeerView],
+    ) -> None:
+        self.version = version
+        self.ts = ts
+        self.rooms = rooms
+        # Room ids, sorted: prefix ranges and cursors are bisections.
+        self.names = names
+        self.peers = peers
+
+    def room_page(self, prefix: str = "", after: str = "", limit: int = 100) -> Tuple[List[RoomView], Optional[str], int]:
+        """Rooms starting with `prefix` that sort after `after`.
+
+        Returns the page, the cursor for the next page (None on the last
+        one) and how many rooms match the prefix in total.
+        """
+
+        names = self.names
+        lo = names.bisect_left(prefix)
+        # Past every id that starts with prefix.
+        hi = names.bisect_left(prefix + "\U0010ffff") if prefix else len(names)
+        start = min(max(names.bisect_right(after), lo), hi) if after else lo
+        end = min(start + limit, hi)
+        page = [self.rooms[name] for name in names.slice(start, end)]
+        return page, (page[-1].room if end < hi and page else None), hi - lo
+
+
+_NO_SHARDS: Tuple[dict, ...] = tuple({} for _ in range(_SHARDS))
+CURRENT: Snapshot = Snapshot(0, 0.0, ShardedMap(_NO_SHARDS, 0), SortedNames(), ShardedMap(_NO_SHARDS, 0))
+
+# Marked by core.state since the last publish.
+_DIRTY_ROOMS: Set[str] = set()
+_DIRTY_PEERS: Set[str] = set()
+
+_task: Optional[asyncio.Task] = None
+
+
+def touch_room(room: str) -> None:
+    _DIRTY_ROOMS.add(room)
+
+
+def touch_peer(peer_id: str) -> None:
+    _DIRTY_PEERS.add(peer_id)
+
+
+def current() -> Snapshot:
+    return CURRENT
+
+
+def publish() -> Snapshot:
+    """Build and install the next version if anything changed since the last one."""
+
+    global CURRENT
+    if not _DIRTY_ROOMS and not _DIRTY_PEERS:
+        return CURRENT
+    from core.state import PEERS, ROSTERS
+
+    t0 = time.perf_counter()
+    old = CURRENT
+    version = old.version + 1
+
+    room_changes: Dict[str, Optional[RoomView]] = {}
+    added: List[str] = []
+    removed: Set[str] = set()
+    for room in _DIRTY_ROOMS:
+        roster = ROSTERS.get(room)
+        if roster is None or not len(roster):
+            if room in old.rooms:
+                removed.add(room)
+                room_changes[room] = None
+            continue
+        if room not in old.rooms:
+            added.append(room)
+        room_changes[room] = RoomView(room, len(roster), roster.text(), version)
+    _DIRTY_ROOMS.clear()
+
+    names = old.names.evolve(added, removed) if added or removed else old.names
+
+    peer_changes: Dict[str, Optional[PeerView]] = {}
+    for peer_id in _DIRTY_PEERS:
+        p = PEERS.get(peer_id)
+        peer_changes[peer_id] = None if p is None else PeerView(peer_id, p.name, p.room, p.codec.name, bool(p.detached_at), version)
+    _DIRTY_PEERS.clear()
+
+    CURRENT = Snapshot(version, time.time(), old.rooms.evolve(room_changes), names, old.peers.evolve(peer_changes))
+    metrics.SNAPSHOT_PUBLISH.observe(time.perf_counter() - t0)
+    return CURRENT
+
+
+async def _run(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            publish()
+        except Exception:
+            logger.exception("snapshot publish failed")
+
+
+def start() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run(config.SNAPSHOT_INTERVAL_MS / 1000.0), name="snapshot-publisher")
+
+
+async def stop() -> None:
+    global _task
+    task = _task
+    _task = None
+    if task:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+metrics.REGISTRY.register(metrics.Gauge("vc_snapshot_version", "Version of the admin state snapshot.", lambda: CURRENT.version))
@@ -1,79 +1,401 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
-from typing import Any, Dict, Optional, Set
-
-from fastapi import WebSocket
+import secrets
+import sys
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple, Union
 
+import config
+from core import history, journal, metrics, presence, snapshot
+from core.backend import MemoryBackend, StateBackend
 from core.models import Peer
+from core.outbound import Frame
+from core.roster import Roster, RosterPage
 
 
 logger = logging.getLogger(__name__)
 
 
-# peer_id -> Peer
+# peer_id -> Peer (connections owned by this process)
 PEERS: Dict[str, Peer] = {}
 
-# room_id -> set(peer_id)
+# room_id -> set(peer_id); with a shared backend this includes members
+# connected to other processes.
 ROOMS: Dict[str, Set[str]] = {}
 
-# async lock for shared state
-STATE_LOCK = asyncio.Lock()
+# room_id -> Roster (same members as ROOMS, with pre-serialized entries).
+ROSTERS: Dict[str, Roster] = {}
+
+# Cross-process side of the state (see core.backend).
+BACKEND: StateBackend = MemoryBackend()
+
+# resume token -> peer_id (see detach_peer / resume_peer)
+RESUME_TOKENS: Dict[str, str] = {}
+
+# room_id -> [lock, holders]; entries exist only while someone holds or waits.
+_ROOM_LOCKS: Dict[str, List[Any]] = {}
+
+
+@dataclass
+class Notice:
+    """A room notification produced by a state mutation, delivered after unlocking."""
+
+    room: str
+    payload: Dict[str, Any]
+    exclude: Optional[str] = None
+
+
+@asynccontextmanager
+async def room_locks(*rooms: str) -> AsyncIterator[None]:
+    """Hold the locks of one or more rooms.
+
+    Locks are taken in sorted order so concurrent multi-room operations (room
+    switches) cannot deadlock. Code under these locks must not do network I/O.
+    """
+
+    names = sorted({r for r in rooms if r})
+    entries = []
+    for name in names:
+        entry = _ROOM_LOCKS.get(name)
+        if entry is None:
+            entry = _ROOM_LOCKS[name] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        entries.append((name, entry))
+
+    acquired = []
+    try:
+        t0 = time.perf_counter()
+        for _, entry in entries:
+            await entry[0].acquire()
+            acquired.append(entry[0])
+        metrics.LOCK_WAIT.observe(time.perf_counter() - t0)
+        yield
+    finally:
+        for lock in reversed(acquired):
+            lock.release()
+        for name, entry in entries:
+            entry[1] -= 1
+            if entry[1] == 0 and _ROOM_LOCKS.get(name) is entry:
+                del _ROOM_LOCKS[name]
+
+
+def use_backend(backend: StateBackend) -> None:
+    global BACKEND
+    BACKEND = backend
 
 
-async def ws_send(ws: WebSocket, payload: Dict[str, Any]) -> None:
-    await ws.send_text(json.dumps(payload, separators=(",", ":"), ensure_ascii=False))
+def send_to_peer(peer_id: str, payload: Union[Dict[str, Any], Frame]) -> bool:
+    """Queue a message on the peer's outbound queue.
 
+    Never waits on the socket; delivery happens in the peer's writer task.
+    Peers owned by another process are reached through the backend.
+    """
 
-async def send_to_peer(peer_id: str, payload: Dict[str, Any]) -> bool:
     peer = PEERS.get(peer_id)
     if not peer:
+        frame = payload if isinstance(payload, Frame) else Frame(payload)
+        if BACKEND.send_to_remote(peer_id, frame):
+            return True
         logger.debug("send_to_peer peer not found peer_id=%s", peer_id)
         return False
-    try:
-        await ws_send(peer.ws, payload)
-        return True
-    except Exception:
-        logger.info("send_to_peer failed peer_id=%s", peer_id)
+    if not peer.outbox.put(payload):
+        logger.debug("send_to_peer not queued peer_id=%s", peer_id)
         return False
+    return True
+
 
+def broadcast_room(
+    room: str,
+    payload: Union[Dict[str, Any], Frame],
+    exclude: Optional[str] = None,
+    local_only: bool = False,
+) -> None:
+    """Fan a message out to every member of a room.
 
-async def broadcast_room(room: str, payload: Dict[str, Any], exclude: Optional[str] = None) -> None:
-    peer_ids = ROOMS.get(room, set()).copy()
+    The payload is wrapped in one shared Frame, so it is encoded once no matter
+    how many recipients there are; each recipient's writer task then sends it
+    concurrently with the others. Members owned by other processes get it
+    through a single backend publish unless `local_only` is set.
+    """
+
+    t0 = time.perf_counter()
+    peer_ids = ROOMS.get(room, set())
     logger.debug("broadcast_room room=%s recipients=%s", room, len(peer_ids))
+    frame = payload if isinstance(payload, Frame) else Frame(payload)
     for pid in peer_ids:
         if exclude and pid == exclude:
             continue
-        await send_to_peer(pid, payload)
+        peer = PEERS.get(pid)
+        if peer:
+            peer.outbox.put(frame)
+    if not local_only:
+        BACKEND.broadcast_remote(room, frame, exclude)
+    metrics.FANOUT_DURATION.observe(time.perf_counter() - t0)
 
 
-async def remove_peer(peer_id: str, reason: str = "disconnect") -> None:
-    """Remove peer from server state and notify room.
+def deliver(notices: List[Notice]) -> None:
+    """Send presence notices to this process's members of the room.
 
-    Must be called under STATE_LOCK.
+    Other processes derive their own from the backend's membership
+    announcements (see core.bus), in the order they apply them.
     """
 
-    peer = PEERS.pop(peer_id, None)
-    if not peer:
-        return
+    for notice in notices:
+        # Large rooms get presence as periodic diffs (see core.presence).
+        if presence.absorb(notice.room, notice.payload, len(ROOMS.get(notice.room, ()))):
+            continue
+        broadcast_room(notice.room, notice.payload, exclude=notice.exclude, local_only=True)
+
+
+def register_peer(peer: Peer) -> None:
+    PEERS[peer.peer_id] = peer
+    BACKEND.peer_up(peer.peer_id)
+    snapshot.touch_peer(peer.peer_id)
+
+
+def issue_resume_token(peer: Peer) -> str:
+    """Give the peer a fresh resume token (the previous one stops working)."""
 
-    logger.info("remove_peer peer_id=%s reason=%s room=%s", peer_id, reason, peer.room)
+    RESUME_TOKENS.pop(peer.resume_token, None)
+    token = secrets.token_urlsafe(16)
+    peer.resume_token = token
+    RESUME_TOKENS[token] = peer.peer_id
+    journal.record("t", peer.peer_id, token)
+    return token
 
-    room = peer.room
+
+def detach_peer(peer: Peer, grace: float) -> bool:
+    """Keep a peer whose socket dropped in its room for `grace` seconds.
+
+    Nothing is announced to the room. Returns False if the peer cannot wait
+    for a resume (already removed, or its queue was closed by the server).
+    """
+
+    if grace <= 0 or PEERS.get(peer.peer_id) is not peer or peer.outbox.closed:
+        return False
+    stamp = peer.detached_at = time.monotonic()
+    snapshot.touch_peer(peer.peer_id)
+    asyncio.get_running_loop().call_later(grace, _expire_detached, peer, stamp)
+    return True
+
+
+def _expire_detached(peer: Peer, stamp: float) -> None:
+    if peer.detached_at == stamp and PEERS.get(peer.peer_id) is peer:
+        asyncio.create_task(_drop_detached(peer), name=f"expire:{peer.peer_id}")
+
+
+async def _drop_detached(peer: Peer) -> None:
+    logger.info("resume grace expired peer_id=%s", peer.peer_id)
+    metrics.RESUME_EXPIRED.inc()
+    await remove_peer(peer.peer_id, reason="disconnect")
+    await peer.outbox.stop()
+
+
+def restore_peer(peer_id: str, token: str, room: str, name: str, grace: float) -> bool:
+    """Recreate a saved session as a detached peer waiting to be resumed."""
+
+    if peer_id in PEERS:
+        return False
+    room = sys.intern(room)
+    peer = Peer(peer_id=peer_id, ws=None, name=name, room=room)  # type: ignore[arg-type]
+    register_peer(peer)
+    peer.resume_token = token
+    RESUME_TOKENS[token] = peer_id
     if room:
-        members = ROOMS.get(room)
-        if members and peer_id in members:
-            members.remove(peer_id)
-            if not members:
-                ROOMS.pop(room, None)
-
-        await broadcast_room(
-            room,
-            {"type": "peer-left", "peer_id": peer_id, "reason": reason},
-            exclude=peer_id,
-        )
+        _add_member(room, peer_id, name)
+        BACKEND.member(peer_id, room, name)
+    return detach_peer(peer, grace)
+
+
+def resume_peer(token: str) -> Optional[Peer]:
+    """Claim the session a resume token belongs to, detached or not.
+
+    The caller must move the peer onto its new socket before awaiting.
+    """
+
+    peer_id = RESUME_TOKENS.pop(token, None)
+    peer = PEERS.get(peer_id) if peer_id else None
+    if peer is None:
+        return None
+    peer.resume_token = ""
+    peer.detached_at = 0.0
+    snapshot.touch_peer(peer_id)
+    return peer
+
+
+def apply_remote_member(peer_id: str, old_room: str, room: str, name: str = "") -> None:
+    """Mirror a membership change made by another process.
+
+    Plain synchronous mutation: like the locked sections above it never
+    awaits, so it cannot interleave with them on the event loop.
+    """
+
+    if old_room and old_room != room:
+        _discard_member(old_room, peer_id)
+    if room:
+        _add_member(sys.intern(room), peer_id, name)
+
+
+def _add_member(room: str, peer_id: str, name: str) -> Set[str]:
+    members = ROOMS.setdefault(room, set())
+    members.add(peer_id)
+    roster = ROSTERS.get(room)
+    if roster is None:
+        roster = ROSTERS[room] = Roster()
+    roster.set(peer_id, name)
+    snapshot.touch_room(room)
+    snapshot.touch_peer(peer_id)
+    return members
+
+
+def _discard_member(room: str, peer_id: str) -> None:
+    members = ROOMS.get(room)
+    if members and peer_id in members:
+        members.remove(peer_id)
+        if not members:
+            ROOMS.pop(room, None)
+            history.room_closed(room)
+    roster = ROSTERS.get(room)
+    if roster is not None:
+        roster.discard(peer_id)
+        if not len(roster):
+            ROSTERS.pop(room, None)
+    snapshot.touch_room(room)
+    snapshot.touch_peer(peer_id)
+
+
+def roster_page(room: str, after: int = 0, exclude: Optional[str] = None) -> RosterPage:
+    """A page of `room`'s roster after cursor `after` (see core.roster)."""
+
+    roster = ROSTERS.get(room)
+    if roster is None:
+        return RosterPage("[]", None, 0)
+    return roster.page(after, config.ROSTER_PAGE_SIZE, exclude=exclude)
+
+
+async def join_room(peer_id: str, room: str, name: str) -> Tuple[Optional[RosterPage], List[Notice]]:
+    """Move a peer into `room`.
+
+    Returns the (first page of the) roster of the other members, None if the
+    peer is gone, and the notices to deliver once the caller is outside the
+    lock.
+    """
+
+    # One string per room, however many members (and Peer.room fields) refer to it.
+    room = sys.intern(room)
+    while True:
+        p = PEERS.get(peer_id)
+        if not p:
+            return None, []
+        old_room = p.room
+        async with room_locks(old_room, room):
+            if p.room != old_room:
+                # Raced with another mutation of this peer; retry with fresh locks.
+                continue
+            if PEERS.get(peer_id) is not p:
+                return None, []
+
+            notices = []
+            if old_room and old_room != room:
+                _discard_member(old_room, peer_id)
+                notices.append(
+                    Notice(old_room, {"type": "peer-left", "peer_id": peer_id, "reason": "switched-room"}, peer_id)
+                )
+
+            p.room = room
+            p.name = name
+
+            # Taken before adding the joiner, so it is served from the cache.
+            roster = roster_page(room, exclude=peer_id)
+            members = _add_member(room, peer_id, name)
+            # Same as in later `roster` pages: the joiner counts.
+            roster.total = len(members)
+            BACKEND.member(peer_id, room, name)
+            journal.record("m", peer_id, room, name)
+
+            logger.info(
+                "peer joined peer_id=%s room=%s name_set=%s members=%s",
+                peer_id,
+                room,
+                bool(name),
+                len(members),
+            )
+
+            notices.append(Notice(room, {"type": "peer-joined", "peer": {"peer_id": peer_id, "name": name}}, peer_id))
+            return roster, notices
+
+
+async def leave_room(peer_id: str) -> Tuple[Optional[str], List[Notice]]:
+    """Take a peer out of its room.
+
+    Returns the room it left ("" if none, None if the peer is gone) and the
+    notices to deliver.
+    """
+
+    while True:
+        p = PEERS.get(peer_id)
+        if not p:
+            return None, []
+        room = p.room
+        async with room_locks(room):
+            if p.room != room:
+                continue
+            p.room = ""
+            if not room:
+                return "", []
+            _discard_member(room, peer_id)
+            BACKEND.member(peer_id, "", p.name)
+            journal.record("m", peer_id, "", p.name)
+            return room, [Notice(room, {"type": "peer-left", "peer_id": peer_id, "reason": "left"}, peer_id)]
+
+
+async def unregister_peer(peer_id: str, reason: str = "disconnect") -> List[Notice]:
+    """Drop a peer from server state; returns the notices to deliver."""
+
+    while True:
+        peer = PEERS.get(peer_id)
+        if not peer:
+            return []
+        room = peer.room
+        async with room_locks(room):
+            if PEERS.get(peer_id) is not peer:
+                return []
+            if peer.room != room:
+                continue
+            del PEERS[peer_id]
+            RESUME_TOKENS.pop(peer.resume_token, None)
+            snapshot.touch_peer(peer_id)
+            BACKEND.peer_down(peer_id, reason)
+            journal.record("d", peer_id)
+
+            logger.info("remove_peer peer_id=%s reason=%s room=%s", peer_id, reason, room)
+
+            if not room:
+                return []
+            _discard_member(room, peer_id)
+            return [Notice(room, {"type": "peer-left", "peer_id": peer_id, "reason": reason}, peer_id)]
+
+
+async def remove_peer(peer_id: str, reason: str = "disconnect") -> None:
+    """Remove peer from server state and notify room (no lock needed by the caller)."""
+
+    deliver(await unregister_peer(peer_id, reason=reason))
+
+
+metrics.REGISTRY.register(metrics.Gauge("vc_connections", "WebSocket connections on this process.", lambda: len(PEERS)))
+metrics.REGISTRY.register(metrics.Gauge("vc_rooms", "Rooms with at least one member.", lambda: len(ROOMS)))
+metrics.REGISTRY.register(
+    metrics.SampledHistogram(
+        "vc_room_size",
+        "Distribution of room sizes (members per room).",
+        metrics.SIZE_BUCKETS,
+        lambda: (len(members) for members in ROOMS.values()),
+    )
+)
 
 
 def validate_message(msg: Any) -> Optional[str]:
@@ -0,0 +1,234 @@
+"""Event-loop lag monitor, stall attribution and on-demand profiling.
+
+A beat task on the loop sleeps `LOOP_LAG_INTERVAL_MS` and records how late
+it wakes up (`vc_loop_lag_seconds`). A watchdog thread checks the beat: once
+it is `LOOP_STALL_MS` overdue, the loop is blocked right now, so the thread
+grabs the loop thread's Python stack (`sys._current_frames`). When the loop
+comes back, the stall is logged with its length and the code that was
+running, counted (`vc_loop_stalls_total`) and kept in a short ring.
+
+`profile` samples the loop thread's stack for a few seconds and returns
+collapsed stacks ("frame;frame;frame count" lines, root first), the input
+format of flamegraph.pl and speedscope. `task_summary` groups live asyncio
+tasks by coroutine (ws_endpoint, OutboundQueue._run, ...) with where they
+are waiting.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from types import FrameType
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import config
+from core import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _label(code: Any, lineno: Optional[int] = None) -> str:
+    filename = code.co_filename
+    if filename.startswith(_ROOT):
+        filename = os.path.relpath(filename, _ROOT)
+    else:
+        filename = os.path.basename(filename)
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({filename}:{lineno or code.co_firstlineno})"
+
+
+def collapse(frame: Optional[FrameType], limit: int = 128) -> List[str]:
+    """Labels of `frame` and its callers, outermost first."""
+
+    labels = []
+    while frame is not None and len(labels) < limit:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class LoopMonitor:
+    def __init__(self, interval: float, stall: float) -> None:
+        self.interval = interval
+        self.stall = stall
+        self.thread_id = 0
+        self.last_beat = 0.0
+        # Lateness of the most recent beat, in seconds (admission control, /ready).
+        self.lag = 0.0
+        # (beat, stack) grabbed by the watchdog thread for the current stall.
+        self._capture: Optional[Tuple[float, List[str]]] = None
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=20)
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self.thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._beat(), name="loop-monitor")
+        if self.stall > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        task = self._task
+        self._task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join, 1.0)
+            self._thread = None
+
+    async def _beat(self) -> None:
+        interval = self.interval
+        while True:
+            start = time.monotonic()
+            self.last_beat = start
+            await asyncio.sleep(interval)
+            lag = self.lag = max(0.0, time.monotonic() - start - interval)
+            metrics.LOOP_LAG.observe(lag)
+            if self.stall > 0 and lag >= self.stall:
+                self._stalled(start, lag)
+
+    def _stalled(self, beat: float, lag: float) -> None:
+        capture = self._capture
+        stack = capture[1] if capture is not None and capture[0] == beat else []
+        metrics.LOOP_STALLS.inc()
+        self.stalls.append({"ts": time.time(), "ms": round(lag * 1000.0, 1), "stack": stack})
+        logger.warning(
+            "event loop stalled %.0fms in %s",
+            lag * 1000.0,
+            " <- ".join(reversed(stack[-3:])) if stack else "unknown (no sample)",
+        )
+
+    def _watch(self) -> None:
+        poll = min(self.interval, self.stall) / 2.0
+        while not self._stop.wait(poll):
+            beat = self.last_beat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue < self.stall:
+                continue
+            capture = self._capture
+            if capture is not None and capture[0] == beat:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            self._capture = (beat, collapse(frame))
+            del frame
+
+
+MONITOR = LoopMonitor(config.LOOP_LAG_INTERVAL_MS / 1000.0, config.LOOP_STALL_MS / 1000.0)
+
+
+def start() -> None:
+    MONITOR.start()
+
+
+async def stop() -> None:
+    await MONITOR.stop()
+
+
+# -- on-demand profiling -------------------------------------------------------
+
+_PROFILE_LOCK = threading.Lock()
+
+
+def _sample(thread_id: int, seconds: float, interval: float) -> Tuple[Counter, int]:
+    stacks: Counter = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        stacks[";".join(collapse(frame))] += 1
+        del frame
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+async def profile(seconds: float, interval: float) -> Optional[str]:
+    """Collapsed stacks of the event loop thread over `seconds`; None if a profile is already running."""
+
+    if not _PROFILE_LOCK.acquire(blocking=False):
+        return None
+    try:
+        thread_id = MONITOR.thread_id or threading.get_ident()
+        stacks, samples = await asyncio.to_thread(_sample, thread_id, seconds, interval)
+    finally:
+        _PROFILE_LOCK.release()
+    logger.info("profile taken seconds=%s samples=%s stacks=%s", seconds, samples, len(stacks))
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+# -- task dump ------------------------------------------------------------------
+
+
+def _await_chain(coro: Any) -> List[FrameType]:
+    """Frames a suspended coroutine is waiting in, outermost first."""
+
+    chain = []
+    while coro is not None and len(chain) < 64:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        chain.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return chain
+
+
+def _is_ours(code: Any) -> bool:
+    return code.co_filename.startswith(_ROOT) and "site-packages" not in code.co_filename
+
+
+def task_summary(top: int = 5) -> Dict[str, Any]:
+    """Live tasks grouped by coroutine, each with the most common wait points.
+
+    A task is grouped under the outermost coroutine of this server in its
+    await chain (so a connection shows up as `ws_endpoint` rather than as
+    the server library's protocol task), else under its own coroutine.
+    """
+
+    groups: Dict[str, Dict[str, Any]] = {}
+    tasks = asyncio.all_tasks()
+    for task in tasks:
+        coro = task.get_coro()
+        chain = _await_chain(coro)
+        ours = next((f.f_code for f in chain if _is_ours(f.f_code)), None)
+        code = ours or getattr(coro, "cr_code", None) or getattr(coro, "gi_code", None)
+        if code is not None:
+            name = getattr(code, "co_qualname", code.co_name)
+        else:
+            name = getattr(coro, "__qualname__", type(coro).__name__)
+        group = groups.get(name)
+        if group is None:
+            group = groups[name] = {"count": 0, "waiting": Counter()}
+        group["count"] += 1
+        if chain:
+            innermost = chain[-1]
+            group["waiting"][_label(innermost.f_code, innermost.f_lineno)] += 1
+    ordered = sorted(groups.items(), key=lambda item: -item[1]["count"])
+    return {
+        "total": len(tasks),
+        "groups": [
+            {"coro": name, "count": g["count"], "waiting": [{"at": at, "count": n} for at, n in g["waiting"].most_common(top)]}
+            for name, g in ordered
+        ],
+    }
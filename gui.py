@@ -1,19 +1,27 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+import json
 import logging
+import os
 import sys
 import threading
-from typing import Optional
+import time
+from typing import List, Optional
 
 import uvicorn
 
 from app import app as fastapi_app
+from cli import uvicorn_ws_options
 from logging_config import setup_logging
 
 
 logger = logging.getLogger(__name__)
 
+# Seconds between stats lines from a server child.
+CHILD_STATS_INTERVAL_SEC = 1.0
+
 
 class UvicornThread:
     def __init__(self, host: str, port: int, log_level: str) -> None:
@@ -37,6 +45,7 @@ class UvicornThread:
             # we install (Qt handler). Uvicorn's default logging config can
             # replace handlers and prevent our UI from seeing its startup logs.
             log_config=None,
+            **uvicorn_ws_options(),
         )
         self._server = uvicorn.Server(config)
 
@@ -55,6 +64,94 @@ class UvicornThread:
             self._thread.join(timeout=timeout)
 
 
+# -- server child ----------------------------------------------------------
+
+
+def _std_stream(fd: int, mode: str):
+    """The std stream for `fd`; windowed builds start without sys.std* objects."""
+
+    current = {0: sys.stdin, 2: sys.stderr}[fd]
+    if current is not None:
+        return current
+    try:
+        return os.fdopen(fd, mode, buffering=1, encoding="utf-8")
+    except OSError:
+        return None
+
+
+async def _report_stats() -> None:
+    from core import metrics, state
+
+    stats_logger = logging.getLogger("vc.stats")
+    started = time.monotonic()
+    while True:
+        await asyncio.sleep(CHILD_STATS_INTERVAL_SEC)
+        stats = {
+            "pid": os.getpid(),
+            "uptime": round(time.monotonic() - started),
+            "peers": len(state.PEERS),
+            "rooms": len(state.ROOMS),
+            "messages": sum(metrics.MESSAGES.values.values()),
+            "log_dropped": sum(metrics.LOG_DROPPED.values.values()),
+        }
+        stats_logger.info("%s", json.dumps(stats, separators=(",", ":")))
+
+
+def run_server_child(host: str, port: int, log_level: Optional[str]) -> int:
+    """Serve in this process on behalf of a GUI parent (see ui.server).
+
+    Logs, and a stats line every CHILD_STATS_INTERVAL_SEC, go to stderr as
+    JSON lines from the queued logging thread. The server shuts down when
+    stdin is closed, which also covers the parent going away.
+    """
+
+    stderr = _std_stream(2, "w")
+    if stderr is not None:
+        sys.stderr = stderr
+    setup_logging(log_level, mode="queued", fmt="json")
+
+    config = uvicorn.Config(
+        fastapi_app,
+        host=host,
+        port=port,
+        log_level=(log_level or "info").lower(),
+        log_config=None,
+        **uvicorn_ws_options(),
+    )
+    server = uvicorn.Server(config)
+
+    def _watch_parent() -> None:
+        stdin = _std_stream(0, "r")
+        if stdin is None:
+            return
+        for _ in stdin:
+            pass
+        server.should_exit = True
+
+    threading.Thread(target=_watch_parent, name="parent-watch", daemon=True).start()
+
+    async def _serve() -> None:
+        stats = asyncio.create_task(_report_stats(), name="child-stats")
+        try:
+            await server.serve()
+        finally:
+            stats.cancel()
+
+    asyncio.run(_serve())
+    return 0
+
+
+def _child_command(args: argparse.Namespace) -> List[str]:
+    if getattr(sys, "frozen", False):
+        command = [sys.executable]
+    else:
+        command = [sys.executable, os.path.abspath(__file__)]
+    command += ["--server-child", "--host", str(args.host), "--port", str(args.port)]
+    if args.log_level:
+        command += ["--log-level", str(args.log_level)]
+    return command
+
+
 def main(argv: list[str] | None = None) -> int:
     parser = argparse.ArgumentParser(description="Tiny WebRTC signaling server (GUI)")
     parser.add_argument("--host", default="0.0.0.0")
@@ -64,14 +161,26 @@ def main(argv: list[str] | None = None) -> int:
         default=None,
         help="Logging level (debug, info, warning, error). Can also use VC_SERVER_LOG_LEVEL or VC_LOG_LEVEL.",
     )
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run the server in a thread of the GUI process instead of a child process.",
+    )
+    parser.add_argument("--server-child", action="store_true", help=argparse.SUPPRESS)
     args = parser.parse_args(argv)
 
+    if args.server_child:
+        return run_server_child(str(args.host), int(args.port), args.log_level)
+
     setup_logging(args.log_level)
     effective_level = (args.log_level or "info").lower()
 
     try:
+        from PySide6 import QtWidgets
+
         from ui.app import create_qt_app
-        from ui.logging import LogBridge, install_qt_log_handler
+        from ui.logging import LogBuffer, install_qt_log_handler
+        from ui.server import ServerProcess
         from ui.windows import LogWindow
     except Exception as e:
         print(f"Failed to import UI dependencies: {e}")
@@ -80,38 +189,70 @@ def main(argv: list[str] | None = None) -> int:
 
     qt_app = create_qt_app()
 
-    bridge = LogBridge()
-    handler = install_qt_log_handler(bridge)
+    log_buffer = LogBuffer()
+    handler = install_qt_log_handler(log_buffer)
     handler.setLevel(logging.DEBUG)
 
-    # When uvicorn's `log_config` is disabled, it won't configure its own
-    # logger levels. Ensure we don't accidentally suppress its startup INFO logs.
-    level_map = {
-        "critical": logging.CRITICAL,
-        "error": logging.ERROR,
-        "warning": logging.WARNING,
-        "warn": logging.WARNING,
-        "info": logging.INFO,
-        "debug": logging.DEBUG,
-        "trace": logging.DEBUG,
-    }
-    uvicorn_level = level_map.get(effective_level, logging.INFO)
-    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
-        logging.getLogger(name).setLevel(uvicorn_level)
-
-    window = LogWindow()
-    bridge.log.connect(window.append_log)
-
-    server = UvicornThread(host=str(args.host), port=int(args.port), log_level=effective_level)
-    server.start()
+    window = LogWindow(log_buffer)
+
+    if args.in_process:
+        # When uvicorn's `log_config` is disabled, it won't configure its own
+        # logger levels. Ensure we don't accidentally suppress its startup INFO logs.
+        level_map = {
+            "critical": logging.CRITICAL,
+            "error": logging.ERROR,
+            "warning": logging.WARNING,
+            "warn": logging.WARNING,
+            "info": logging.INFO,
+            "debug": logging.DEBUG,
+            "trace": logging.DEBUG,
+        }
+        uvicorn_level = level_map.get(effective_level, logging.INFO)
+        for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+            logging.getLogger(name).setLevel(uvicorn_level)
+
+        server = UvicornThread(host=str(args.host), port=int(args.port), log_level=effective_level)
+        server.start()
+
+        def _shutdown() -> None:
+            logger.info("server ui shutdown")
+            server.stop()
+
+    else:
+        command = _child_command(args)
+        child = ServerProcess(command[0], command[1:], log_buffer, parent=window)
+
+        toolbar = window.addToolBar("Server")
+        start_action = toolbar.addAction("Start", child.start)
+        stop_action = toolbar.addAction("Stop", child.stop)
+        toolbar.addAction("Restart", child.restart)
+        status = QtWidgets.QLabel("server: stopped", window)
+        window.statusBar().addWidget(status)
+
+        def _state_changed(state: str) -> None:
+            status.setText(f"server: {state}")
+            start_action.setEnabled(state == "stopped")
+            stop_action.setEnabled(state in ("starting", "running"))
+
+        def _stats(stats: dict) -> None:
+            if child.state == "running":
+                status.setText(
+                    "server: running pid={pid} peers={peers} rooms={rooms} messages={messages} uptime={uptime}s".format_map(
+                        {k: stats.get(k, "?") for k in ("pid", "peers", "rooms", "messages", "uptime")}
+                    )
+                )
+
+        child.state_changed.connect(_state_changed)
+        child.stats.connect(_stats)
+        child.start()
+
+        def _shutdown() -> None:
+            logger.info("server ui shutdown")
+            child.shutdown()
 
     logger.info("server ui started host=%s port=%s", args.host, args.port)
     window.show()
 
-    def _shutdown() -> None:
-        logger.info("server ui shutdown")
-        server.stop()
-
     qt_app.aboutToQuit.connect(_shutdown)
     return qt_app.exec()
 
@@ -1,24 +1,251 @@
 from __future__ import annotations
 
+import atexit
+import json
 import logging
+import logging.handlers
 import os
-from typing import Optional
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
 
+import config
+from core import metrics
 
-def setup_logging(level: Optional[str] = None) -> None:
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Running listener in "queued" mode (handlers added later go here).
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+
+
+class _SampleRule:
+    __slots__ = ("every", "rate", "seen", "tokens", "stamp", "suppressed")
+
+    def __init__(self, every: int, rate: float) -> None:
+        self.every = max(1, int(every))
+        self.rate = float(rate)
+        self.seen = 0
+        self.tokens = self.rate
+        self.stamp = time.monotonic()
+        self.suppressed = 0
+
+    def keep(self) -> Optional[str]:
+        """None to keep the record, else the drop reason."""
+
+        self.seen += 1
+        if self.seen % self.every:
+            return "sampled"
+        if self.rate > 0:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens < 1.0:
+                return "rate"
+            self.tokens -= 1.0
+        return None
+
+
+class SamplingFilter(logging.Filter):
+    """Sampling and rate caps for hot-path log events (`config.LOG_SAMPLING`).
+
+    Records are matched on their message template (`record.msg`) by prefix;
+    the match is cached per template, so the common case is one dict lookup.
+    A record let through after others of its kind were dropped carries the
+    count as `suppressed`.
+    """
+
+    _CACHE_MAX = 4096
+
+    def __init__(self, rules: Optional[Dict[str, Tuple[int, float]]] = None) -> None:
+        super().__init__()
+        rules = config.LOG_SAMPLING if rules is None else rules
+        self._rules = {prefix: _SampleRule(every, rate) for prefix, (every, rate) in rules.items()}
+        self._by_template: Dict[Any, Optional[_SampleRule]] = {}
+        self._lock = threading.Lock()
+
+    def _rule(self, template: Any) -> Optional[_SampleRule]:
+        try:
+            return self._by_template[template]
+        except (KeyError, TypeError):
+            pass
+        rule = None
+        if isinstance(template, str):
+            for prefix, candidate in self._rules.items():
+                if template.startswith(prefix):
+                    rule = candidate
+                    break
+            if len(self._by_template) < self._CACHE_MAX:
+                self._by_template[template] = rule
+        return rule
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rule = self._rule(record.msg)
+        if rule is None:
+            return True
+        with self._lock:
+            reason = rule.keep()
+            if reason is not None:
+                rule.suppressed += 1
+            else:
+                suppressed, rule.suppressed = rule.suppressed, 0
+        if reason is not None:
+            metrics.LOG_DROPPED.inc(reason)
+            return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class SuppressedCountFormatter(logging.Formatter):
+    """Text format; appends how many similar records were dropped before this one."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (+{suppressed} similar suppressed)"
+        return text
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg (+ suppressed, exc)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks or formats on the logging thread.
+
+    When the queue is full the record is dropped and counted instead.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens in the listener thread; the record goes as is.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPPED.inc("queue-full")
+
+
+def _formatter(fmt: str) -> logging.Formatter:
+    if fmt == "json":
+        return JsonLinesFormatter()
+    return SuppressedCountFormatter(TEXT_FORMAT)
+
+
+def queued() -> bool:
+    return _LISTENER is not None
+
+
+def add_handler(handler: logging.Handler) -> None:
+    """Attach an output handler: to the background listener if logging is queued."""
+
+    listener = _LISTENER
+    if listener is not None:
+        if handler not in listener.handlers:
+            listener.handlers = listener.handlers + (handler,)
+    else:
+        logging.getLogger().addHandler(handler)
+
+
+def handlers() -> Tuple[logging.Handler, ...]:
+    """Output handlers currently installed (listener's or root's)."""
+
+    listener = _LISTENER
+    if listener is not None:
+        return tuple(listener.handlers)
+    return tuple(logging.getLogger().handlers)
+
+
+def setup_logging(level: Optional[str] = None, mode: Optional[str] = None, fmt: Optional[str] = None) -> None:
     """Configure stdlib logging for the server.
 
+    mode "queued" (default; `VC_SERVER_LOG_MODE`): the root logger only has a
+    queue handler, filtered by `SamplingFilter`; a listener thread formats and
+    writes, so log I/O never runs on the event loop. mode "sync": plain
+    handlers on the root logger.
+
+    fmt "text" (default) or "json" for JSON lines (`VC_SERVER_LOG_FORMAT`).
+
     Uvicorn often configures logging itself; in that case we avoid overriding
     handlers and only ensure the root logger has a sensible level.
     """
 
+    global _LISTENER
+
     effective_level = (level or os.environ.get("VC_SERVER_LOG_LEVEL") or os.environ.get("VC_LOG_LEVEL") or "INFO").upper()
+    mode = (mode or os.environ.get("VC_SERVER_LOG_MODE") or "queued").lower()
+    fmt = (fmt or os.environ.get("VC_SERVER_LOG_FORMAT") or "text").lower()
 
     root = logging.getLogger()
-    if not root.handlers:
-        logging.basicConfig(
-            level=effective_level,
-            format="%(asctime)s %(levelname)s %(name)s: %(message)s",
-        )
-    else:
-        root.setLevel(effective_level)
+    root.setLevel(effective_level)
+    if root.handlers:
+        return
+
+    output = logging.StreamHandler()
+    output.setFormatter(_formatter(fmt))
+
+    if mode != "queued":
+        output.addFilter(SamplingFilter())
+        root.addHandler(output)
+        return
+
+    q: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=config.LOG_QUEUE_MAX)
+    handler = DroppingQueueHandler(q)
+    handler.addFilter(SamplingFilter())
+    root.addHandler(handler)
+
+    listener = logging.handlers.QueueListener(q, output, respect_handler_level=True)
+    listener.start()
+    _LISTENER = listener
+    atexit.register(stop_logging)
+
+
+def worker_handler() -> logging.Handler:
+    """dictConfig factory behind `worker_log_config`: sets up this process's logging."""
+
+    setup_logging()
+    return logging.NullHandler()
+
+
+def worker_log_config() -> Dict[str, Any]:
+    """uvicorn `log_config` for `--workers`: each worker runs `setup_logging`.
+
+    uvicorn applies it with dictConfig in every worker process it spawns,
+    before the app is imported. Level, mode and format come from the
+    environment (`VC_SERVER_LOG_*`); uvicorn's own loggers propagate to the
+    root handlers.
+    """
+
+    return {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "handlers": {"setup": {"()": "logging_config.worker_handler"}},
+    }
+
+
+def stop_logging() -> None:
+    """Flush and stop the background listener (if any)."""
+
+    global _LISTENER
+    listener = _LISTENER
+    _LISTENER = None
+    if listener is not None:
+        listener.stop()
@@ -1,18 +1,53 @@
 from __future__ import annotations
 
 import logging
+import threading
+from collections import deque
+from typing import Deque, List, NamedTuple, Tuple
 
-from PySide6 import QtCore
+import logging_config
 
 
-class LogBridge(QtCore.QObject):
-    log = QtCore.Signal(str)
+class LogEntry(NamedTuple):
+    levelno: int
+    name: str
+    line: str
 
 
-class QtSignalLogHandler(logging.Handler):
-    def __init__(self, bridge: LogBridge):
+class LogBuffer:
+    """Hands log lines from any thread to the UI thread.
+
+    Producers append; the log window drains everything pending on its flush
+    timer, so a burst of records costs one widget update instead of one Qt
+    signal each. Bounded: under a flood the oldest pending lines are dropped
+    (and counted) rather than piling up in memory.
+    """
+
+    def __init__(self, maxlen: int = 20000) -> None:
+        self._pending: Deque[LogEntry] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._dropped = 0
+
+    def append(self, entry: LogEntry) -> None:
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped += 1
+            self._pending.append(entry)
+
+    def drain(self) -> Tuple[List[LogEntry], int]:
+        """Pending entries and how many were dropped since the last drain."""
+
+        with self._lock:
+            entries = list(self._pending)
+            self._pending.clear()
+            dropped, self._dropped = self._dropped, 0
+        return entries, dropped
+
+
+class BufferedLogHandler(logging.Handler):
+    def __init__(self, buffer: LogBuffer):
         super().__init__()
-        self._bridge = bridge
+        self._buffer = buffer
 
     def emit(self, record: logging.LogRecord) -> None:
         try:
@@ -20,9 +55,8 @@ class QtSignalLogHandler(logging.Handler):
         except Exception:
             msg = record.getMessage()
 
-        # Emitting from non-UI threads is OK; Qt will queue delivery.
         try:
-            self._bridge.log.emit(msg)
+            self._buffer.append(LogEntry(record.levelno, record.name, msg))
         except Exception:
             # Never let logging crash the app.
             pass
@@ -43,35 +77,38 @@ class DisplayNameFormatter(logging.Formatter):
         if mapped:
             record.name = mapped
         try:
-            return super().format(record)
+            text = super().format(record)
         finally:
             record.name = original_name
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (+{suppressed} similar suppressed)"
+        return text
 
 
-def install_qt_log_handler(bridge: LogBridge, level: str | int | None = None) -> QtSignalLogHandler:
-    root = logging.getLogger()
-
+def install_qt_log_handler(buffer: LogBuffer, level: str | int | None = None) -> BufferedLogHandler:
     # If we already installed one (e.g. hot-reload / repeated startup), reuse it.
-    for existing in list(root.handlers):
-        if isinstance(existing, QtSignalLogHandler):
+    for existing in logging_config.handlers():
+        if isinstance(existing, BufferedLogHandler):
             return existing
 
-    handler = QtSignalLogHandler(bridge)
+    handler = BufferedLogHandler(buffer)
     handler.setFormatter(DisplayNameFormatter(fmt="%(asctime)s %(levelname)s %(name)s: %(message)s"))
 
     if level is not None:
         handler.setLevel(level)
 
-    root.addHandler(handler)
+    # With queued logging this runs on the listener thread, off the server loop.
+    logging_config.add_handler(handler)
 
     # Uvicorn logs via `uvicorn.*` loggers. We rely on propagation to the root
     # handler (installed above) to avoid duplicate entries.
     for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
         lg = logging.getLogger(name)
         lg.propagate = True
-        # If a previous run attached Qt handlers directly, remove them.
+        # If a previous run attached our handlers directly, remove them.
         for h in list(lg.handlers):
-            if isinstance(h, QtSignalLogHandler):
+            if isinstance(h, BufferedLogHandler):
                 lg.removeHandler(h)
 
     return handler
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from PySide6 import QtCore
+
+from ui.logging import LogBuffer, LogEntry
+
+
+# Logger the server child uses for its periodic stats lines.
+STATS_LOGGER = "vc.stats"
+
+_DISPLAY_NAMES = {"uvicorn.error": "uvicorn"}
+
+
+def _format_entry(entry: Dict[str, Any]) -> LogEntry:
+    ts = float(entry.get("ts") or time.time())
+    level = str(entry.get("level", "INFO"))
+    name = str(entry.get("logger", "server"))
+    asctime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)) + f",{int(ts % 1 * 1000):03d}"
+    line = f"{asctime} {level} {_DISPLAY_NAMES.get(name, name)}: {entry.get('msg', '')}"
+    if entry.get("suppressed"):
+        line += f" (+{entry['suppressed']} similar suppressed)"
+    if entry.get("exc"):
+        line += "\n" + str(entry["exc"])
+    levelno = logging.getLevelName(level)
+    return LogEntry(levelno if isinstance(levelno, int) else logging.INFO, name, line)
+
+
+class ServerProcess(QtCore.QObject):
+    """The signaling server as a child process of the GUI.
+
+    The child (`gui.py --server-child`) writes its logs as JSON lines to
+    stderr through the queued logging pipeline; they are read here on the Qt
+    event loop and handed to the log buffer. If the UI stalls, the pipe fills
+    and the child drops log lines in its log thread; its event loop never
+    waits on us. Closing the child's stdin asks it to shut down gracefully.
+    """
+
+    state_changed = QtCore.Signal(str)  # "starting" | "running" | "stopping" | "stopped"
+    stats = QtCore.Signal(dict)
+
+    def __init__(self, program: str, arguments: List[str], buffer: LogBuffer, parent: Optional[QtCore.QObject] = None) -> None:
+        super().__init__(parent)
+        self._program = program
+        self._arguments = arguments
+        self._buffer = buffer
+        self._partial = b""
+        self._restart = False
+        self.state = "stopped"
+
+        self._process = QtCore.QProcess(self)
+        self._process.setProcessChannelMode(QtCore.QProcess.ProcessChannelMode.SeparateChannels)
+        self._process.readyReadStandardError.connect(self._read_logs)
+        self._process.readyReadStandardOutput.connect(self._read_output)
+        self._process.started.connect(lambda: self._set_state("running"))
+        self._process.finished.connect(self._finished)
+        self._process.errorOccurred.connect(self._error)
+
+        self._kill_timer = QtCore.QTimer(self)
+        self._kill_timer.setSingleShot(True)
+        self._kill_timer.timeout.connect(self._process.kill)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        self.state_changed.emit(state)
+
+    def _note(self, level: int, msg: str) -> None:
+        self._buffer.append(_format_entry({"ts": time.time(), "level": logging.getLevelName(level), "logger": "gui", "msg": msg}))
+
+    # -- control ------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._process.state() != QtCore.QProcess.ProcessState.NotRunning:
+            return
+        self._partial = b""
+        self._set_state("starting")
+        self._process.start(self._program, self._arguments)
+
+    def stop(self, timeout_ms: int = 5000) -> None:
+        """Ask the child to exit; it is killed if still running after `timeout_ms`."""
+
+        if self._process.state() == QtCore.QProcess.ProcessState.NotRunning:
+            return
+        self._set_state("stopping")
+        self._process.closeWriteChannel()
+        self._kill_timer.start(timeout_ms)
+
+    def restart(self) -> None:
+        if self._process.state() == QtCore.QProcess.ProcessState.NotRunning:
+            self.start()
+            return
+        self._restart = True
+        self.stop()
+
+    def shutdown(self, timeout_ms: int = 5000) -> None:
+        """Stop and wait for the child (used when the GUI quits)."""
+
+        self._restart = False
+        self.stop(timeout_ms)
+        if not self._process.waitForFinished(timeout_ms):
+            self._process.kill()
+            self._process.waitForFinished(1000)
+
+    # -- child output ---------------------------------------------------------
+
+    def _read_logs(self) -> None:
+        data = self._partial + bytes(self._process.readAllStandardError().data())
+        *lines, self._partial = data.split(b"\n")
+        for raw in lines:
+            text = raw.decode("utf-8", "replace").rstrip("\r")
+            if not text:
+                continue
+            try:
+                entry = json.loads(text)
+            except ValueError:
+                entry = None
+            if not isinstance(entry, dict):
+                # Output from before logging was set up (e.g. an import error).
+                self._buffer.append(LogEntry(logging.WARNING, "server", text))
+                continue
+            if entry.get("logger") == STATS_LOGGER:
+                try:
+                    self.stats.emit(json.loads(entry.get("msg", "")))
+                except ValueError:
+                    pass
+                continue
+            self._buffer.append(_format_entry(entry))
+
+    def _read_output(self) -> None:
+        for raw in bytes(self._process.readAllStandardOutput().data()).splitlines():
+            text = raw.decode("utf-8", "replace").rstrip()
+            if text:
+                self._buffer.append(LogEntry(logging.INFO, "server", text))
+
+    def _finished(self, exit_code: int, exit_status: QtCore.QProcess.ExitStatus) -> None:
+        self._kill_timer.stop()
+        self._read_logs()
+        crashed = exit_status == QtCore.QProcess.ExitStatus.CrashExit
+        self._note(logging.WARNING if crashed or exit_code else logging.INFO, f"server process exited code={exit_code}{' (killed)' if crashed else ''}")
+        self._set_state("stopped")
+        if self._restart:
+            self._restart = False
+            self.start()
+
+    def _error(self, error: QtCore.QProcess.ProcessError) -> None:
+        if error == QtCore.QProcess.ProcessError.FailedToStart:
+            self._note(logging.ERROR, f"server process failed to start: {self._process.errorString()}")
+            self._set_state("stopped")
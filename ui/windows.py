@@ -1,18 +1,169 @@
 from __future__ import annotations
 
-from PySide6 import QtWidgets
+import logging
+from collections import deque
+from typing import Deque, Iterable
+
+from PySide6 import QtCore, QtGui, QtWidgets
+
+from ui.logging import LogBuffer, LogEntry
+
+
+# Lines kept by the viewer (older ones scroll out) and how often it takes
+# pending lines from the log buffer.
+LOG_VIEW_MAX_LINES = 5000
+LOG_FLUSH_INTERVAL_MS = 100
+
+_LEVELS = (
+    ("All", logging.NOTSET),
+    ("Info", logging.INFO),
+    ("Warning", logging.WARNING),
+    ("Error", logging.ERROR),
+)
 
 
 class LogWindow(QtWidgets.QMainWindow):
-    def __init__(self) -> None:
+    """Log viewer fed from a `LogBuffer`.
+
+    Lines are appended in one batch per flush tick to a plain-text view
+    capped at `LOG_VIEW_MAX_LINES`. The same number of entries is kept in a
+    ring, so changing the level or logger filter re-renders at most that
+    many lines; search moves through the view without re-rendering.
+    """
+
+    def __init__(self, buffer: LogBuffer) -> None:
         super().__init__()
         self.setWindowTitle("Tiny Signaling Server")
 
-        self._text = QtWidgets.QTextEdit(self)
+        self._buffer = buffer
+        self._entries: Deque[LogEntry] = deque(maxlen=LOG_VIEW_MAX_LINES)
+        self._min_level = logging.NOTSET
+        self._logger_filter = ""
+        self._dropped = 0
+
+        self._text = QtWidgets.QPlainTextEdit(self)
         self._text.setReadOnly(True)
-        self.setCentralWidget(self._text)
+        self._text.setUndoRedoEnabled(False)
+        self._text.setLineWrapMode(QtWidgets.QPlainTextEdit.LineWrapMode.NoWrap)
+        self._text.setMaximumBlockCount(LOG_VIEW_MAX_LINES)
+        self._text.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.SystemFont.FixedFont))
+
+        self._level = QtWidgets.QComboBox(self)
+        for label, level in _LEVELS:
+            self._level.addItem(label, level)
+        self._level.currentIndexChanged.connect(self._filters_changed)
+
+        self._logger = QtWidgets.QLineEdit(self)
+        self._logger.setPlaceholderText("logger (e.g. api.ws, core)")
+        self._logger.setClearButtonEnabled(True)
+        self._logger.editingFinished.connect(self._filters_changed)
+
+        self._search = QtWidgets.QLineEdit(self)
+        self._search.setPlaceholderText("search (Enter: next, Shift+Enter: previous)")
+        self._search.setClearButtonEnabled(True)
+        self._search.returnPressed.connect(self.find_next)
+        QtGui.QShortcut(QtGui.QKeySequence("Shift+Return"), self._search, self.find_previous)
+        QtGui.QShortcut(QtGui.QKeySequence.StandardKey.Find, self, self._search.setFocus)
+
+        clear = QtWidgets.QPushButton("Clear", self)
+        clear.clicked.connect(self.clear)
+
+        bar = QtWidgets.QHBoxLayout()
+        bar.addWidget(QtWidgets.QLabel("Level:", self))
+        bar.addWidget(self._level)
+        bar.addWidget(self._logger, 1)
+        bar.addWidget(self._search, 2)
+        bar.addWidget(clear)
+
+        central = QtWidgets.QWidget(self)
+        layout = QtWidgets.QVBoxLayout(central)
+        layout.setContentsMargins(4, 4, 4, 4)
+        layout.addLayout(bar)
+        layout.addWidget(self._text)
+        self.setCentralWidget(central)
+
+        self._status = QtWidgets.QLabel(self)
+        self.statusBar().addPermanentWidget(self._status)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(LOG_FLUSH_INTERVAL_MS)
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
 
         self.resize(900, 600)
 
-    def append_log(self, line: str) -> None:
-        self._text.append(line)
+    # -- feeding ------------------------------------------------------------
+
+    def flush(self) -> None:
+        """Move pending lines from the buffer into the view (one batch)."""
+
+        entries, dropped = self._buffer.drain()
+        if dropped:
+            self._dropped += dropped
+            self._update_status()
+        if not entries:
+            return
+        self._entries.extend(entries)
+        lines = [e.line for e in entries[-LOG_VIEW_MAX_LINES:] if self._accepts(e)]
+        if lines:
+            self._append(lines)
+        self._update_status()
+
+    def _append(self, lines: Iterable[str]) -> None:
+        scroll = self._text.verticalScrollBar()
+        at_bottom = scroll.value() >= scroll.maximum() - 2
+        # One appendPlainText call for the batch; the block limit trims the top.
+        self._text.appendPlainText("\n".join(lines))
+        if at_bottom:
+            scroll.setValue(scroll.maximum())
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._text.clear()
+        self._dropped = 0
+        self._update_status()
+
+    # -- filtering ----------------------------------------------------------
+
+    def _accepts(self, entry: LogEntry) -> bool:
+        if entry.levelno < self._min_level:
+            return False
+        prefixes = self._logger_filter
+        return not prefixes or entry.name.startswith(prefixes)
+
+    def _filters_changed(self) -> None:
+        self._min_level = int(self._level.currentData())
+        names = tuple(p.strip() for p in self._logger.text().split(",") if p.strip())
+        self._logger_filter = names or ""
+        self._text.setPlainText("\n".join(e.line for e in self._entries if self._accepts(e)))
+        scroll = self._text.verticalScrollBar()
+        scroll.setValue(scroll.maximum())
+        self._update_status()
+
+    def _update_status(self) -> None:
+        text = f"{self._text.blockCount() if self._entries else 0} shown / {len(self._entries)} kept"
+        if self._dropped:
+            text += f" / {self._dropped} dropped"
+        self._status.setText(text)
+
+    # -- search -------------------------------------------------------------
+
+    def find_next(self) -> None:
+        self._find(QtGui.QTextDocument.FindFlag(0))
+
+    def find_previous(self) -> None:
+        self._find(QtGui.QTextDocument.FindFlag.FindBackward)
+
+    def _find(self, flags: QtGui.QTextDocument.FindFlag) -> None:
+        needle = self._search.text()
+        if not needle:
+            return
+        if self._text.find(needle, flags):
+            return
+        # Wrap around.
+        cursor = self._text.textCursor()
+        backward = bool(flags & QtGui.QTextDocument.FindFlag.FindBackward)
+        cursor.movePosition(QtGui.QTextCursor.MoveOperation.End if backward else QtGui.QTextCursor.MoveOperation.Start)
+        self._text.setTextCursor(cursor)
+        if not self._text.find(needle, flags):
+            self.statusBar().showMessage(f"not found: {needle}", 2000)